@@ -1,4 +1,4 @@
-import nest
+import time
 
 # simulation parameters
 simtime = 1000.            # simulation time (ms)
@@ -32,54 +32,101 @@ neuron_params = {
 }
 
 # external input parameters
+nu_ratio = 2.0             # external rate relative to threshold rate
 nu_th = V_th / (w * tau_m) # external rate needed to evoke activity (spikes/ms)
-nu_ex = 2.0 * nu_th        # set external rate above threshold
+nu_ex = nu_ratio * nu_th   # set external rate above threshold
 p_rate = 1e3 * nu_ex       # external rate (spikes/s)
 
-# configure kernel
-nest.ResetKernel()
-nest.SetKernelStatus({
-    'resolution': dt,      # set simulation resolution
-    'print_time': True,    # enable printing of simulation progress (-> terminal)
-    'local_num_threads': 2 # use two threads to build & simulate the network
-})
-
-# set default parameters for neurons and create neurons
-nest.SetDefaults('iaf_psc_delta', neuron_params)
-neurons_e = nest.Create('iaf_psc_delta', NE)
-neurons_i = nest.Create('iaf_psc_delta', NI)
-
-# create poisson generator and set 'rate' to p_rate
-pgen = nest.Create('poisson_generator', params={'rate': p_rate})
-
-# create spike detectors
-spikes_e = nest.Create('spike_recorder')
-spikes_i = nest.Create('spike_recorder')
-
-# create excitatory connections
-
-# synapse specification
-syn_exc = {'delay': d, 'weight': w}
-# connection specification
-conn_exc = {'rule': 'fixed_indegree', 'indegree': CE}
-# connect stuff
-nest.Connect(neurons_e, neurons_e, conn_exc, syn_exc)
-nest.Connect(neurons_e, neurons_i, conn_exc, syn_exc)
-
-# create inhibitory connections
-
-# synapse specification
-syn_inh = {'delay': d, 'weight': - g * w}
-# connection specification
-conn_inh = {'rule': 'fixed_indegree', 'indegree': CI}
-# connect stuff
-nest.Connect(neurons_i, neurons_e, conn_inh, syn_inh)
-nest.Connect(neurons_i, neurons_i, conn_inh, syn_inh)
-
-# connect poisson generator using the excitatory connection weight
-nest.Connect(pgen, neurons_i, syn_spec=syn_exc)
-nest.Connect(pgen, neurons_e, syn_spec=syn_exc)
-
-# connect poisson generator using the excitatory connection weight
-nest.Connect(pgen, neurons_i, syn_spec=syn_exc)
-nest.Connect(pgen, neurons_e, syn_spec=syn_exc)
\ No newline at end of file
+
+def build_brunel(NE=NE, gamma=gamma, CE=CE, g=g, nu_ratio=nu_ratio, threads=2, record=N_rec, scale=1., w=w, d=d,
+                 dt=dt, print_time=True, seed=None):
+    """
+    Builds the Brunel network (sparsely connected E/I populations of `iaf_psc_delta` neurons driven by Poisson
+    input) in a freshly reset kernel. Nothing is built when this module is imported.
+
+    `scale` multiplies the population sizes and indegrees and divides the weights, so the mean recurrent and external
+    input (and thus the operating point) stay the same while the network shrinks or grows.
+
+    :param NE: number of excitatory neurons
+    :param gamma: relative number of inhibitory neurons and connections
+    :param CE: indegree from excitatory neurons
+    :param g: relative inhibitory to excitatory synaptic weight
+    :param nu_ratio: external rate relative to the rate needed to reach threshold
+    :param threads: number of threads (local_num_threads)
+    :param record: number of neurons per population to record spikes from, 'all' or None for no recorders
+    :param scale: scaling factor of the network size
+    :param w: excitatory synaptic weight (mV)
+    :param d: synaptic transmission delay (ms)
+    :param dt: simulation resolution (ms)
+    :param print_time: print the simulation progress
+    :param seed: seed of the NEST random number generators (None for the default seed)
+    :return: dictionary with the populations ('neurons_e', 'neurons_i'), the Poisson generator ('pgen'), the spike
+             recorders ('spikes_e', 'spikes_i', None if not recording), the effective parameters ('params') and the
+             wall-clock times of node creation and connection ('times')
+    """
+    import nest
+
+    NE = int(round(NE * scale))
+    NI = int(round(gamma * NE))
+    CE = int(round(CE * scale))
+    CI = int(round(gamma * CE))
+    w = w / scale
+
+    # external rate needed to evoke activity, for the rescaled weight (spikes/ms)
+    nu_th = V_th / (w * tau_m)
+    p_rate = 1e3 * nu_ratio * nu_th
+
+    # configure kernel
+    nest.ResetKernel()
+    nest.SetKernelStatus({
+        'resolution': dt,             # set simulation resolution
+        'print_time': print_time,     # enable printing of simulation progress (-> terminal)
+        'local_num_threads': threads  # number of threads to build & simulate the network
+    })
+    if seed is not None:
+        nest.rng_seed = seed
+
+    # set default parameters for neurons and create neurons
+    start = time.perf_counter()
+    nest.SetDefaults('iaf_psc_delta', neuron_params)
+    neurons_e = nest.Create('iaf_psc_delta', NE)
+    neurons_i = nest.Create('iaf_psc_delta', NI)
+
+    # create poisson generator and set 'rate' to p_rate
+    pgen = nest.Create('poisson_generator', params={'rate': p_rate})
+
+    # create spike recorders
+    spikes_e = spikes_i = None
+    if record is not None:
+        spikes_e = nest.Create('spike_recorder')
+        spikes_i = nest.Create('spike_recorder')
+    create_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # create excitatory connections
+    syn_exc = {'delay': d, 'weight': w}
+    conn_exc = {'rule': 'fixed_indegree', 'indegree': CE}
+    nest.Connect(neurons_e, neurons_e, conn_exc, syn_exc)
+    nest.Connect(neurons_e, neurons_i, conn_exc, syn_exc)
+
+    # create inhibitory connections
+    syn_inh = {'delay': d, 'weight': - g * w}
+    conn_inh = {'rule': 'fixed_indegree', 'indegree': CI}
+    nest.Connect(neurons_i, neurons_e, conn_inh, syn_inh)
+    nest.Connect(neurons_i, neurons_i, conn_inh, syn_inh)
+
+    # connect poisson generator (once) using the excitatory connection weight
+    nest.Connect(pgen, neurons_e, syn_spec=syn_exc)
+    nest.Connect(pgen, neurons_i, syn_spec=syn_exc)
+
+    # connect spike recorders
+    if record is not None:
+        for neurons, recorder in ((neurons_e, spikes_e), (neurons_i, spikes_i)):
+            nest.Connect(neurons if record == 'all' else neurons[:min(record, len(neurons))], recorder)
+    connect_time = time.perf_counter() - start
+
+    params = {'NE': NE, 'NI': NI, 'CE': CE, 'CI': CI, 'w': w, 'g': g, 'd': d, 'nu_ratio': nu_ratio,
+              'p_rate': p_rate, 'threads': threads, 'scale': scale}
+
+    return {'neurons_e': neurons_e, 'neurons_i': neurons_i, 'pgen': pgen, 'spikes_e': spikes_e,
+            'spikes_i': spikes_i, 'params': params, 'times': {'create': create_time, 'connect': connect_time}}
@@ -253,64 +253,37 @@ plt.ylim(NE, NE+NI)
 senders = spikes_e.events['senders']
 spikes = spikes_e.events['times']
 
-import numpy as np
-def instantaneous_rate(global_ids, spikes, senders, t, bin_width = 100):
-    
-    window = [t - bin_width / 2, t + bin_width / 2]
-    rates = np.empty(len(global_ids))
-    
-    for i, global_id in enumerate(global_ids):
-        spikes_id = spikes[senders == global_id]
-        rates[i] = np.sum((window[0] < spikes_id) * (spikes_id < window[1]))
-    
-    return rates / bin_width * 1e3
-
-
 # +
-import matplotlib.animation as animation
-     
-def update_plot(i, data, scat, time):
-    scat.set_array(data[i])
-    plt.title(f'Instantaneous firing rate\n elapsed time: {int(time[i])} ms')
-    return scat,
+import numpy as np
+from layer_positions import LayerPositions
+from rates import BinnedSpikes
+from rate_animation import animate_rates
 
 def firing_rate_over_time(neurons, spikes, senders, bin_width = 1000, delta_t = 50, interval=10,
-                          spikes_with_pulse=None, senders_with_pulse=None):
+                          spikes_with_pulse=None, senders_with_pulse=None, window=100, save=None):
     
-    # extract spatial positions
-    x = np.asarray(neurons.spatial['positions'])[:,0]
-    y = np.asarray(neurons.spatial['positions'])[:,1]
+    # extract spatial positions (queried from NEST only once per layer)
+    positions = LayerPositions.of(neurons)
     
     # calculate time range over which to animate
     t_range = np.arange(bin_width / 2, simtime - (bin_width / 2) + delta_t, delta_t)
     
-    # calculate instantaneous rate over time range
-    rate = [instantaneous_rate(layer_e.global_id, spikes, senders, t) for t in t_range]
+    # bin the spikes of the neurons once, the rates in windows of width `window` around
+    # the times in t_range are only computed when the frames are drawn
+    binned = BinnedSpikes(senders, spikes, positions.node_ids, t_start=0., t_stop=simtime)
+    reference = None
+    title = 'Instantaneous firing rate'
     
-    # in case pulse is given, calculate relative rate change
+    # in case pulse is given, show the rate change relative to the run without pulse
     if spikes_with_pulse is not None:
-        rate_with_pulse = [instantaneous_rate(layer_e.global_id, spikes_with_pulse,
-                                              senders_with_pulse, t) for t in t_range]
-        rate_difference = []
-        for i in range(len(rate)):
-            rate_difference.append(rate_with_pulse[i] - rate[i])
-        rate = rate_difference
+        reference = binned
+        binned = BinnedSpikes(senders_with_pulse, spikes_with_pulse, positions.node_ids, t_start=0.,
+                              t_stop=simtime)
         title = 'Change of instantaneous firing rate with pulse'
-
-    # set up initial figure
-    fig = plt.figure()
-    scat = plt.scatter(x=x, y=y, c=rate[0], s=30)
-
-    # animation
-    ani = animation.FuncAnimation(fig, update_plot, frames=range(len(t_range)),
-                                  fargs=(rate, scat, t_range), interval=interval)
-    
-    # add colorbar and axis labels
-    plt.colorbar(label=r'rate ($\frac{\mathrm{spikes}}{s}$)')
-    plt.xlabel('cortical space x (mm)')
-    plt.ylabel('cortical space y (mm)')
     
-    return ani
+    # animation, written to a file (e.g. 'rates.mp4' or 'rates.gif') if save is given
+    return animate_rates(positions, binned, t_range, window, reference, interval=interval, save=save,
+                         title=title)
 
 
 # -
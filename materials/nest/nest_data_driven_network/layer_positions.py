@@ -0,0 +1,151 @@
+"""
+Cached positions of spatial NodeCollections.
+
+`layer.spatial['positions']` converts the positions of all nodes from the kernel into a tuple of tuples on every
+call. `LayerPositions.of(layer)` queries the layer once and keeps the positions as a contiguous float32
+(nodes x dim) array together with the node ids, the extent, the center and the boundary conditions; later calls for
+the same NodeCollection object return the cached object. The cache is keyed on the NodeCollection itself, not on its
+node ids: the layers created after `nest.ResetKernel` reuse the node ids of the old ones but are new objects, and the
+entry of a layer is dropped when the layer is garbage collected.
+
+Usage:
+    pos = LayerPositions.of(layer_e)
+    plt.scatter(pos.x, pos.y)
+    rows = pos.rows(senders)                        # row of the sender of each spike
+    dist = pos.distances_from(pos.positions[0])     # distances to the first neuron, periodic with edge_wrap
+"""
+import weakref
+
+import numpy as np
+
+
+class LayerPositions:
+    """
+    Positions of the nodes of a spatial layer.
+
+    :param positions: (nodes x dim) positions (mm)
+    :param node_ids: node ids in the order of the positions
+    :param extent: size of the layer (mm)
+    :param center: center of the layer (mm)
+    :param edge_wrap: periodic boundary conditions
+    """
+    _cache = {}
+
+    def __init__(self, positions, node_ids, extent, center, edge_wrap=False):
+        self.positions = np.ascontiguousarray(positions, dtype=np.float32)
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.extent = np.asarray(extent, dtype=float)
+        self.center = np.asarray(center, dtype=float)
+        self.edge_wrap = bool(edge_wrap)
+
+        # node ids of layers are usually contiguous, the row is then the offset from the first id
+        ids = self.node_ids
+        self._contiguous = len(ids) > 0 and ids[-1] - ids[0] == len(ids) - 1 and np.all(np.diff(ids) == 1)
+        self._order = None if self._contiguous else np.argsort(ids, kind='stable')
+
+    @classmethod
+    def from_layer(cls, layer):
+        """
+        Query the positions and geometry of a spatial NodeCollection (uncached).
+        """
+        spatial = layer.spatial
+        return cls(spatial['positions'], layer.tolist(), spatial['extent'], spatial['center'], spatial['edge_wrap'])
+
+    @classmethod
+    def of(cls, layer):
+        """
+        Cached positions of a spatial NodeCollection.
+        """
+        key = id(layer)
+        entry = cls._cache.get(key)
+        # the id of a collected layer can be reused by a new object, the weak reference tells them apart
+        if entry is None or entry[0]() is not layer:
+            entry = weakref.ref(layer, lambda _: cls._cache.pop(key, None)), cls.from_layer(layer)
+            cls._cache[key] = entry
+        return entry[1]
+
+    @classmethod
+    def clear(cls):
+        cls._cache.clear()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.positions if dtype is None else self.positions.astype(dtype)
+
+    @property
+    def dim(self):
+        return self.positions.shape[1]
+
+    @property
+    def x(self):
+        return self.positions[:, 0]
+
+    @property
+    def y(self):
+        return self.positions[:, 1]
+
+    @property
+    def geometry(self):
+        """
+        Keyword arguments extent, center and edge_wrap of the functions in `spatial_fields.py`.
+        """
+        return {'extent': tuple(self.extent.tolist()), 'center': tuple(self.center.tolist()),
+                'edge_wrap': self.edge_wrap}
+
+    def rows(self, node_ids):
+        """
+        Rows of the given node ids in `positions`, -1 for node ids that are not in the layer.
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if not len(self.node_ids):
+            return np.full(node_ids.shape, -1)
+        if self._contiguous:
+            rows = node_ids - self.node_ids[0]
+            return np.where((rows >= 0) & (rows < len(self.node_ids)), rows, -1)
+        sorted_ids = self.node_ids[self._order]
+        pos = np.minimum(np.searchsorted(sorted_ids, node_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == node_ids, self._order[pos], -1)
+
+    def displacement(self, source, target):
+        """
+        Displacement vectors target - source (broadcast against each other), the shortest ones on the torus with
+        `edge_wrap`.
+        """
+        d = np.asarray(target, dtype=np.float32) - np.asarray(source, dtype=np.float32)
+        if self.edge_wrap:
+            extent = self.extent.astype(np.float32)
+            d -= extent * np.round(d / extent)
+        return d
+
+    def distance(self, source, target):
+        """
+        Distances between positions (broadcast against each other), periodic with `edge_wrap`.
+        """
+        return np.linalg.norm(self.displacement(source, target), axis=-1)
+
+    def distances_from(self, point, rows=None):
+        """
+        Distances of all nodes (or of the given rows) from a point.
+        """
+        positions = self.positions if rows is None else self.positions[rows]
+        return self.distance(np.asarray(point)[None, :], positions)
+
+    def pairwise_distances(self, rows_a=None, rows_b=None):
+        """
+        (len(rows_a) x len(rows_b)) distance matrix, all nodes by default.
+        """
+        a = self.positions if rows_a is None else self.positions[rows_a]
+        b = self.positions if rows_b is None else self.positions[rows_b]
+        return self.distance(a[:, None, :], b[None, :, :])
+
+    def wrap(self, positions):
+        """
+        Positions mapped into the layer with `edge_wrap`, unchanged otherwise.
+        """
+        positions = np.asarray(positions, dtype=np.float32)
+        if not self.edge_wrap:
+            return positions
+        lower = (self.center - self.extent / 2.).astype(np.float32)
+        return lower + np.mod(positions - lower, self.extent.astype(np.float32))
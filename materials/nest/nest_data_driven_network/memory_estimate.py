@@ -0,0 +1,324 @@
+"""
+Estimate the number of synapses and the memory of a network before building it.
+
+The expected number of connections of each projection is computed from the connection rule, for spatial
+`pairwise_bernoulli` connections by integrating the distance-dependent probability numerically over the layer extent
+(with or without `edge_wrap`). Synapses are stored on the thread of their target neuron, so the memory is reported
+per synapse model and per thread (virtual process). The bytes per synapse are approximate values for 64-bit NEST 3
+and can be calibrated with `measure_synapse_bytes`.
+
+Usage:
+    python memory_estimate.py --threads 4 --budget 16
+"""
+import argparse
+import warnings
+
+import numpy as np
+
+# approximate memory per connection (bytes) by synapse model: connection base (target, delay, synapse id; 16 bytes)
+# plus the parameters and state of the model
+SYNAPSE_BYTES = {
+    'static_synapse': 24,
+    'static_synapse_hom_w': 16,
+    'bernoulli_synapse': 32,
+    'sic_connection': 24,
+    'stdp_synapse': 88,
+    'tsodyks_synapse': 88,
+    'tsodyks2_synapse': 72,
+}
+# additional memory per connection: entries in the source table (during construction) and the target table
+CONNECTION_OVERHEAD_BYTES = 16
+# approximate memory per node (neuron or device)
+NODE_BYTES = 1500
+
+
+def distance_profile(profile):
+    """
+    Distance-dependent connection probability as function of the distance, relative to the zero-distance probability.
+
+    :param profile: callable, or dictionary {'kernel': 'exponential', 'beta': ..} or {'kernel': 'gaussian', 'std': ..}
+    :return: callable
+    """
+    if callable(profile):
+        return profile
+    kernel = profile['kernel']
+    if kernel == 'exponential':
+        return lambda dist: np.exp(-dist / profile['beta'])
+    if kernel == 'gaussian':
+        return lambda dist: np.exp(-dist ** 2 / (2. * profile['std'] ** 2))
+    raise ValueError("Unknown spatial profile '{}'".format(kernel))
+
+
+def mean_probability(p, profile=None, extent=(1., 1.), edge_wrap=False, mask_radius=None, resolution=512):
+    """
+    Mean connection probability between two layers of uniformly distributed neurons, i.e. p times the distance
+    profile averaged over all displacements between source and target. With `edge_wrap` the displacements are
+    uniform on the periodic layer (minimal image), otherwise their density is triangular in each dimension.
+
+    :param p: zero-distance connection probability
+    :param profile: distance profile (see `distance_profile`), None for constant p
+    :param extent: size of the layers (mm)
+    :param edge_wrap: periodic boundary conditions
+    :param mask_radius: connections only within this distance (None for no mask)
+    :param resolution: number of grid points per dimension for the numerical integration
+    :return: mean probability
+    """
+    if profile is None and mask_radius is None:
+        return float(p)
+    profile = distance_profile(profile) if profile is not None else (lambda dist: np.ones_like(dist))
+
+    axes = []
+    for length in extent:
+        if edge_wrap:
+            delta = (np.arange(resolution) + 0.5) / resolution * length - length / 2.
+            weight = np.full(resolution, 1. / resolution)
+        else:
+            delta = (np.arange(2 * resolution) + 0.5) / resolution * length - length
+            weight = (length - np.abs(delta)) / length ** 2 * (length / resolution)
+        axes.append((delta, weight))
+
+    (dx, wx), (dy, wy) = axes
+    dist = np.hypot(dx[:, None], dy[None, :])
+    prob = np.clip(p * profile(dist), 0., 1.)
+    if mask_radius is not None:
+        prob = np.where(dist <= mask_radius, prob, 0.)
+
+    return float(np.sum(prob * wx[:, None] * wy[None, :]))
+
+
+def expected_connections(n_src, n_tgt, conn_spec, profile=None, extent=(1., 1.), edge_wrap=False, mask_radius=None,
+                         same_population=False):
+    """
+    Expected number of connections created by one `nest.Connect` (or `nest.TripartiteConnect`) call.
+
+    :param n_src: number of source nodes
+    :param n_tgt: number of target nodes
+    :param conn_spec: connection specification, for spatial connections 'p' is the zero-distance probability
+    :param profile: distance profile of spatial `pairwise_bernoulli` connections (see `distance_profile`)
+    :param extent: size of the layers (mm)
+    :param edge_wrap: periodic boundary conditions
+    :param mask_radius: connections only within this distance (None for no mask)
+    :param same_population: sources and targets are the same nodes (autapses are excluded if not allowed)
+    :return: dictionary of expected numbers of connections, {'primary': n} or, for tripartite rules, with
+             'third_in' and 'third_out'
+    """
+    rule = conn_spec.get('rule', 'all_to_all')
+    no_autapses = same_population and not conn_spec.get('allow_autapses', True)
+
+    if rule == 'one_to_one':
+        n = n_src
+    elif rule == 'all_to_all':
+        n = n_src * n_tgt - (n_src if no_autapses else 0)
+    elif rule == 'fixed_indegree':
+        n = n_tgt * conn_spec['indegree']
+    elif rule == 'fixed_outdegree':
+        n = n_src * conn_spec['outdegree']
+    elif rule == 'fixed_total_number':
+        n = conn_spec['N']
+    elif rule in ('pairwise_bernoulli', 'tripartite_bernoulli_with_pool'):
+        p = conn_spec['p' if rule == 'pairwise_bernoulli' else 'p_primary']
+        n = mean_probability(p, profile, extent, edge_wrap, mask_radius) * n_src * n_tgt
+        if no_autapses:
+            n -= n_src * min(p, 1.)
+    else:
+        raise ValueError("Cannot estimate the number of connections of rule '{}'".format(rule))
+
+    counts = {'primary': float(n)}
+    if rule == 'tripartite_bernoulli_with_pool':
+        # each paired primary connection adds one neuron -> astrocyte and one astrocyte -> neuron connection
+        counts['third_in'] = counts['third_out'] = counts['primary'] * conn_spec.get('p_third_if_primary', 1.)
+
+    return counts
+
+
+class MemoryEstimate:
+    """
+    Accumulates the expected nodes and connections of a network and estimates its memory.
+
+    Example:
+        estimate = MemoryEstimate(threads=4)
+        estimate.add_nodes('iaf_psc_delta', 6250)
+        estimate.add_projection('E->E', 5000, 5000, {'rule': 'fixed_indegree', 'indegree': 1000})
+        print(estimate.report())
+        estimate.check(budget_gb=16., action='raise')
+    """
+    def __init__(self, threads=1, processes=1, synapse_bytes=None, overhead_bytes=CONNECTION_OVERHEAD_BYTES,
+                 node_bytes=NODE_BYTES):
+        """
+        :param threads: number of threads per process
+        :param processes: number of MPI processes
+        :param synapse_bytes: bytes per connection by synapse model, updates `SYNAPSE_BYTES`
+        :param overhead_bytes: additional bytes per connection
+        :param node_bytes: bytes per node
+        """
+        self.threads = threads
+        self.processes = processes
+        self.synapse_bytes = dict(SYNAPSE_BYTES, **(synapse_bytes or {}))
+        self.overhead_bytes = overhead_bytes
+        self.node_bytes = node_bytes
+        self.nodes = {}
+        self.projections = []
+
+    def add_nodes(self, model, n):
+        self.nodes[model] = self.nodes.get(model, 0) + n
+
+    def add_projection(self, name, n_src, n_tgt, conn_spec, syn_spec=None, **spatial):
+        """
+        Add the expected connections of one `nest.Connect` / `nest.TripartiteConnect` call.
+
+        :param name: label of the projection
+        :param n_src: number of source nodes
+        :param n_tgt: number of target nodes
+        :param conn_spec: connection specification
+        :param syn_spec: synapse specification, for tripartite rules a dictionary with 'primary', 'third_in' and
+                         'third_out' specifications
+        :param spatial: spatial parameters of `expected_connections` (profile, extent, edge_wrap, mask_radius,
+                        same_population)
+        :return: dictionary of expected connections per synapse model
+        """
+        counts = expected_connections(n_src, n_tgt, conn_spec, **spatial)
+        syn_spec = syn_spec or {}
+        tripartite = 'primary' in syn_spec
+        per_model = {}
+        for part, n in counts.items():
+            spec = syn_spec.get(part, {}) if tripartite else syn_spec
+            model = spec.get('synapse_model', 'static_synapse')
+            if model not in self.synapse_bytes:
+                warnings.warn("No memory estimate for '{}', assuming static_synapse".format(model))
+            per_model[model] = per_model.get(model, 0.) + n
+
+        self.projections.append((name, per_model))
+        return per_model
+
+    def synapse_counts(self):
+        """
+        :return: expected number of connections per synapse model
+        """
+        counts = {}
+        for _, per_model in self.projections:
+            for model, n in per_model.items():
+                counts[model] = counts.get(model, 0.) + n
+        return counts
+
+    def bytes_per_model(self):
+        """
+        :return: bytes of all connections per synapse model
+        """
+        return {model: n * (self.synapse_bytes.get(model, self.synapse_bytes['static_synapse']) +
+                            self.overhead_bytes)
+                for model, n in self.synapse_counts().items()}
+
+    def total_bytes(self):
+        return sum(self.bytes_per_model().values()) + self.node_bytes * sum(self.nodes.values())
+
+    def bytes_per_thread(self):
+        """
+        Connections are stored by the thread of the target node, distributed evenly over all virtual processes.
+        """
+        return self.total_bytes() / (self.threads * self.processes)
+
+    def bytes_per_process(self):
+        return self.bytes_per_thread() * self.threads
+
+    def report(self):
+        lines = ['{:<24} {:>16} {:>12}'.format('projection', 'connections', 'memory')]
+        for name, per_model in self.projections:
+            for model, n in per_model.items():
+                nbytes = n * (self.synapse_bytes.get(model, self.synapse_bytes['static_synapse']) +
+                              self.overhead_bytes)
+                lines.append('{:<24} {:>16,.0f} {:>9.2f} GB  ({})'.format(name, n, nbytes / 1024 ** 3, model))
+        lines.append('')
+        for model, nbytes in self.bytes_per_model().items():
+            lines.append('{:<24} {:>16,.0f} {:>9.2f} GB'.format(model, self.synapse_counts()[model],
+                                                                   nbytes / 1024 ** 3))
+        lines.append('{:<24} {:>16,} {:>9.2f} GB'.format('nodes', sum(self.nodes.values()),
+                                                            self.node_bytes * sum(self.nodes.values()) / 1024 ** 3))
+        lines.append('total {:.2f} GB, per process {:.2f} GB, per thread {:.2f} GB ({} processes x {} threads)'.format(
+            self.total_bytes() / 1024 ** 3, self.bytes_per_process() / 1024 ** 3, self.bytes_per_thread() / 1024 ** 3,
+            self.processes, self.threads))
+        return '\n'.join(lines)
+
+    def check(self, budget_gb, action='warn'):
+        """
+        Compare the memory per process with a budget.
+
+        :param budget_gb: available memory per process (GB)
+        :param action: 'warn' or 'raise' (MemoryError) if the estimate exceeds the budget
+        :return: True if the estimate fits into the budget
+        """
+        needed = self.bytes_per_process() / 1024 ** 3
+        if needed <= budget_gb:
+            return True
+
+        message = 'Estimated memory per process {:.2f} GB exceeds the budget of {:.2f} GB'.format(needed, budget_gb)
+        if action == 'raise':
+            raise MemoryError(message)
+        warnings.warn(message)
+        return False
+
+
+def measure_synapse_bytes(synapse_model, n_connections=1000000, threads=1):
+    """
+    Measure the memory per connection of a synapse model in NEST, to calibrate `SYNAPSE_BYTES`.
+
+    :param synapse_model: name of the synapse model
+    :param n_connections: number of connections to create
+    :param threads: number of threads
+    :return: bytes per connection (including the connection infrastructure)
+    """
+    import nest
+
+    nest.ResetKernel()
+    nest.local_num_threads = threads
+    nodes = nest.Create('parrot_neuron', 1000)
+    nest.Prepare()
+    nest.Cleanup()
+    before = nest.ll_api.sli_func('memory_thisjob')
+
+    nest.Connect(nodes, nodes, {'rule': 'fixed_total_number', 'N': n_connections}, {'synapse_model': synapse_model})
+    nest.Prepare()
+    after = nest.ll_api.sli_func('memory_thisjob')
+    nest.Cleanup()
+
+    # memory_thisjob is in kB
+    return (after - before) * 1024. / n_connections
+
+
+def estimate_data_driven_network(threads=1, scaling=0.1):
+    """
+    Estimate for the network of `2_data_driven_network.py`: four populations with 16 spatial `pairwise_bernoulli`
+    projections with exponential profiles on periodic 1 x 1 mm layers.
+    """
+    populations = ['L2/3E', 'L2/3I', 'L4E', 'L4I']
+    num_neurons_all_layers = np.load('data/num_neurons_V1_1mm2.npy') * scaling
+    connection_probs = np.load('data/connection_probs.npy')
+    beta_all_layers = np.load('data/beta.npy')
+    num_neurons = dict(zip(populations, num_neurons_all_layers.astype(int).ravel()))
+    beta = dict(zip(populations, beta_all_layers.ravel()))
+
+    estimate = MemoryEstimate(threads=threads)
+    estimate.add_nodes('iaf_psc_delta', sum(num_neurons.values()))
+    for s, source in enumerate(populations):
+        for t, target in enumerate(populations):
+            estimate.add_projection('{}->{}'.format(source, target), num_neurons[source], num_neurons[target],
+                                    {'rule': 'pairwise_bernoulli', 'p': connection_probs[t, s]},
+                                    profile={'kernel': 'exponential', 'beta': beta[target]}, extent=(1., 1.),
+                                    edge_wrap=True, same_population=source == target)
+    return estimate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=1, help='threads per process')
+    parser.add_argument('--scaling', type=float, default=0.1, help='scaling of the number of neurons')
+    parser.add_argument('--budget', type=float, help='memory budget per process (GB)')
+    args = parser.parse_args()
+
+    estimate = estimate_data_driven_network(args.threads, args.scaling)
+    print(estimate.report())
+    if args.budget is not None:
+        estimate.check(args.budget, action='raise')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Animation of the firing rates of spatially distributed neurons.
+
+The frames are computed lazily from `rates.BinnedSpikes`, a block of frames at a time, while the animation is shown
+or written to a file, so the memory does not grow with the number of frames. Only the colours of the scatter plot
+are updated per frame (blitting).
+
+Usage:
+    pos = LayerPositions.of(layer_e)
+    binned = BinnedSpikes(senders, times, pos.node_ids, t_start=0., t_stop=simtime)
+    ani = animate_rates(pos, binned, np.arange(500., 9550., 50.), window=100.)
+    animate_rates(..., save='rates.mp4')
+"""
+import numpy as np
+
+
+def rate_frames(binned, t, window, reference=None, block=64):
+    """
+    Generator of the rates of all neurons at the times t, computed in blocks of `block` frames.
+
+    :param binned: `rates.BinnedSpikes`
+    :param t: window centres (ms)
+    :param window: window width (ms)
+    :param reference: `rates.BinnedSpikes` of the same neurons, e.g. of a run without pulse; if given, the frames are
+                      the rate differences binned - reference
+    :return: iterator over arrays of rates (spikes/s), one per time
+    """
+    t = np.asarray(t, dtype=float)
+    for i in range(0, len(t), block):
+        rate = binned.rate(t[i:i + block], window)
+        if reference is not None:
+            rate -= reference.rate(t[i:i + block], window)
+        yield from rate
+
+
+def animate_rates(positions, binned, t, window, reference=None, interval=10, save=None, writer=None, fps=20,
+                  vmin=None, vmax=None, size=30, title='Instantaneous firing rate'):
+    """
+    Scatter plot of the neurons coloured by their rate in a sliding window.
+
+    :param positions: (neurons x 2) positions or `LayerPositions`, in the order of `binned.node_ids`
+    :param binned: `rates.BinnedSpikes`
+    :param t: window centres (ms), one frame each
+    :param window: window width (ms)
+    :param reference: `rates.BinnedSpikes` to subtract, see `rate_frames`
+    :param interval: delay between frames (ms)
+    :param save: file to write the animation to (e.g. 'rates.mp4' or 'rates.gif'), frames are streamed to the writer
+    :param writer: matplotlib writer or its name (default: 'ffmpeg' for mp4, 'pillow' otherwise)
+    :param fps: frames per second of the saved animation
+    :param vmin: lower colour limit (default: from the first frame)
+    :param vmax: upper colour limit (default: from the first frame)
+    :return: matplotlib.animation.FuncAnimation
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    positions = np.asarray(positions)
+    t = np.asarray(t, dtype=float)
+    first = next(rate_frames(binned, t[:1], window, reference))
+
+    fig, ax = plt.subplots()
+    scat = ax.scatter(x=positions[:, 0], y=positions[:, 1], c=first, s=size, vmin=vmin, vmax=vmax)
+    # the title is drawn inside the axes, blitting only redraws the axes
+    label = ax.text(0.02, 0.98, '', transform=ax.transAxes, va='top')
+    fig.colorbar(scat, ax=ax, label=r'rate ($\frac{\mathrm{spikes}}{s}$)')
+    ax.set_title(title)
+    ax.set_xlabel('cortical space x (mm)')
+    ax.set_ylabel('cortical space y (mm)')
+
+    def frames():
+        return zip(t, rate_frames(binned, t, window, reference))
+
+    def update(frame):
+        time, rate = frame
+        scat.set_array(rate)
+        label.set_text(f'elapsed time: {int(time)} ms')
+        return scat, label
+
+    ani = animation.FuncAnimation(fig, update, frames=frames, interval=interval, blit=True, save_count=len(t),
+                                  cache_frame_data=False)
+    if save is not None:
+        if writer is None:
+            writer = 'ffmpeg' if save.endswith('.mp4') else 'pillow'
+        ani.save(save, writer=writer, fps=fps)
+
+    return ani
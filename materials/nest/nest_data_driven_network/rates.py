@@ -0,0 +1,116 @@
+"""
+Firing rates of many neurons in sliding time windows.
+
+The spikes are sorted once by neuron and fine time bin. Window counts then come from cumulative sums over the
+(neuron x bin) count matrix, so the rates of all neurons at all window centres are computed at once instead of looping
+over neurons and windows. At low activity the count matrix is mostly zeros and is not built at all; the window counts
+are then looked up in the sorted spikes with binary search, which needs memory proportional to the number of spikes
+only.
+
+Usage:
+    binned = BinnedSpikes(senders, times, LayerPositions.of(layer_e).node_ids, t_start=0., t_stop=simtime)
+    rate = binned.rate(np.arange(500., simtime - 500., 50.), window=100.)   # (windows x neurons), spikes/s
+"""
+import numpy as np
+
+
+class BinnedSpikes:
+    """
+    Spike counts of a group of neurons in fine time bins.
+
+    :param senders: node ids of the spikes
+    :param times: spike times (ms)
+    :param node_ids: node ids of the neurons, in the order of the rows of the results, e.g. `neurons.tolist()`;
+                     spikes of other senders are ignored
+    :param t_start: start of the first bin (ms)
+    :param t_stop: end of the last bin (ms)
+    :param bin_size: width of the fine bins (ms), window edges are rounded to multiples of it
+    :param sparse: use the sorted spikes instead of the dense count matrix; None chooses sparse storage if there are
+                   fewer than `sparse_density` spikes per matrix entry
+    :param sparse_density: density threshold of the automatic choice
+    """
+    def __init__(self, senders, times, node_ids, t_start, t_stop, bin_size=1., sparse=None, sparse_density=0.05):
+        node_ids = np.asarray(node_ids).ravel()
+        senders, times = np.asarray(senders), np.asarray(times)
+        self.node_ids = node_ids
+        self.t_start, self.t_stop, self.bin_size = float(t_start), float(t_stop), float(bin_size)
+        self.n_neurons = len(node_ids)
+        self.n_bins = int(np.ceil((self.t_stop - self.t_start) / self.bin_size - 1e-9))
+
+        # row of each spike, via the sorted node ids (node ids of a NodeCollection are sorted already)
+        order = np.argsort(node_ids, kind='stable')
+        sorted_ids = node_ids[order]
+        pos = np.minimum(np.searchsorted(sorted_ids, senders), max(self.n_neurons - 1, 0))
+        bins = np.floor((times - self.t_start) / self.bin_size + 1e-9).astype(np.int64)
+        keep = (bins >= 0) & (bins < self.n_bins)
+        if self.n_neurons:
+            keep &= sorted_ids[pos] == senders
+        else:
+            keep[:] = False
+        rows = order[pos[keep]]
+
+        # flat index of (row, bin) for every spike
+        keys = rows.astype(np.int64) * self.n_bins + bins[keep]
+        self.n_spikes = len(keys)
+        size = self.n_neurons * self.n_bins
+
+        if sparse is None:
+            sparse = self.n_spikes < sparse_density * size
+        self.sparse = sparse
+        if sparse:
+            self.keys = np.sort(keys)
+            self._counts = None
+        else:
+            self.keys = None
+            self._counts = np.bincount(keys, minlength=size).reshape(self.n_neurons, self.n_bins)
+        self._cumsum = None
+
+    @property
+    def counts(self):
+        """
+        (neurons x bins) spike counts, a `scipy.sparse.csr_matrix` with sparse storage.
+        """
+        if not self.sparse:
+            return self._counts
+        from scipy.sparse import csr_matrix
+        keys, n = np.unique(self.keys, return_counts=True)
+        return csr_matrix((n, (keys // self.n_bins, keys % self.n_bins)), shape=(self.n_neurons, self.n_bins))
+
+    def bin_edges(self, t):
+        """
+        Index of the fine bin edge closest to each time t (ms), clipped to the binned interval.
+        """
+        edges = np.rint((np.asarray(t, dtype=float) - self.t_start) / self.bin_size).astype(np.int64)
+        return np.clip(edges, 0, self.n_bins)
+
+    def window_counts(self, start, stop):
+        """
+        Spike counts of all neurons in the windows [start, stop) (ms, arrays of equal length).
+
+        :return: (windows x neurons) array
+        """
+        return self._bin_counts(self.bin_edges(np.atleast_1d(start)), self.bin_edges(np.atleast_1d(stop)))
+
+    def _bin_counts(self, a, b):
+        # counts in the fine bins [a, b) per window
+        if not self.sparse:
+            if self._cumsum is None:
+                # cumulative counts with a leading zero column: count in bins [a, b) = C[:, b] - C[:, a]
+                self._cumsum = np.zeros((self.n_neurons, self.n_bins + 1), dtype=np.int64)
+                np.cumsum(self._counts, axis=1, out=self._cumsum[:, 1:])
+            return (self._cumsum[:, b] - self._cumsum[:, a]).T
+
+        offsets = np.arange(self.n_neurons, dtype=np.int64) * self.n_bins
+        return (np.searchsorted(self.keys, offsets[None, :] + b[:, None]) -
+                np.searchsorted(self.keys, offsets[None, :] + a[:, None]))
+
+    def rate(self, t, window):
+        """
+        Rates of all neurons in windows of width `window` (ms) centred on the times t (ms).
+
+        :return: (len(t) x neurons) array of rates (spikes/s)
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        a, b = self.bin_edges(t - window / 2.), self.bin_edges(t + window / 2.)
+        width = np.maximum(b - a, 1) * self.bin_size
+        return self._bin_counts(a, b) / width[:, None] * 1e3
@@ -0,0 +1,160 @@
+"""
+Chunked simulation that streams the spikes of the recorders to disk.
+
+The simulation time is split into chunks (`nest.Prepare`, `nest.Run` per chunk, `nest.Cleanup`). After every chunk the
+events of the spike recorders are taken out of NEST, the recorders are cleared and a background thread appends the
+events to one binary file per recorder while the next chunk is simulated. The memory of the recorders is thus bounded
+by one chunk, independent of the simulated time, and the files of an interrupted run contain all finished chunks.
+
+Each file is a flat sequence of records (int32 sender, float32 time in ms), see `SPIKE_DTYPE` and `read_spikes`.
+
+Usage:
+    spikes = {pop: nest.Create('spike_recorder') for pop in populations}
+    ...
+    files = simulate_chunked(simtime, spikes, 'spikes', chunk=1000.)
+    senders, times = read_spikes(files['L4E'])
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+
+SPIKE_DTYPE = np.dtype([('sender', '<i4'), ('time', '<f4')])
+
+
+class SpikeWriter:
+    """
+    Appends spike events to binary files on a background thread.
+
+    At most `max_pending` chunks wait in the queue, `write` blocks when the thread falls behind, so the memory of the
+    pending events stays bounded as well.
+    """
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, records = item
+            try:
+                with open(path, 'ab') as f:
+                    records.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                self.error = e
+
+    def write(self, path, senders, times):
+        """
+        Queue events for appending to `path`.
+        """
+        if self.error is not None:
+            raise self.error
+        records = np.empty(len(senders), dtype=SPIKE_DTYPE)
+        records['sender'] = senders
+        records['time'] = times
+        self.queue.put((path, records))
+
+    def close(self):
+        """
+        Write all queued events and stop the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def drain(recorder):
+    """
+    Take the events out of a spike recorder and clear it.
+
+    :return: senders, times
+    """
+    events = recorder.get('events')
+    senders, times = np.asarray(events['senders']), np.asarray(events['times'])
+    recorder.n_events = 0
+    return senders, times
+
+
+def simulate_chunked(simtime, recorders, prefix, chunk=1000., overwrite=True, callback=None):
+    """
+    Simulate for `simtime` in chunks and stream the events of the spike recorders to `<prefix>_<name>.spikes`.
+
+    :param simtime: simulation time (ms)
+    :param recorders: dictionary of spike recorders, e.g. {'L4E': spikes_L4E, ..}
+    :param prefix: path prefix of the spike files
+    :param chunk: simulation time per chunk (ms), a multiple of the resolution
+    :param overwrite: remove existing spike files first, otherwise the events are appended
+    :param callback: called as callback(t, events) after every chunk, with the simulated time t (ms) and a dictionary
+                     of (senders, times) per recorder, e.g. to compute online statistics
+    :return: dictionary of the spike file paths per recorder
+    """
+    import nest
+
+    paths = {name: '{}_{}.spikes'.format(prefix, name.replace('/', '')) for name in recorders}
+    if overwrite:
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    n_chunks = int(np.ceil(simtime / chunk - 1e-9))
+    t = 0.
+    with SpikeWriter() as writer:
+        nest.Prepare()
+        try:
+            for _ in range(n_chunks):
+                run_time = min(chunk, simtime - t)
+                nest.Run(run_time)
+                t += run_time
+                events = {name: drain(recorder) for name, recorder in recorders.items()}
+                for name, (senders, times) in events.items():
+                    writer.write(paths[name], senders, times)
+                if callback is not None:
+                    callback(t, events)
+        finally:
+            nest.Cleanup()
+
+    return paths
+
+
+def read_spikes(path, t_start=None, t_stop=None, mmap=False):
+    """
+    Read a spike file written by `simulate_chunked`. An incomplete last record of an interrupted write is ignored.
+
+    :param path: spike file
+    :param t_start: only spikes at or after t_start (ms)
+    :param t_stop: only spikes before t_stop (ms)
+    :param mmap: memory-map the file instead of reading it
+    :return: senders, times
+    """
+    n = os.path.getsize(path) // SPIKE_DTYPE.itemsize
+    if n == 0:
+        return np.empty(0, dtype='<i4'), np.empty(0, dtype='<f4')
+    if mmap:
+        records = np.memmap(path, dtype=SPIKE_DTYPE, mode='r', shape=(n,))
+    else:
+        records = np.fromfile(path, dtype=SPIKE_DTYPE, count=n)
+
+    senders, times = records['sender'], records['time']
+    if t_start is not None or t_stop is not None:
+        keep = np.ones(n, dtype=bool)
+        if t_start is not None:
+            keep &= times >= t_start
+        if t_stop is not None:
+            keep &= times < t_stop
+        senders, times = senders[keep], times[keep]
+
+    return senders, times
@@ -0,0 +1,150 @@
+"""
+Spatial rate fields: the rates of the neurons of a spatial layer aggregated on a regular grid.
+
+Each neuron is assigned to one grid cell once, and the aggregation of many time frames is a single sparse matrix
+product, so the fields of all frames are computed at once and the cost of plotting and analysing them depends on the
+grid size instead of the number of neurons. Positions outside the layer are wrapped around (`edge_wrap`) or assigned
+to the border cells, the kernel smoothing is periodic with `edge_wrap`.
+
+Usage:
+    pos = LayerPositions.of(layer_e)
+    fields = rate_field(rate, pos, (32, 32), **pos.geometry)           # (frames x Gx x Gy)
+    fields = rate_fields_from_spikes(binned, pos, t, 100., (32, 32), **pos.geometry)
+    plot_rate_field(fields[0], **pos.geometry)
+"""
+import numpy as np
+
+from layer_positions import LayerPositions
+
+STATISTICS = ('mean', 'sum', 'count', 'kernel')
+
+
+def layer_geometry(layer):
+    """
+    Extent, center and periodic boundary conditions of a spatial NodeCollection, see `LayerPositions.geometry`.
+
+    :return: dictionary with 'extent', 'center' and 'edge_wrap'
+    """
+    return LayerPositions.of(layer).geometry
+
+
+def grid_cells(positions, shape, extent=(1., 1.), center=(0., 0.), edge_wrap=False):
+    """
+    Grid cell of each position.
+
+    :param positions: (neurons x 2) positions (mm) or `LayerPositions`
+    :param shape: number of grid cells (Gx, Gy)
+    :param extent: size of the layer (mm)
+    :param center: center of the layer (mm)
+    :param edge_wrap: periodic boundary conditions
+    :return: flat index ix * Gy + iy of the cell of each position
+    """
+    positions = np.asarray(positions, dtype=float)[:, :2]
+    shape, extent, center = np.asarray(shape), np.asarray(extent, dtype=float), np.asarray(center, dtype=float)
+    idx = np.floor((positions - (center - extent / 2.)) / extent * shape).astype(np.int64)
+    idx = np.mod(idx, shape) if edge_wrap else np.clip(idx, 0, shape - 1)
+    return idx[:, 0] * shape[1] + idx[:, 1]
+
+
+def aggregation_matrix(cells, n_cells):
+    """
+    Sparse (neurons x cells) indicator matrix of the grid cell of each neuron.
+    """
+    from scipy.sparse import csr_matrix
+    n = len(cells)
+    return csr_matrix((np.ones(n), (np.arange(n), cells)), shape=(n, n_cells))
+
+
+def smooth(fields, sigma, extent=(1., 1.), edge_wrap=False):
+    """
+    Gaussian smoothing of fields over the two grid dimensions.
+
+    :param fields: (... x Gx x Gy) array
+    :param sigma: standard deviation of the kernel (mm)
+    :param extent: size of the layer (mm)
+    :param edge_wrap: periodic (otherwise zero) boundary conditions
+    """
+    from scipy.ndimage import gaussian_filter
+    fields = np.asarray(fields, dtype=float)
+    cell_size = np.asarray(extent, dtype=float) / fields.shape[-2:]
+    sigmas = [0.] * (fields.ndim - 2) + list(sigma / cell_size)
+    return gaussian_filter(fields, sigmas, mode='wrap' if edge_wrap else 'constant')
+
+
+def rate_field(rate, positions, shape, extent=(1., 1.), center=(0., 0.), edge_wrap=False, statistic='mean',
+               sigma=None):
+    """
+    Aggregate the rates of neurons on a regular grid.
+
+    :param rate: (neurons,) or (frames x neurons) rates, e.g. of `rates.BinnedSpikes.rate`
+    :param positions: (neurons x 2) positions (mm) or `LayerPositions`, in the order of the neurons in `rate`
+    :param shape: number of grid cells (Gx, Gy)
+    :param extent: size of the layer (mm)
+    :param center: center of the layer (mm)
+    :param edge_wrap: periodic boundary conditions
+    :param statistic: 'mean' rate of the neurons in each cell (nan for empty cells), 'sum' of their rates, 'count'
+                      of neurons per cell, or 'kernel' for the mean rate smoothed with a Gaussian kernel of width
+                      `sigma` (mm), i.e. the ratio of the smoothed sum and the smoothed count
+    :param sigma: width of the kernel (mm), default: one grid cell
+    :return: (frames x Gx x Gy) array, (Gx x Gy) for one-dimensional `rate`
+    """
+    if statistic not in STATISTICS:
+        raise ValueError("statistic must be one of {}".format(STATISTICS))
+    rate = np.asarray(rate, dtype=float)
+    single = rate.ndim == 1
+    rate = np.atleast_2d(rate)
+    shape = tuple(shape)
+    n_cells = shape[0] * shape[1]
+
+    M = aggregation_matrix(grid_cells(positions, shape, extent, center, edge_wrap), n_cells)
+    count = np.asarray(M.sum(axis=0)).reshape(shape)
+    if statistic == 'count':
+        fields = np.broadcast_to(count, (len(rate),) + shape).astype(float)
+    else:
+        # (frames x neurons) @ (neurons x cells) aggregates all frames at once
+        fields = np.asarray(M.T.dot(rate.T).T).reshape((len(rate),) + shape)
+        if statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fields = fields / count
+        elif statistic == 'kernel':
+            if sigma is None:
+                sigma = float(np.max(np.asarray(extent, dtype=float) / shape))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fields = smooth(fields, sigma, extent, edge_wrap) / smooth(count, sigma, extent, edge_wrap)
+
+    return fields[0] if single else fields
+
+
+def rate_fields_from_spikes(binned, positions, t, window, shape, extent=(1., 1.), center=(0., 0.), edge_wrap=False,
+                            statistic='mean', sigma=None, block=256):
+    """
+    Rate fields in sliding windows, computed in blocks of `block` frames so the (frames x neurons) rates are never
+    held in memory at once.
+
+    :param binned: `rates.BinnedSpikes`
+    :param positions: (neurons x 2) positions (mm) or `LayerPositions`, in the order of `binned.node_ids`
+    :param t: window centres (ms)
+    :param window: window width (ms)
+    :return: (len(t) x Gx x Gy) array
+    """
+    t = np.asarray(t, dtype=float)
+    fields = np.empty((len(t),) + tuple(shape))
+    for i in range(0, len(t), block):
+        fields[i:i + block] = rate_field(binned.rate(t[i:i + block], window), positions, shape, extent, center,
+                                         edge_wrap, statistic, sigma)
+    return fields
+
+
+def plot_rate_field(field, extent=(1., 1.), center=(0., 0.), edge_wrap=False, ax=None, **kwargs):
+    """
+    Image of a (Gx x Gy) rate field in layer coordinates.
+    """
+    import matplotlib.pyplot as plt
+    ax = ax or plt.gca()
+    left, bottom = np.asarray(center) - np.asarray(extent) / 2.
+    im = ax.imshow(np.asarray(field).T, origin='lower', extent=(left, left + extent[0], bottom, bottom + extent[1]),
+                   **kwargs)
+    plt.colorbar(im, ax=ax, label=r'rate ($\frac{\mathrm{spikes}}{s}$)')
+    ax.set_xlabel('cortical space x (mm)')
+    ax.set_ylabel('cortical space y (mm)')
+    return im
@@ -0,0 +1,53 @@
+"""
+Checks of the cached layer positions, run with `python -m pytest test_layer_positions.py`.
+"""
+import gc
+
+import numpy as np
+import pytest
+
+nest = pytest.importorskip('nest')
+from layer_positions import LayerPositions  # noqa: E402
+
+
+def create_layer(positions, extent=(2., 2.)):
+    return nest.Create('iaf_psc_alpha', positions=nest.spatial.free(
+        pos=[list(p) for p in positions], extent=list(extent), edge_wrap=True))
+
+
+def test_cache_after_reset_kernel():
+    """
+    The layers of a new kernel reuse the node ids of the old ones, their positions are queried again.
+    """
+    rng = np.random.default_rng(1)
+    positions_a, positions_b = rng.uniform(-0.9, 0.9, (2, 50, 2))
+
+    nest.ResetKernel()
+    layer = create_layer(positions_a)
+    cached = LayerPositions.of(layer)
+    assert LayerPositions.of(layer) is cached
+    np.testing.assert_allclose(cached.positions, positions_a, atol=1e-6)
+
+    nest.ResetKernel()
+    new_layer = create_layer(positions_b, extent=(1.9, 1.9))
+    assert new_layer.tolist() == layer.tolist()
+    pos = LayerPositions.of(new_layer)
+    np.testing.assert_allclose(pos.positions, positions_b, atol=1e-6)
+    np.testing.assert_allclose(pos.extent, (1.9, 1.9))
+
+
+def test_cache_entry_dropped_with_layer():
+    nest.ResetKernel()
+    layer = create_layer(np.zeros((3, 2)))
+    LayerPositions.of(layer)
+    n_cached = len(LayerPositions._cache)
+    del layer
+    gc.collect()
+    assert len(LayerPositions._cache) == n_cached - 1
+
+
+def test_rows():
+    pos = LayerPositions(np.zeros((4, 2)), [3, 4, 5, 6], (1., 1.), (0., 0.))
+    np.testing.assert_array_equal(pos.rows([5, 3, 7, 2]), [2, 0, -1, -1])
+    pos = LayerPositions(np.zeros((4, 2)), [9, 3, 12, 5], (1., 1.), (0., 0.))
+    np.testing.assert_array_equal(pos.rows([5, 9, 7, 12]), [3, 0, -1, 2])
@@ -0,0 +1,58 @@
+"""
+Checks of the memory estimate, run with `python -m pytest test_memory_estimate.py`.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from memory_estimate import MemoryEstimate, distance_profile, mean_probability
+
+
+def brute_force_probability(p, profile, extent, edge_wrap, mask_radius=None, n=40):
+    # all pairs of neurons at the centres of an n x n grid of cells on the layer
+    x = (np.arange(n) + 0.5) / n * extent[0]
+    y = (np.arange(n) + 0.5) / n * extent[1]
+    positions = np.stack(np.meshgrid(x, y, indexing='ij'), axis=-1).reshape(-1, 2)
+    d = positions[:, None, :] - positions[None, :, :]
+    if edge_wrap:
+        d -= np.asarray(extent) * np.round(d / np.asarray(extent))
+    dist = np.hypot(d[..., 0], d[..., 1])
+    prob = np.clip(p * distance_profile(profile)(dist), 0., 1.)
+    if mask_radius is not None:
+        prob = np.where(dist <= mask_radius, prob, 0.)
+    return prob.mean()
+
+
+@pytest.mark.parametrize('edge_wrap', [False, True])
+@pytest.mark.parametrize('p, profile, extent, mask_radius', [
+    (0.5, {'kernel': 'exponential', 'beta': 0.2}, (1., 1.), None),
+    (2., {'kernel': 'gaussian', 'std': 0.3}, (1.5, 1.), None),     # p * profile is clipped at 1
+    (0.3, {'kernel': 'exponential', 'beta': 0.5}, (1., 1.), 0.4),
+])
+def test_mean_probability(p, profile, extent, mask_radius, edge_wrap):
+    expected = brute_force_probability(p, profile, extent, edge_wrap, mask_radius)
+    assert mean_probability(p, profile, extent, edge_wrap, mask_radius) == pytest.approx(expected, rel=0.01)
+
+
+def test_mean_probability_boundary():
+    # without periodic boundaries the neurons at the border have fewer neighbours
+    profile = {'kernel': 'gaussian', 'std': 0.2}
+    assert mean_probability(1., profile, edge_wrap=False) < mean_probability(1., profile, edge_wrap=True)
+    assert mean_probability(0.1) == 0.1
+
+
+def test_check_budget():
+    estimate = MemoryEstimate(threads=2, processes=2)
+    estimate.add_nodes('iaf_psc_delta', 1000)
+    estimate.add_projection('E->E', 10000, 10000, {'rule': 'fixed_indegree', 'indegree': 1000})
+    needed = estimate.bytes_per_process() / 1024 ** 3
+    assert needed == pytest.approx((1e7 * (24 + 16) + 1000 * 1500) / 2 / 1024 ** 3)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert estimate.check(needed) and estimate.check(needed, action='raise')
+    with pytest.warns(UserWarning, match='exceeds the budget'):
+        assert not estimate.check(0.99 * needed)
+    with pytest.raises(MemoryError):
+        estimate.check(0.99 * needed, action='raise')
@@ -0,0 +1,62 @@
+"""
+Checks of the binned spike rates, run with `python -m pytest test_rates.py`.
+"""
+import numpy as np
+import pytest
+
+from rates import BinnedSpikes
+
+SIMTIME = 2000.
+
+
+def random_spikes(node_ids, n_spikes, seed):
+    rng = np.random.default_rng(seed)
+    # NEST spike times are on the grid of the resolution, spikes of other neurons are ignored
+    senders = rng.choice(np.concatenate((node_ids, [1, 10 ** 6])), n_spikes)
+    times = np.round(rng.uniform(0., SIMTIME, n_spikes), 1)
+    return senders, times
+
+
+def reference_rate(senders, times, node_ids, t, window):
+    # the loop of the original instantaneous_rate, over half-open windows [t - window / 2, t + window / 2)
+    rate = np.empty((len(t), len(node_ids)))
+    for i, t_i in enumerate(t):
+        for j, node_id in enumerate(node_ids):
+            spikes = times[senders == node_id]
+            rate[i, j] = np.sum((t_i - window / 2. <= spikes) & (spikes < t_i + window / 2.))
+    return rate / window * 1e3
+
+
+@pytest.mark.parametrize('n_spikes', [50, 20000])
+@pytest.mark.parametrize('node_ids', [np.arange(5, 45), np.array([17, 3, 90, 4, 56, 8])])
+def test_rate(node_ids, n_spikes):
+    senders, times = random_spikes(node_ids, n_spikes, seed=n_spikes)
+    # spikes on window edges
+    senders = np.concatenate((senders, node_ids[:2], node_ids[:2]))
+    times = np.concatenate((times, [150., 250.], [149.9, 249.9]))
+    t, window = np.arange(50., SIMTIME - 50., 100.), 100.
+
+    expected = reference_rate(senders, times, node_ids, t, window)
+    for sparse in (False, True):
+        binned = BinnedSpikes(senders, times, node_ids, t_start=0., t_stop=SIMTIME, sparse=sparse)
+        np.testing.assert_allclose(binned.rate(t, window), expected)
+    assert BinnedSpikes(senders, times, node_ids, 0., SIMTIME).sparse == (n_spikes == 50)
+
+
+def test_counts_and_windows():
+    node_ids = np.arange(1, 21)
+    senders, times = random_spikes(node_ids, 3000, seed=1)
+    dense = BinnedSpikes(senders, times, node_ids, t_start=0., t_stop=SIMTIME, bin_size=5., sparse=False)
+    sparse = BinnedSpikes(senders, times, node_ids, t_start=0., t_stop=SIMTIME, bin_size=5., sparse=True)
+    np.testing.assert_array_equal(sparse.counts.toarray(), dense.counts)
+    assert dense.counts.sum() == dense.n_spikes == np.isin(senders, node_ids).sum()
+
+    start, stop = np.array([0., 100., 1995.]), np.array([100., 1000., 2000.])
+    expected = [[np.sum((senders == i) & (a <= times) & (times < b)) for i in node_ids] for a, b in zip(start, stop)]
+    np.testing.assert_array_equal(dense.window_counts(start, stop), expected)
+    np.testing.assert_array_equal(sparse.window_counts(start, stop), expected)
+
+
+def test_no_spikes():
+    binned = BinnedSpikes([], [], np.arange(3), t_start=0., t_stop=100.)
+    np.testing.assert_array_equal(binned.rate([50.], 20.), np.zeros((1, 3)))
@@ -0,0 +1,109 @@
+"""
+Checks of the spike files written during chunked simulations, run with `python -m pytest test_recording.py`.
+"""
+import builtins
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+import recording
+from recording import SpikeWriter, drain, read_spikes
+
+
+class Recorder:
+    """
+    Spike recorder with the interface used by `drain`: the events accumulate until n_events is set to 0.
+    """
+    def __init__(self):
+        self.senders, self.times = [], []
+
+    def record(self, senders, times):
+        self.senders += list(senders)
+        self.times += list(times)
+
+    def get(self, key):
+        assert key == 'events'
+        return {'senders': np.array(self.senders, dtype=int), 'times': np.array(self.times)}
+
+    @property
+    def n_events(self):
+        return len(self.senders)
+
+    @n_events.setter
+    def n_events(self, value):
+        assert value == 0
+        self.senders, self.times = [], []
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'spikes_L4E.spikes')
+    rng = np.random.default_rng(1)
+    recorder = Recorder()
+    expected_senders, expected_times = [], []
+    with SpikeWriter() as writer:
+        for chunk in range(5):
+            n = 0 if chunk == 2 else int(rng.integers(1, 200))
+            senders = rng.integers(1, 10 ** 5, n)
+            times = np.round(rng.uniform(chunk * 100., (chunk + 1) * 100., n), 1)
+            recorder.record(senders, times)
+            drained = drain(recorder)
+            assert recorder.n_events == 0
+            writer.write(path, *drained)
+            expected_senders.append(senders)
+            expected_times.append(times)
+    expected_senders, expected_times = np.concatenate(expected_senders), np.concatenate(expected_times)
+
+    # flat little-endian records of an int32 sender and a float32 time
+    with open(path, 'rb') as f:
+        raw = f.read()
+    assert len(raw) == 8 * len(expected_senders)
+    assert struct.unpack('<if', raw[:8]) == (expected_senders[0], np.float32(expected_times[0]))
+
+    for mmap in (False, True):
+        senders, times = read_spikes(path, mmap=mmap)
+        assert senders.dtype == np.int32 and times.dtype == np.float32
+        np.testing.assert_array_equal(senders, expected_senders)
+        np.testing.assert_array_equal(times, expected_times.astype(np.float32))
+
+    senders, times = read_spikes(path, t_start=100., t_stop=300.)
+    keep = (expected_times.astype(np.float32) >= 100.) & (expected_times.astype(np.float32) < 300.)
+    np.testing.assert_array_equal(senders, expected_senders[keep])
+
+    # a record cut off by an interrupted write is ignored
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    np.testing.assert_array_equal(read_spikes(path)[0], expected_senders)
+
+
+def test_bounded_queue(tmp_path, monkeypatch):
+    path = str(tmp_path / 'spikes.spikes')
+    gate = threading.Event()
+
+    def gated_open(*args, **kwargs):
+        gate.wait(10.)
+        return builtins.open(*args, **kwargs)
+
+    monkeypatch.setattr(recording, 'open', gated_open, raising=False)
+    writer = SpikeWriter(max_pending=1)
+    writer.write(path, [1], [0.1])
+    writer.write(path, [2], [0.2])
+
+    # the thread waits in the first write and one chunk is pending, the next write blocks
+    blocked = threading.Thread(target=writer.write, args=(path, [3], [0.3]))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive() and writer.queue.full()
+
+    gate.set()
+    blocked.join(10.)
+    writer.close()
+    np.testing.assert_array_equal(read_spikes(path)[0], [1, 2, 3])
+
+
+def test_write_error(tmp_path):
+    writer = SpikeWriter()
+    writer.write(str(tmp_path / 'missing' / 'spikes.spikes'), [1], [0.1])
+    with pytest.raises(OSError):
+        writer.close()
@@ -0,0 +1,63 @@
+"""
+Checks of the gridded rate fields, run with `python -m pytest test_spatial_fields.py`.
+"""
+import numpy as np
+import pytest
+
+from rates import BinnedSpikes
+from spatial_fields import grid_cells, rate_field, rate_fields_from_spikes
+
+EXTENT, CENTER, SHAPE = (2., 1.), (0.5, 0.), (8, 4)
+
+
+def reference_fields(rate, positions, edge_wrap):
+    # loop over the grid cells, with the cell bounds of the layer
+    lower = np.asarray(CENTER) - np.asarray(EXTENT) / 2.
+    size = np.asarray(EXTENT) / SHAPE
+    wrapped = lower + np.mod(positions - lower, EXTENT) if edge_wrap else positions
+    fields = np.full((len(rate),) + SHAPE, np.nan)
+    for ix in range(SHAPE[0]):
+        for iy in range(SHAPE[1]):
+            low = lower + size * (ix, iy)
+            inside = np.all((wrapped >= low) & (wrapped < low + size), axis=1)
+            if inside.any():
+                fields[:, ix, iy] = rate[:, inside].mean(axis=1)
+    return fields
+
+
+@pytest.mark.parametrize('edge_wrap', [False, True])
+def test_mean_rate_field(edge_wrap):
+    rng = np.random.default_rng(1)
+    lower = np.asarray(CENTER) - np.asarray(EXTENT) / 2.
+    positions = lower + rng.uniform(0., 1., (300, 2)) * EXTENT
+    if edge_wrap:
+        # positions outside the layer are wrapped into it
+        positions[:20] += EXTENT
+    rate = rng.uniform(0., 10., (5, len(positions)))
+
+    fields = rate_field(rate, positions, SHAPE, EXTENT, CENTER, edge_wrap)
+    np.testing.assert_allclose(fields, reference_fields(rate, positions, edge_wrap))
+    np.testing.assert_allclose(rate_field(rate[0], positions, SHAPE, EXTENT, CENTER, edge_wrap), fields[0])
+
+    count = rate_field(rate, positions, SHAPE, EXTENT, CENTER, edge_wrap, statistic='count')
+    assert count.sum() == 5 * len(positions)
+    np.testing.assert_allclose(rate_field(rate, positions, SHAPE, EXTENT, CENTER, edge_wrap, statistic='sum'),
+                               np.nan_to_num(fields) * count)
+
+
+def test_grid_cells_clipped():
+    # without edge_wrap, positions on or beyond the upper border belong to the last cell
+    cells = grid_cells(np.array([[1.5, 0.5], [-0.5, -0.5], [5., -3.]]), SHAPE, EXTENT, CENTER)
+    np.testing.assert_array_equal(cells, [7 * 4 + 3, 0, 7 * 4])
+
+
+def test_fields_from_spikes_in_blocks():
+    rng = np.random.default_rng(2)
+    node_ids = np.arange(1, 101)
+    positions = rng.uniform(-0.5, 0.5, (100, 2))
+    senders, times = rng.choice(node_ids, 5000), np.round(rng.uniform(0., 1000., 5000), 1)
+    binned = BinnedSpikes(senders, times, node_ids, 0., 1000.)
+    t = np.arange(25., 1000., 10.)
+
+    fields = rate_fields_from_spikes(binned, positions, t, 50., (4, 4), block=7)
+    np.testing.assert_allclose(fields, rate_field(binned.rate(t, 50.), positions, (4, 4)))
@@ -0,0 +1,54 @@
+"""
+Checks of the wave analysis on synthetic travelling waves, run with `python -m pytest test_wave_analysis.py`.
+"""
+import numpy as np
+import pytest
+
+from wave_analysis import correlation_length, wave_statistics
+
+EXTENT, SHAPE = (2., 2.), (32, 32)
+
+
+def plane_wave(wave_vector, frequency, dt, n_frames):
+    """
+    (frames x Gx x Gy) fields of cos(2 pi (k x - f t)) sampled at the cell centres, k in 1/mm and f in 1/ms.
+    """
+    x = (np.arange(SHAPE[0]) + 0.5) * EXTENT[0] / SHAPE[0]
+    y = (np.arange(SHAPE[1]) + 0.5) * EXTENT[1] / SHAPE[1]
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    t = np.arange(n_frames)[:, None, None] * dt
+    return 5. + np.cos(2. * np.pi * (wave_vector[0] * X + wave_vector[1] * Y - frequency * t))
+
+
+@pytest.mark.parametrize('wave_vector', [(2., 0.), (0., 1.5), (1., 1.)])
+def test_plane_wave(wave_vector):
+    # wave numbers that are multiples of 1 / extent are periodic on the layer
+    dt, frequency = 1., 0.02
+    fields = plane_wave(wave_vector, frequency, dt, 200)
+    stats = wave_statistics(fields, dt, EXTENT)
+
+    k = np.asarray(wave_vector)
+    expected_velocity = frequency * k / np.sum(k ** 2)
+    np.testing.assert_allclose(stats['phase_velocity'], expected_velocity, rtol=0.05, atol=1e-4)
+    if 0. in wave_vector:
+        # the cross-correlation peak of an oblique wave front is only defined up to a shift along the front
+        np.testing.assert_allclose(stats['velocity'], expected_velocity, rtol=0.05, atol=1e-3)
+    assert stats['frequency'] == pytest.approx(frequency * 1e3, rel=0.05)
+    assert stats['wavelength'] == pytest.approx(1. / np.hypot(*k), rel=0.1)
+
+
+def test_trials():
+    fields = np.stack([plane_wave((2., 0.), 0.02, 1., 100), plane_wave((0., 1.), 0.01, 1., 100)])
+    stats = wave_statistics(fields, 1., EXTENT)
+    assert stats['speed'].shape == (2,)
+    np.testing.assert_allclose(stats['frequency'], [20., 10.], rtol=0.05)
+    for trial in range(2):
+        single = wave_statistics(fields[trial], 1., EXTENT)
+        np.testing.assert_allclose(stats['velocity'][trial], single['velocity'])
+
+
+def test_correlation_length_of_noise():
+    # uncorrelated fields decorrelate within one grid cell
+    fields = np.random.default_rng(3).normal(size=(50,) + SHAPE)
+    _, _, length = correlation_length(fields, EXTENT)
+    assert 0. < length < EXTENT[0] / SHAPE[0]
@@ -0,0 +1,249 @@
+"""
+Quantitative analysis of the propagation of activity in spatial networks.
+
+The input are spatiotemporal rate fields on a regular grid, see `spatial_fields.py`, with shape (frames x Gx x Gy)
+or (trials x frames x Gx x Gy); all results are computed for every trial at once. The layer is treated as a torus
+(`edge_wrap`), all correlations are circular and computed with FFTs:
+
+- the spatial autocorrelation of the rate fluctuations and the correlation length, where it drops below 1/e,
+- the dominant wavelength, at the peak of the spatial power spectrum,
+- the propagation velocity, from the displacement of the peak of the cross-correlation between frames t and t + lag,
+- the phase velocity and frequency of the dominant travelling wave, at the peak of the spatiotemporal power spectrum.
+
+Usage:
+    pos = LayerPositions.of(layer_e)
+    fields = fields_from_spikes(senders, times, pos.node_ids, pos, 0., simtime, 5., (32, 32), **pos.geometry)
+    stats = wave_statistics(fields, dt=5., extent=pos.extent)
+"""
+import numpy as np
+
+from rates import BinnedSpikes
+from spatial_fields import rate_fields_from_spikes
+
+
+def fields_from_spikes(senders, times, node_ids, positions, t_start, t_stop, dt, shape, extent=(1., 1.),
+                       center=(0., 0.), edge_wrap=True, statistic='mean', sigma=None):
+    """
+    Rate fields in consecutive frames of width dt.
+
+    :param senders: node ids of the spikes (array), or a list of arrays for several trials
+    :param times: spike times (ms, array), or a list of arrays for several trials
+    :param node_ids: node ids of the neurons
+    :param positions: (neurons x 2) positions (mm) or `LayerPositions`, in the order of `node_ids`
+    :param t_start: start of the first frame (ms)
+    :param t_stop: end of the last frame (ms)
+    :param dt: frame width (ms)
+    :param shape: number of grid cells (Gx, Gy)
+    :return: (frames x Gx x Gy) array, (trials x frames x Gx x Gy) for a list of trials
+    """
+    trials = isinstance(senders, (list, tuple))
+    if not trials:
+        senders, times = [senders], [times]
+
+    fields = []
+    for s, t in zip(senders, times):
+        binned = BinnedSpikes(s, t, node_ids, t_start, t_stop, bin_size=dt)
+        centres = t_start + (np.arange(binned.n_bins) + 0.5) * dt
+        fields.append(rate_fields_from_spikes(binned, positions, centres, dt, shape, extent, center, edge_wrap,
+                                              statistic, sigma))
+    fields = np.stack(fields)
+
+    return fields if trials else fields[0]
+
+
+def fluctuations(fields):
+    """
+    Fields minus their temporal mean in each grid cell; empty cells (nan) are set to zero.
+    """
+    fields = np.asarray(fields, dtype=float)
+    with np.errstate(invalid='ignore'):
+        delta = fields - np.nanmean(fields, axis=-3, keepdims=True)
+    return np.nan_to_num(delta, nan=0.)
+
+
+def cell_size(fields, extent):
+    return np.asarray(extent, dtype=float) / np.shape(fields)[-2:]
+
+
+def displacements(shape, extent):
+    """
+    Minimal-image displacements (mm) of the cells of a periodic grid, in FFT order (zero displacement at [0, 0]).
+
+    :return: dx, dy arrays of the given shape
+    """
+    dx = np.fft.fftfreq(shape[0], d=1. / shape[0]) * extent[0] / shape[0]
+    dy = np.fft.fftfreq(shape[1], d=1. / shape[1]) * extent[1] / shape[1]
+    return np.meshgrid(dx, dy, indexing='ij')
+
+
+def radial_average(values, radius, bin_width):
+    """
+    Average of the last two axes of `values` in rings of width `bin_width` around radius 0.
+
+    :return: ring centres, (... x rings) averages
+    """
+    ring = np.rint(radius / bin_width).astype(int).ravel()
+    n = np.bincount(ring)
+    onehot = np.zeros((ring.size, len(n)))
+    onehot[np.arange(ring.size), ring] = 1. / np.maximum(n[ring], 1)
+    averages = values.reshape(values.shape[:-2] + (-1,)) @ onehot
+    return np.arange(len(n)) * bin_width, np.where(n > 0, averages, np.nan)
+
+
+def spatial_autocorrelation(fields, extent=(1., 1.)):
+    """
+    Circular spatial autocorrelation of the rate fluctuations, averaged over frames and normalised to 1 at zero
+    displacement.
+
+    :param fields: (... x frames x Gx x Gy) rate fields
+    :param extent: size of the layer (mm)
+    :return: displacements dx, dy (mm, centred) and the (... x Gx x Gy) autocorrelation (centred)
+    """
+    delta = fluctuations(fields)
+    F = np.fft.fft2(delta, axes=(-2, -1))
+    acf = np.fft.ifft2(np.mean(np.abs(F) ** 2, axis=-3), axes=(-2, -1)).real
+    with np.errstate(invalid='ignore', divide='ignore'):
+        acf = acf / acf[..., :1, :1]
+    dx, dy = displacements(delta.shape[-2:], extent)
+    return (np.fft.fftshift(dx), np.fft.fftshift(dy)), np.fft.fftshift(acf, axes=(-2, -1))
+
+
+def correlation_length(fields, extent=(1., 1.)):
+    """
+    Distance (mm) at which the radially averaged spatial autocorrelation first drops below 1/e (linear
+    interpolation, nan if it does not).
+
+    :return: distances, (... x distances) radial autocorrelation, (...) correlation lengths
+    """
+    (dx, dy), acf = spatial_autocorrelation(fields, extent)
+    r, profile = radial_average(acf, np.hypot(dx, dy), np.min(cell_size(fields, extent)))
+
+    below = profile < np.exp(-1.)
+    first = np.argmax(below, axis=-1)
+    i = np.maximum(first, 1)
+    p0 = np.take_along_axis(profile, (i - 1)[..., None], axis=-1)[..., 0]
+    p1 = np.take_along_axis(profile, i[..., None], axis=-1)[..., 0]
+    length = r[i - 1] + (p0 - np.exp(-1.)) / (p0 - p1) * (r[i] - r[i - 1])
+    length = np.where(below.any(axis=-1), length, np.nan)
+
+    return r, profile, length
+
+
+def dominant_wavelength(fields, extent=(1., 1.)):
+    """
+    Wavelength (mm) of the peak of the radially averaged spatial power spectrum of the rate fluctuations (excluding
+    k = 0).
+
+    :return: wave numbers k (1/mm), (... x k) power, (...) wavelengths
+    """
+    delta = fluctuations(fields)
+    power = np.mean(np.abs(np.fft.fft2(delta, axes=(-2, -1))) ** 2, axis=-3)
+    shape = delta.shape[-2:]
+    kx = np.fft.fftfreq(shape[0], d=extent[0] / shape[0])
+    ky = np.fft.fftfreq(shape[1], d=extent[1] / shape[1])
+    k_abs = np.hypot(*np.meshgrid(kx, ky, indexing='ij'))
+    k, spectrum = radial_average(power, k_abs, 1. / np.max(extent))
+
+    peak = 1 + np.nanargmax(spectrum[..., 1:], axis=-1)
+    return k, spectrum, 1. / k[peak]
+
+
+def cross_correlation(fields, lags):
+    """
+    Circular spatial cross-correlation of the rate fluctuations of frames t and t + lag, averaged over t.
+
+    :param fields: (... x frames x Gx x Gy) rate fields
+    :param lags: frame lags
+    :return: (... x lags x Gx x Gy) cross-correlation in FFT order (zero displacement at [0, 0])
+    """
+    delta = fluctuations(fields)
+    F = np.fft.fft2(delta, axes=(-2, -1))
+    n = delta.shape[-3]
+    xcorr = [np.fft.ifft2(np.mean(np.conj(F[..., :n - lag, :, :]) * F[..., lag:, :, :], axis=-3),
+                          axes=(-2, -1)).real for lag in lags]
+    return np.stack(xcorr, axis=-3)
+
+
+def _peak_offset(xcorr):
+    # position of the maximum over the last two axes in cells (minimal image), refined by parabolic interpolation
+    # through the periodic neighbours along each axis
+    shape = xcorr.shape[-2:]
+    X = xcorr.reshape((-1,) + shape)
+    b = np.arange(len(X))
+    ix, iy = np.unravel_index(np.argmax(X.reshape(len(X), -1), axis=-1), shape)
+    offsets = []
+    for idx, n, neighbour in ((ix, shape[0], lambda s: X[b, (ix + s) % shape[0], iy]),
+                              (iy, shape[1], lambda s: X[b, ix, (iy + s) % shape[1]])):
+        lower, centre, upper = neighbour(-1), neighbour(0), neighbour(1)
+        curvature = lower - 2. * centre + upper
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shift = np.where(curvature < 0., 0.5 * (lower - upper) / curvature, 0.)
+        offsets.append((idx + n // 2) % n - n // 2 + shift)
+    return np.stack(offsets, axis=-1).reshape(xcorr.shape[:-2] + (2,))
+
+
+def propagation_velocity(fields, dt, extent=(1., 1.), max_lag=3):
+    """
+    Propagation velocity of the activity, from a least-squares fit of the displacement of the cross-correlation
+    peak over the lags 1..max_lag. The displacement per lag has to stay below half a wavelength, so frames should be
+    short compared to the time the activity needs to cross one wavelength.
+
+    :param fields: (... x frames x Gx x Gy) rate fields
+    :param dt: frame width (ms)
+    :param extent: size of the layer (mm)
+    :param max_lag: largest lag (frames)
+    :return: (... x 2) velocity (mm/ms = m/s), (...) speed (m/s)
+    """
+    lags = np.arange(1, max_lag + 1)
+    offsets = _peak_offset(cross_correlation(fields, lags)) * cell_size(fields, extent)
+    # fit of offset = velocity * lag * dt through the origin
+    tau = lags * dt
+    velocity = np.sum(offsets * tau[:, None], axis=-2) / np.sum(tau ** 2)
+    return velocity, np.linalg.norm(velocity, axis=-1)
+
+
+def phase_velocity(fields, dt, extent=(1., 1.)):
+    """
+    Phase velocity of the dominant plane wave, at the peak (f, k) of the spatiotemporal power spectrum of the rate
+    fluctuations (excluding k = 0): velocity = f k / |k|^2. Unlike `propagation_velocity` this is unambiguous for
+    extended, periodic wave fronts, but only meaningful if the activity is dominated by one travelling wave.
+
+    :param fields: (... x frames x Gx x Gy) rate fields
+    :param dt: frame width (ms)
+    :param extent: size of the layer (mm)
+    :return: (... x 2) velocity (mm/ms = m/s), (...) frequency (Hz) of the wave
+    """
+    delta = fluctuations(fields)
+    power = np.abs(np.fft.fftn(delta, axes=(-3, -2, -1))) ** 2
+    n, shape = delta.shape[-3], delta.shape[-2:]
+    power[..., 0, 0] = 0.
+    f = np.fft.fftfreq(n, d=dt)
+    kx = np.fft.fftfreq(shape[0], d=extent[0] / shape[0])
+    ky = np.fft.fftfreq(shape[1], d=extent[1] / shape[1])
+
+    i_f, i_x, i_y = np.unravel_index(np.argmax(power.reshape(power.shape[:-3] + (-1,)), axis=-1), power.shape[-3:])
+    # cos(2 pi (k x - f t)) has its power at (-f, k) and (f, -k)
+    k = np.stack((kx[i_x], ky[i_y]), axis=-1)
+    frequency = -f[i_f]
+    velocity = frequency[..., None] * k / np.sum(k ** 2, axis=-1, keepdims=True)
+    return velocity, np.abs(frequency) * 1e3
+
+
+def wave_statistics(fields, dt, extent=(1., 1.), max_lag=3):
+    """
+    Correlation length, dominant wavelength and propagation velocity of rate fields, per trial for
+    (trials x frames x Gx x Gy) fields.
+
+    :param fields: rate fields, e.g. of `fields_from_spikes`
+    :param dt: frame width (ms)
+    :param extent: size of the layer (mm)
+    :param max_lag: largest lag of the velocity fit (frames)
+    :return: dictionary with 'correlation_length' (mm), 'wavelength' (mm), 'velocity' (mm/ms), 'speed' (m/s),
+             'phase_velocity' (mm/ms) and 'frequency' (Hz, of the dominant wave)
+    """
+    _, _, length = correlation_length(fields, extent)
+    _, _, wavelength = dominant_wavelength(fields, extent)
+    velocity, speed = propagation_velocity(fields, dt, extent, max_lag)
+    phase, frequency = phase_velocity(fields, dt, extent)
+    return {'correlation_length': length, 'wavelength': wavelength, 'velocity': velocity, 'speed': speed,
+            'phase_velocity': phase, 'frequency': frequency}
@@ -0,0 +1,257 @@
+"""
+Benchmark suite for the modular connectivity generation in `modularity.py`.
+
+Every case of a parameter grid (population sizes, number of stimuli, modularity, rho0, delta) runs in a fresh process,
+recording the wall time of the layout computation (`get_source_clusters`, `get_topographic_probabilities`) and of the
+connection generation, the peak resident memory and the number of distinct connections. Results are written as JSON
+or CSV and can be compared against a stored baseline to flag regressions. Duplicate (source, target) pairs in the
+sparse output are counted separately and make the run fail. Baselines store the version of the connectivity generation
+(`modularity.__version__`), connection counts of baselines from other versions are not comparable.
+
+Usage:
+    python benchmark_modularity.py --grid quick --output baseline.json
+    python benchmark_modularity.py --grid quick --output new.json --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+GRIDS = {
+    'quick': {
+        'n_src': [1000, 10000],
+        'n_tgt': [1000, 10000],
+        'n_stim': [5, 10],
+        'modularity': [0., 0.9],
+        'rho0': [None, 0.3],
+        'delta': [0.],
+        'density': [0.05],
+        'method': ['sparse'],
+    },
+    'full': {
+        'n_src': [1000, 10000, 100000],
+        'n_tgt': [1000, 10000, 100000],
+        'n_stim': [5, 10, 20],
+        'modularity': [0., 0.5, 0.9],
+        'rho0': [None, 0.3],
+        'delta': [0., 0.05],
+        'density': [0.01],
+        'method': ['sparse', 'dense'],
+    },
+}
+
+# parameters that identify a case, used to match results against the baseline
+CASE_KEYS = ('n_src', 'n_tgt', 'n_stim', 'modularity', 'rho0', 'delta', 'density', 'method')
+# metrics compared against the baseline
+METRICS = ('time', 'peak_rss_mb')
+
+MAX_DENSE_BYTES = 2 * 1024 ** 3
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process in MB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024. ** 2 if sys.platform == 'darwin' else rss / 1024.
+
+
+def grid_cases(grid):
+    """
+    All combinations of the grid parameters, skipping dense matrices that do not fit into memory.
+    """
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        case = dict(zip(keys, values))
+        if case['method'] == 'dense' and case['n_src'] * case['n_tgt'] * 8 > MAX_DENSE_BYTES:
+            continue
+        yield case
+
+
+def run_case(case, seed=0):
+    """
+    Run one benchmark case, meant to be executed in a fresh process.
+
+    :param case: dictionary of grid parameters
+    :param seed: seed for the connectivity generation
+    :return: dictionary of parameters and results
+    """
+    import numpy as np
+    from modularity import __version__, ParameterSet, generate_modular_connections, get_modular_layout
+
+    result = dict(case, version=__version__, import_rss_mb=peak_rss_mb())
+    n_stim = case['n_stim']
+    mod_pars = ParameterSet({
+        'rho0': 1. / n_stim if case['rho0'] is None else case['rho0'],
+        'm': case['modularity'],
+        'sigma': case['density'],
+        'n_stim': n_stim,
+        'wE': 1.0,
+        'delta': case['delta'],
+    })
+
+    try:
+        start = time.perf_counter()
+        layout = get_modular_layout(case['n_src'], case['n_tgt'], mod_pars)
+        layout_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        A = generate_modular_connections(case['n_src'], case['n_tgt'], mod_pars, sparse=case['method'] == 'sparse',
+                                         rng=seed)[0]
+        gen_time = time.perf_counter() - start
+    except AssertionError as e:
+        # inconsistent parameter combination (e.g. non-integer map or overlap sizes)
+        result.update(status='invalid', error=str(e))
+        return result
+
+    peak = peak_rss_mb()
+    if case['method'] == 'sparse':
+        # count distinct (source, target) pairs, duplicates would become multapses when connected
+        n_entries = len(A['sources'])
+        nnz = len(np.unique(A['sources'].astype(np.int64) * case['n_tgt'] + A['targets']))
+    else:
+        n_entries = nnz = np.count_nonzero(A)
+
+    result.update(
+        status='ok',
+        overlap=bool(layout.v_overlap or layout.h_overlap),
+        layout_time=layout_time,
+        time=gen_time,
+        peak_rss_mb=peak,
+        nnz=int(nnz),
+        duplicates=int(n_entries - nnz),
+        connection_density=nnz / float(case['n_src'] * case['n_tgt']),
+    )
+    return result
+
+
+def run_suite(cases, repeat=1, seed=0):
+    """
+    Run all cases, each repetition in a fresh process. The fastest repetition and the largest peak memory are kept.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        runs = []
+        for _ in range(repeat):
+            with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+                runs.append(pool.apply(run_case, (case, seed)))
+
+        result = min(runs, key=lambda r: r.get('time', 0.))
+        if result['status'] == 'ok':
+            result['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+        results.append(result)
+        print(format_result(result), flush=True)
+
+    return results
+
+
+def format_result(result):
+    params = ' '.join('{}={}'.format(key, result[key]) for key in CASE_KEYS)
+    if result['status'] != 'ok':
+        return '{}  {}'.format(params, result['status'])
+    return '{}  time={:.3f}s  layout={:.4f}s  rss={:.0f}MB  nnz={}  duplicates={}'.format(
+        params, result['time'], result['layout_time'], result['peak_rss_mb'], result['nnz'], result['duplicates'])
+
+
+def case_key(result):
+    return tuple(result[key] for key in CASE_KEYS)
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare results against a baseline.
+
+    :param results: list of results
+    :param baseline: list of baseline results
+    :param threshold: relative increase of a metric that counts as regression
+    :return: list of (case, metric, baseline value, new value)
+    """
+    reference = {case_key(r): r for r in baseline if r['status'] == 'ok'}
+    regressions = []
+    for result in results:
+        ref = reference.get(case_key(result))
+        if result['status'] != 'ok' or ref is None:
+            continue
+        for metric in METRICS:
+            if result[metric] > ref[metric] * (1. + threshold):
+                regressions.append((case_key(result), metric, ref[metric], result[metric]))
+
+    return regressions
+
+
+def write_results(results, path):
+    if path.endswith('.csv'):
+        fields = sorted({key for r in results for key in r})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, 'w') as f:
+            json.dump({'platform': platform.platform(), 'python': platform.python_version(), 'results': results},
+                      f, indent=1)
+
+
+def read_results(path):
+    if path.endswith('.csv'):
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        # restore types from the CSV strings
+        for row in rows:
+            for key, value in row.items():
+                if value == '':
+                    row[key] = None
+                elif key not in ('method', 'status', 'error', 'overlap', 'version'):
+                    row[key] = float(value) if '.' in value or 'e' in value else int(value)
+        return rows
+
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', choices=sorted(GRIDS), default='quick', help='parameter grid')
+    parser.add_argument('--output', default='benchmark_modularity.json', help='results file (.json or .csv)')
+    parser.add_argument('--baseline', help='baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative increase flagged as regression')
+    parser.add_argument('--repeat', type=int, default=1, help='repetitions per case')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the connectivity generation')
+    args = parser.parse_args()
+
+    results = run_suite(list(grid_cases(GRIDS[args.grid])), repeat=args.repeat, seed=args.seed)
+    write_results(results, args.output)
+
+    failed = False
+    duplicates = [r for r in results if r['status'] == 'ok' and r['duplicates']]
+    for result in duplicates:
+        print('DUPLICATES {}: {}'.format(dict(zip(CASE_KEYS, case_key(result))), result['duplicates']))
+        failed = True
+
+    if args.baseline:
+        baseline = read_results(args.baseline)
+        versions = {r.get('version') for r in baseline} - {r.get('version') for r in results}
+        if versions:
+            print('Baseline generated with connectivity version {}, connection counts are not comparable; create a '
+                  'new baseline'.format(', '.join(str(v) for v in versions)))
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print('REGRESSION {}: {} {:.3f} -> {:.3f}'.format(dict(zip(CASE_KEYS, key)), metric, old, new))
+        if regressions:
+            failed = True
+        else:
+            print('No regressions above {:.0%}'.format(args.threshold))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
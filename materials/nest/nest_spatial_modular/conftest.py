@@ -0,0 +1,23 @@
+"""
+Fixtures shared by the tests in this directory.
+"""
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def membership_matrix():
+    """
+    Brute-force cluster memberships: `membership_matrix(intervals, n)` is a boolean [n x n_clusters] array, True where
+    a neuron is in a cluster. The clusters are (start, stop) tuples or contiguous index arrays.
+    """
+    from modularity import cluster_bounds
+
+    def membership_matrix(intervals, n):
+        member = np.zeros((n, len(intervals)), dtype=bool)
+        for cluster_idx, interval in enumerate(intervals):
+            start, stop = cluster_bounds(interval)
+            member[start:stop, cluster_idx] = True
+        return member
+
+    return membership_matrix
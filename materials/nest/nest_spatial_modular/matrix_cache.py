@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from modularity import __version__, ParameterSet, generate_modular_connections, get_modular_layout, modular_matrix, \
+    sparse_to_dense
+
+ARRAYS = ('sources', 'targets', 'weights', 'delays')
+
+
+class MatrixCache:
+    """
+    Persistent, content-addressed on-disk cache for modular connection matrices. Entries are keyed on a hash of the
+    generation parameters, the seed and the version of `modularity`, stored as one `.npy` file per COO array (see
+    `modularity.sparse_connections`) and memory-mapped on load. The total size of the cache is bounded, the least
+    recently used entries are evicted first.
+
+    Only seeded calls are cached, without a seed the matrices are not reproducible and are always generated.
+    """
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024 ** 3):
+        """
+        :param cache_dir: cache directory (default: ~/.cache/modular_matrices)
+        :param max_bytes: maximum total size of the cache in bytes
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'modular_matrices')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(func_name, **params):
+        """
+        Content hash of a generation call.
+
+        :param func_name: name of the generating function
+        :param params: all parameters (including the seed) that determine the result
+        :return: hex digest
+        """
+        content = json.dumps({'func': func_name, 'version': __version__, 'params': params},
+                             sort_keys=True, default=repr)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def load(self, key):
+        """
+        Load a cache entry, memory-mapping its arrays.
+
+        :param key:
+        :return: sparse connections or None if the entry does not exist
+        """
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+                      for name in meta.get('arrays', ARRAYS[:3])}
+        except (OSError, ValueError):
+            return None
+
+        # mark as recently used
+        os.utime(entry)
+        return ParameterSet(dict(arrays, shape=tuple(meta['shape'])))
+
+    def store(self, key, S):
+        """
+        Store sparse connections under the given key and evict old entries if the cache grows too large.
+
+        :param key:
+        :param S: sparse connections (see `modularity.sparse_connections`)
+        """
+        entry = os.path.join(self.cache_dir, key)
+        tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        arrays = [name for name in ARRAYS if name in S]
+        for name in arrays:
+            np.save(os.path.join(tmp_entry, name + '.npy'), S[name])
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+            json.dump({'shape': list(S['shape']), 'arrays': arrays, 'created': time.time()}, f)
+
+        # publish atomically, another process may have stored the same entry in the meantime
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        :return: list of (last access time, size in bytes, key) of all cache entries
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, key))
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits into `max_bytes`.
+
+        :param keep: key of an entry that must not be removed
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all cache entries.
+        """
+        for _, _, key in self.entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _cached(self, func_name, params, seed, generate):
+        if seed is None:
+            return generate()
+        key = self.key(func_name, seed=seed, **params)
+        S = self.load(key)
+        if S is None:
+            S = generate()
+            self.store(key, S)
+        return S
+
+    def generate_modular_connections(self, n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, plot=False,
+                                     sparse=False, seed=None, syn_pars=None):
+        """
+        Cached version of `modularity.generate_modular_connections`.
+
+        :param seed: integer seed, calls without seed are not cached
+        :return: weight matrix (or sparse connections), list of stimulus target segments, None
+        """
+        params = {'n_src': n_src, 'n_tgt': n_tgt, 'mod_pars': dict(mod_pars), 'src_layer': src_layer,
+                  'tgt_layer': tgt_layer, 'syn_pars': syn_pars}
+        S = self._cached('generate_modular_connections', params, seed,
+                         lambda: generate_modular_connections(n_src, n_tgt, mod_pars, src_layer, tgt_layer,
+                                                              sparse=True, rng=seed, syn_pars=syn_pars)[0])
+
+        stimulus_segments = list()
+        if plot:
+            layout = get_modular_layout(n_src, n_tgt, mod_pars, src_layer, tgt_layer)
+            stimulus_segments = [((min(src_pop), max(src_pop)), (start_idx, stop_idx - 1))
+                                 for src_pop, (start_idx, stop_idx) in zip(layout.src_clusters, layout.tgt_intervals)]
+
+        return (S if sparse else sparse_to_dense(S)), stimulus_segments, None
+
+    def modular_matrix(self, layer, N, src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None,
+                       sparse=False, seed=None, syn_pars=None):
+        """
+        Cached version of `modularity.modular_matrix`.
+
+        :param seed: integer seed, calls without seed are not cached
+        :return: adjacency matrix (or sparse connections)
+        """
+        params = {'src_neurons': src_neurons, 'tgt_neurons': tgt_neurons, 'n_clusters': n_clusters,
+                  'density': density, 'modularity': modularity, 'rho0': rho0, 'syn_pars': syn_pars}
+        S = self._cached('modular_matrix', params, seed,
+                         lambda: modular_matrix(layer, N, sparse=True, rng=seed, **params))
+
+        return S if sparse else sparse_to_dense(S)
@@ -0,0 +1,246 @@
+"""
+Mean-field (diffusion approximation) predictions for the Brunel network of `helpers.py`: sparsely connected E and I
+populations of identical `iaf_psc_delta` neurons with CE excitatory and CI inhibitory inputs and Poisson input of
+rate `nu_ext` through one connection of weight w (model A of [1], E and I neurons fire at the same rate).
+
+All functions are vectorised, parameters broadcast against each other, so whole parameter grids are evaluated at
+once. Rates are in spikes/s, times in ms and voltages in mV.
+
+The stability of the stationary state follows [1]: the linear response of the neurons to modulations of the mean and
+the variance of their input, computed by threshold integration of the Fokker-Planck equation [2], closes the loop
+through the recurrent connections with the delay d. The asynchronous state is unstable if the open-loop gain reaches
+1 at a frequency where its phase is a multiple of 2 pi (fast oscillations of the synchronous irregular state and the
+synchronous regular state), or if the slope of the transfer function exceeds 1 (run-away excitation). The slow
+oscillations of [1] close to the threshold rate are not covered.
+
+[1] Brunel N (2000) Dynamics of sparsely connected networks of excitatory and inhibitory spiking neurons.
+    J Comput Neurosci 8:183-208
+[2] Richardson MJE (2007) Firing-rate response of linear and nonlinear integrate-and-fire neurons to modulated
+    current-based and conductance-based synaptic drive. Phys Rev E 76:021919
+"""
+import numpy as np
+from scipy.special import dawsn, erfcx
+
+import helpers
+
+_NODES, _WEIGHTS = np.polynomial.legendre.leggauss(32)
+
+
+def _integral_erfcx(x):
+    """
+    Integral of erfcx(u) from 0 to x (x >= 0), by Gauss-Legendre quadrature on [0, 1] and, for the slowly decaying
+    tail, on [1, x] after substituting u = exp(s).
+    """
+    x = np.asarray(x, dtype=float)
+    lo = np.minimum(x, 1.)[..., None]
+    hi = np.log(np.maximum(x, 1.))[..., None]
+
+    u = 0.5 * lo * (_NODES + 1.)
+    integral = 0.5 * lo[..., 0] * np.sum(_WEIGHTS * erfcx(u), axis=-1)
+    u = np.exp(0.5 * hi * (_NODES + 1.))
+    integral += 0.5 * hi[..., 0] * np.sum(_WEIGHTS * erfcx(u) * u, axis=-1)
+
+    return integral
+
+
+def siegert(mu, sigma, tau_m, t_ref, theta, V_reset):
+    """
+    Stationary firing rate of a leaky integrate-and-fire neuron driven by white noise (Siegert formula),
+        1 / rate = t_ref + tau_m * sqrt(pi) * int_{y_r}^{y_th} exp(u^2) (1 + erf(u)) du,
+    with y_th = (theta - mu) / sigma and y_r = (V_reset - mu) / sigma. The integrand equals erfcx(-u), for u > 0 it is
+    split into 2 exp(u^2) - erfcx(u), whose first part is integrated with the Dawson function.
+
+    :param mu: mean input (mV, relative to E_L)
+    :param sigma: standard deviation of the input (mV)
+    :param tau_m: membrane time constant (ms)
+    :param t_ref: refractory period (ms)
+    :param theta: spike threshold (mV, relative to E_L)
+    :param V_reset: reset potential (mV, relative to E_L)
+    :return: rate (spikes/s)
+    """
+    sigma = np.maximum(sigma, 1e-12)
+    y_th = (theta - mu) / sigma
+    y_r = (V_reset - mu) / sigma
+
+    # part of the integral over u < 0
+    negative = np.where(y_r < 0., _integral_erfcx(np.maximum(-y_r, 0.)) - _integral_erfcx(np.maximum(-y_th, 0.)), 0.)
+
+    # part of the integral over u > 0, exp(b^2) only overflows if the rate is vanishingly small
+    a, b = np.maximum(y_r, 0.), np.maximum(y_th, 0.)
+    with np.errstate(over='ignore', invalid='ignore'):
+        positive = 2. * np.exp(b ** 2) * (dawsn(b) - np.exp(a ** 2 - b ** 2) * dawsn(a)) - \
+            (_integral_erfcx(b) - _integral_erfcx(a))
+        rate = 1e3 / (t_ref + tau_m * np.sqrt(np.pi) * (negative + positive))
+
+    return np.nan_to_num(rate, nan=0.)
+
+
+def input_statistics(rate, nu_ext, CE=helpers.CE, CI=helpers.CI, g=helpers.g, w=helpers.w,
+                     neuron_params=helpers.neuron_params):
+    """
+    Mean and standard deviation of the free membrane potential of a neuron in the network.
+
+    :param rate: rate of the recurrent inputs (spikes/s)
+    :param nu_ext: rate of the external Poisson input (spikes/s), e.g. `helpers.p_rate`
+    :return: mu, sigma (mV)
+    """
+    tau_m = neuron_params['tau_m']
+    r, x = np.asarray(rate) * 1e-3, np.asarray(nu_ext) * 1e-3
+    mu = tau_m * w * (CE * r - g * CI * r + x) + neuron_params['I_e'] * tau_m / neuron_params['C_m']
+    sigma = np.sqrt(tau_m * w ** 2 * (CE * r + g ** 2 * CI * r + x))
+    return mu, sigma
+
+
+def transfer(rate, nu_ext, CE=helpers.CE, CI=helpers.CI, g=helpers.g, w=helpers.w,
+             neuron_params=helpers.neuron_params):
+    """
+    Output rate of a neuron whose recurrent inputs fire at `rate` (spikes/s).
+    """
+    mu, sigma = input_statistics(rate, nu_ext, CE, CI, g, w, neuron_params)
+    E_L = neuron_params['E_L']
+    return siegert(mu, sigma, neuron_params['tau_m'], neuron_params['t_ref'], neuron_params['V_th'] - E_L,
+                   neuron_params['V_reset'] - E_L)
+
+
+def linear_response(mu, sigma, f, neuron_params=helpers.neuron_params, n_reset=200):
+    """
+    Stationary rate and linear rate response of a leaky integrate-and-fire neuron driven by white noise to sinusoidal
+    modulations of the mean mu and of the variance sigma^2 of its input, by threshold integration of the
+    Fokker-Planck equation [2]: the density and the flux are integrated from the threshold down to well below the
+    reset and the lower boundary condition (vanishing flux) fixes the response. The voltage step is
+    (V_th - V_reset) / n_reset.
+
+    :param mu: mean input (mV, relative to E_L)
+    :param sigma: standard deviation of the input (mV), as in `input_statistics`
+    :param f: frequencies (Hz, > 0), broadcast against the trailing axis
+    :param neuron_params: parameters of the `iaf_psc_delta` neurons
+    :param n_reset: number of voltage steps between reset and threshold
+    :return: rate (spikes/s, shape of mu and sigma), response to mu and to sigma^2 ((spikes/s) / mV and
+             (spikes/s) / mV^2, complex, shape of mu and sigma plus the axis of f)
+    """
+    tau_m, t_ref = neuron_params['tau_m'], neuron_params['t_ref']
+    theta = neuron_params['V_th'] - neuron_params['E_L']
+    V_reset = neuron_params['V_reset'] - neuron_params['E_L']
+    mu, sigma = np.broadcast_arrays(np.asarray(mu, dtype=float)[..., None], np.asarray(sigma, dtype=float)[..., None])
+    s2 = np.maximum(sigma, 1e-12) ** 2
+    iw = 2j * np.pi * np.asarray(f, dtype=float) * 1e-3
+
+    # the densities decay within a few sigma below min(mu, V_reset)
+    dV = (theta - V_reset) / float(n_reset)
+    n = n_reset + int(np.ceil(np.max(V_reset - np.minimum(V_reset, mu) + 4. * sigma) / dV))
+
+    def steps():
+        # exponential integrator of dp/dV = 2 (mu - V) / sigma^2 p + b, from V to V - dV
+        for k in range(n):
+            x = 2. * (theta - k * dV - mu) / s2 * dV
+            yield k, np.exp(x), dV * np.where(np.abs(x) > 1e-8, np.expm1(x) / np.where(x == 0., 1., x), 1.)
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        # stationary density for a unit flux between reset and threshold
+        p0 = np.zeros((n + 1,) + mu.shape)
+        for k, growth, phi in steps():
+            p0[k + 1] = p0[k] * growth + 2. * tau_m / s2 * (k < n_reset) * phi
+        rate = 1. / (t_ref + dV * np.sum(p0[:-1], axis=0))
+        P0 = rate * p0
+
+        # free solution (unit flux at threshold, re-injected at the reset after t_ref) and solutions driven by the
+        # modulation of mu and of sigma^2, each with zero density at threshold
+        p_r, j_r = np.zeros(np.broadcast_shapes(mu.shape, iw.shape), dtype=complex), 1.
+        p_mu, j_mu, p_s2, j_s2 = 0., 0., 0., 0.
+        for k, growth, phi in steps():
+            dP0 = 2. / s2 * ((mu - theta + k * dV) * P0[k] - tau_m * rate * (k < n_reset))
+            j_r, p_r = j_r + dV * iw * p_r, p_r * growth + 2. / s2 * tau_m * j_r * phi
+            j_mu, p_mu = j_mu + dV * iw * p_mu, p_mu * growth + 2. / s2 * (tau_m * j_mu - P0[k]) * phi
+            j_s2, p_s2 = j_s2 + dV * iw * p_s2, p_s2 * growth + 1. / s2 * (2. * tau_m * j_s2 + dP0) * phi
+            if k + 1 == n_reset:
+                j_r = j_r - np.exp(-iw * t_ref)
+
+        response_mu = np.nan_to_num(-j_mu / j_r, nan=0., posinf=0., neginf=0.) * 1e3
+        response_s2 = np.nan_to_num(-j_s2 / j_r, nan=0., posinf=0., neginf=0.) * 1e3
+
+    return np.nan_to_num(rate[..., 0], nan=0.) * 1e3, response_mu, response_s2
+
+
+def self_consistent_rate(nu_ext, g=helpers.g, CE=helpers.CE, CI=helpers.CI, w=helpers.w, d=helpers.d,
+                         neuron_params=helpers.neuron_params, tau_s=0., f_max=1e3, df=2.5, tol=1e-6):
+    """
+    Stationary rates and their stability for a grid of parameters (all parameters broadcast against each other).
+
+    The rate solves rate = transfer(rate) and is found by bisection between 0 and 1 / t_ref, which converges for any
+    parameters (if there are several solutions in excitation-dominated networks, one of them is returned).
+    A perturbation of the rate changes the mean and the variance of the input of all neurons after the delay d, the
+    open-loop gain is
+        L(f) = exp(-2 pi i f d) tau_m (w (CE - g CI) R_mu(f) + w^2 (CE + g^2 CI) R_sigma2(f)) / (1 + 2 pi i f tau_s)
+    with the linear responses R of `linear_response`. The state is oscillatory unstable if L(f) crosses the real axis
+    right of 1 (Nyquist criterion) and unstable to run-away excitation if the slope of the transfer function exceeds
+    1. This only approximates the dynamics of the spiking network, points close to the boundary still need to be
+    simulated.
+
+    :param nu_ext: rate of the external Poisson input (spikes/s)
+    :param g: relative inhibitory to excitatory synaptic weight
+    :param CE: indegree from excitatory neurons
+    :param CI: indegree from inhibitory neurons
+    :param w: excitatory synaptic weight (mV)
+    :param d: synaptic transmission delay (ms)
+    :param neuron_params: parameters of the `iaf_psc_delta` neurons
+    :param tau_s: time constant of an optional low-pass filter of the recurrent input (ms, 0 for delta synapses)
+    :param f_max: highest frequency of the stability analysis (Hz)
+    :param df: frequency resolution of the stability analysis (Hz)
+    :param tol: absolute tolerance of the rate (spikes/s)
+    :return: dictionary of arrays: 'rate' (spikes/s), 'mu', 'sigma' (mV), 'slope', 'mean_driven' (mu above
+             threshold), 'stable', 'oscillatory' and 'frequency' (Hz, of the oscillatory instability, else nan)
+    """
+    nu_ext, g, CE, CI, w, d = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in (nu_ext, g, CE, CI, w, d)))
+    pars = {'CE': CE, 'CI': CI, 'g': g, 'w': w, 'neuron_params': neuron_params}
+
+    lo = np.zeros(nu_ext.shape)
+    hi = np.full(nu_ext.shape, 1e3 / neuron_params['t_ref'])
+    while np.max(hi - lo) > tol:
+        mid = 0.5 * (lo + hi)
+        above = transfer(mid, nu_ext, **pars) > mid
+        lo = np.where(above, mid, lo)
+        hi = np.where(above, hi, mid)
+    rate = 0.5 * (lo + hi)
+
+    h = np.maximum(1e-3 * rate, 1e-3)
+    slope = (transfer(rate + h, nu_ext, **pars) - transfer(np.maximum(rate - h, 0.), nu_ext, **pars)) / \
+        (rate + h - np.maximum(rate - h, 0.))
+
+    # open-loop gain, the rate perturbation is in spikes/ms
+    mu, sigma = input_statistics(rate, nu_ext, **pars)
+    f = np.arange(df, f_max + df / 2., df)
+    _, response_mu, response_s2 = linear_response(mu, sigma, f, neuron_params)
+    tau_m = neuron_params['tau_m']
+    gain = tau_m * (w * (CE - g * CI))[..., None] * response_mu + \
+        tau_m * (w ** 2 * (CE + g ** 2 * CI))[..., None] * response_s2
+    L = gain * 1e-3 * np.exp(-2j * np.pi * f * 1e-3 * d[..., None]) / (1. + 2j * np.pi * f * 1e-3 * tau_s)
+
+    # crossings of the real axis right of 1, the instability grows at the one with the largest gain
+    crossing = (np.signbit(L.imag[..., 1:]) != np.signbit(L.imag[..., :-1])) & \
+        (0.5 * (L.real[..., 1:] + L.real[..., :-1]) > 1.)
+    oscillatory = crossing.any(axis=-1)
+    peak = np.argmax(np.where(crossing, L.real[..., 1:], -np.inf), axis=-1)
+
+    return {
+        'rate': rate,
+        'mu': mu,
+        'sigma': sigma,
+        'slope': slope,
+        'mean_driven': mu > neuron_params['V_th'] - neuron_params['E_L'],
+        'stable': (slope < 1.) & ~oscillatory,
+        'oscillatory': oscillatory,
+        'frequency': np.where(oscillatory, 0.5 * (f[peak] + f[peak + 1]), np.nan),
+    }
+
+
+def ai_candidates(prediction, rate_range=(0.5, 50.)):
+    """
+    Parameter sets predicted to be in the asynchronous irregular state: stable and with a rate in the given range.
+    Only these need to be simulated.
+
+    :param prediction: result of `self_consistent_rate`
+    :param rate_range: (min, max) rate (spikes/s)
+    :return: boolean array
+    """
+    rate = prediction['rate']
+    return prediction['stable'] & (rate >= rate_range[0]) & (rate <= rate_range[1])
@@ -1,8 +1,15 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as pl
 import matplotlib.patches as patches
 import numpy as np
 import nest
 
+# version of the connectivity generation, change whenever the same parameters and seed lead to different matrices
+__version__ = '2.2'
+
+
 class ParameterSet(dict):
     """dot.notation access to dictionary attributes"""
     __getattr__ = dict.get
@@ -103,6 +110,90 @@ def get_source_clusters(n_src, n_stim, rho_src=None):
 
     return clusters
 
+def get_target_intervals(n_tgt, n_stim, rho_tgt):
+    """
+    Returns the [start, stop) index intervals of the stimulus-specific maps in the target population, placed in the
+    same way as the source clusters (see `get_source_clusters`).
+
+    :param n_tgt:
+    :param n_stim:
+    :param rho_tgt:
+    :return: list of (start, stop) tuples, overlap between neighbouring maps
+    """
+    map_size = get_map_size(rho_tgt, n_tgt)
+
+    if no_overlap(rho_tgt, n_stim, map_size, n_tgt):
+        return [(map_size * n, map_size * (n + 1)) for n in range(n_stim)], 0
+
+    overlap = get_overlap_size(map_size, 0, n_tgt, n_stim)
+    intervals = [(0, map_size)]
+    for map_idx in range(1, n_stim):
+        start_idx = intervals[-1][1] - overlap
+        intervals.append((start_idx, start_idx + map_size))
+
+    return intervals, overlap
+
+
+def cluster_bounds(interval):
+    """
+    (start, stop) of a cluster given either as (start, stop) tuple or as contiguous index array.
+    """
+    if isinstance(interval, tuple):
+        return interval
+    return interval[0], interval[-1] + 1
+
+
+def get_membership_lists(intervals, n):
+    """
+    Cluster memberships of n neurons in compressed sparse row format: the clusters of neuron i are
+    `labels[indptr[i]:indptr[i + 1]]`, in increasing order. Neighbouring clusters may overlap, for rho > 2 / n_stim a
+    neuron belongs to three or more clusters.
+
+    :param intervals: list of (start, stop) tuples or index arrays, one per cluster
+    :param n: number of neurons
+    :return: indptr (n + 1) and labels (total size of all clusters) arrays
+    """
+    bounds = [cluster_bounds(interval) for interval in intervals]
+    neurons = np.concatenate([np.arange(start, stop) for start, stop in bounds] + [np.empty(0, dtype=int)])
+    labels = np.repeat(np.arange(len(bounds)), [stop - start for start, stop in bounds])
+
+    order = np.lexsort((labels, neurons))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(neurons, minlength=n), out=indptr[1:])
+
+    return indptr, labels[order]
+
+
+def expand_memberships(indptr, labels, idx):
+    """
+    All memberships of the neurons idx (see `get_membership_lists`), one entry per (neuron, cluster) pair.
+
+    :return: position in idx and cluster label of each membership
+    """
+    start = indptr[idx]
+    n = indptr[np.asarray(idx) + 1] - start
+    owner = np.repeat(np.arange(len(n)), n)
+    # position of each membership within the memberships of its neuron
+    rank = np.arange(len(owner)) - np.repeat(np.cumsum(n) - n, n)
+    return owner, labels[start[owner] + rank]
+
+
+def get_membership_bits(intervals, n):
+    """
+    Cluster memberships of n neurons as bit sets: bit k % 64 of word k // 64 is set if the neuron belongs to cluster k.
+    Two neurons share a cluster if the bitwise and of their words is nonzero in any word.
+
+    :param intervals: list of (start, stop) tuples or index arrays, one per cluster
+    :param n: number of neurons
+    :return: uint64 array [n x ceil(n_clusters / 64)]
+    """
+    indptr, labels = get_membership_lists(intervals, n)
+    bits = np.zeros((n, max(1, (len(intervals) + 63) // 64)), dtype=np.uint64)
+    neurons = np.repeat(np.arange(n), np.diff(indptr))
+    np.bitwise_or.at(bits, (neurons, labels // 64), np.left_shift(np.uint64(1), (labels % 64).astype(np.uint64)))
+    return bits
+
+
 def get_all_clusters(n_layers, n_stim, N, NE, NI, rho_src=None):
     """
     :return:
@@ -126,7 +217,152 @@ def get_all_clusters(n_layers, n_stim, N, NE, NI, rho_src=None):
 
 
 
+class ClusterIndex:
+    """
+    Index of the stimulus-specific clusters of all layers of a modular network, built from the layer NodeCollections
+    instead of assumptions on the node ids. Provides the clusters as slices of the (primitive) layer NodeCollections
+    and a node id -> (layer, population, cluster) lookup, which splits the spikes of one recorder per layer into
+    per-cluster rates with a single `np.bincount`.
+    """
+    def __init__(self, layers, n_stim, rho_src=None):
+        """
+        :param layers: dictionary of lists of NodeCollections (one per layer) for each population, e.g.
+                       {'E': [..], 'I': [..]}, each NodeCollection holding contiguous node ids
+        :param n_stim: number of stimuli (clusters)
+        :param rho_src: relative size of the clusters (default: 1 / n_stim)
+        """
+        self.populations = list(layers)
+        self.n_layers = len(layers[self.populations[0]])
+        self.n_stim = n_stim
+        self.clusters = {pop: [] for pop in self.populations}
+
+        blocks = []
+        for pop_idx, pop in enumerate(self.populations):
+            for layer_idx, nodes in enumerate(layers[pop]):
+                intervals = [cluster_bounds(c) for c in get_source_clusters(len(nodes), n_stim, rho_src)]
+                self.clusters[pop].append([nodes[start:stop] for start, stop in intervals])
+                blocks.append((layer_idx, pop_idx, nodes[0].global_id, len(nodes), intervals))
+
+        self.offset = min(b[2] for b in blocks)
+        size = max(b[2] + b[3] for b in blocks) - self.offset
+
+        # lookup arrays indexed by node id - offset, -1 for nodes that are not part of the network
+        self.layer = np.full(size, -1, dtype=np.int32)
+        self.population = np.full(size, -1, dtype=np.int32)
+
+        # cluster memberships in compressed sparse row format (see `get_membership_lists`), neurons in overlaps belong
+        # to two or more clusters
+        n_memberships = np.zeros(size, dtype=np.int64)
+        block_labels = []
+        for layer_idx, pop_idx, first_id, n, intervals in blocks:
+            idx = slice(first_id - self.offset, first_id - self.offset + n)
+            self.layer[idx] = layer_idx
+            self.population[idx] = pop_idx
+            indptr, labels = get_membership_lists(intervals, n)
+            n_memberships[idx] = np.diff(indptr)
+            block_labels.append((first_id, labels))
+
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(n_memberships, out=self.indptr[1:])
+        block_labels.sort(key=lambda b: b[0])
+        self.labels = np.concatenate([labels for _, labels in block_labels]).astype(np.int32)
+
+    def memberships(self, node_ids):
+        """
+        All cluster memberships of the given node ids.
+
+        :param node_ids: array of node ids
+        :return: position of the node in `node_ids` and cluster label of each membership
+        """
+        return expand_memberships(self.indptr, self.labels, np.asarray(node_ids) - self.offset)
+
+    def lookup(self, node_ids):
+        """
+        :param node_ids: array of node ids
+        :return: layer, population index and first cluster (-1 if none) of each node; all clusters of nodes in
+                 overlaps are given by `memberships`
+        """
+        idx = np.asarray(node_ids) - self.offset
+        start = self.indptr[idx]
+        first = np.where(self.indptr[idx + 1] > start, self.labels[np.minimum(start, len(self.labels) - 1)], -1)
+        return self.layer[idx], self.population[idx], first
+
+    def count(self, node_ids):
+        """
+        Number of occurrences of the given node ids (e.g. spike senders) in each cluster, nodes in overlaps are
+        counted in all of their clusters.
+
+        :param node_ids: array of node ids
+        :return: array [n_layers x n_populations x n_stim]
+        """
+        idx = np.asarray(node_ids) - self.offset
+        base = (self.layer[idx] * len(self.populations) + self.population[idx]) * self.n_stim
+        n_bins = self.n_layers * len(self.populations) * self.n_stim
+
+        owner, labels = self.memberships(node_ids)
+        counts = np.bincount(base[owner] + labels, minlength=n_bins).astype(float)
+
+        return counts.reshape(self.n_layers, len(self.populations), self.n_stim)
+
+    def cluster_rates(self, senders, duration, recorded=None):
+        """
+        Firing rates of all clusters from the spike senders of any number of recorders.
+
+        :param senders: node ids of the spike senders
+        :param duration: recording duration (ms)
+        :param recorded: node ids of the recorded neurons (default: all neurons)
+        :return: dictionary with an array [n_layers x n_stim] of rates (spikes/s) per population
+        """
+        if recorded is None:
+            recorded = np.flatnonzero(self.layer >= 0) + self.offset
+        counts = self.count(senders)
+        sizes = self.count(recorded)
+        rates = np.divide(counts, sizes, out=np.full(counts.shape, np.nan), where=sizes > 0) / duration * 1e3
+
+        return {pop: rates[:, pop_idx] for pop_idx, pop in enumerate(self.populations)}
+
+
+def sparse_connections(sources, targets, shape, weights=1., delays=None):
+    """
+    Stores a connection matrix in COO format, i.e., as (source, target, weight) triplets. Memory scales with the
+    number of connections instead of the size of the matrix.
+
+    :param sources: row (source neuron) indices
+    :param targets: column (target neuron) indices
+    :param shape: (n_src, n_tgt)
+    :param weights: scalar or array of weights
+    :param delays: scalar or array of delays (None to leave the delays to the synapse specification)
+    :return: ParameterSet with int32 `sources` and `targets`, float32 `weights` (and `delays`) and `shape`
+    """
+    sources = np.asarray(sources, dtype=np.int32)
+    targets = np.asarray(targets, dtype=np.int32)
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float32), sources.shape).copy()
+
+    S = ParameterSet({'sources': sources, 'targets': targets, 'weights': weights, 'shape': tuple(shape)})
+    if delays is not None:
+        S['delays'] = np.broadcast_to(np.asarray(delays, dtype=np.float32), sources.shape).copy()
+    return S
+
+
+def is_sparse(A):
+    """
+    Check if a connection matrix is stored in COO format (see `sparse_connections`).
+    """
+    return isinstance(A, dict)
+
+
+def sparse_to_dense(S):
+    """
+    Expands sparse connections (see `sparse_connections`) into a dense weight matrix.
+    """
+    A = np.zeros(S['shape'])
+    A[S['sources'], S['targets']] = S['weights']
+    return A
+
+
 def compute_density_matrix(A):
+    if is_sparse(A):
+        return len(A['sources']) / float(A['shape'][0] * A['shape'][1])
     return np.count_nonzero(A) / float(A.shape[0] * A.shape[1])
 
 
@@ -187,17 +423,82 @@ def get_topographic_probabilities(sigma, m, n_stim, n_src, n_tgt, map_size_src,
     return x[0], x[1]
 
 
-def generate_modular_connections(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, plot=False, debug=False):
+def sample_without_replacement(n, k, rng):
     """
-    Generates a structured feed-forward connection matrix.
+    Draws k distinct integers from [0, n) without materialising and permuting all n items. Sparse draws (k <= n / 50)
+    use the hash-based Floyd sampler of numpy.random.Generator, which is O(k) in memory and time. Denser draws mark
+    values drawn with replacement in a boolean mask until k distinct ones are hit (n bytes, i.e. at most 50 bytes per
+    sample), for k > n / 2 the complement is sampled instead.
+
+    :param n: population size
+    :param k: number of samples
+    :param rng: numpy.random.Generator
+    :return: int64 array of length k
+    """
+    if k <= n // 50:
+        return rng.choice(n, k, replace=False, shuffle=False)
 
-    :param n_src: number of source neurons (e.g., generators / channels)
+    if k > n // 2:
+        mask = np.ones(n, dtype=bool)
+        mask[sample_without_replacement(n, n - k, rng)] = False
+        return np.flatnonzero(mask)
+
+    mask = np.zeros(n, dtype=bool)
+    n_drawn = 0
+    while n_drawn < k:
+        mask[rng.integers(0, n, size=k - n_drawn)] = True
+        n_drawn = np.count_nonzero(mask)
+
+    return np.flatnonzero(mask)
+
+
+def sample_rows_without_replacement(n_rows, n, k, rng):
+    """
+    Draws k distinct integers from [0, n) independently for each of n_rows rows in one batch.
+
+    :param n_rows: number of rows
+    :param n: population size
+    :param k: number of samples per row
+    :param rng: numpy.random.Generator
+    :return: int64 array [n_rows x k]
+    """
+    if k > n // 4:
+        return np.argpartition(rng.random((n_rows, n)), k - 1, axis=1)[:, :k] if k else np.empty((n_rows, 0), int)
+
+    drawn = rng.integers(0, n, size=(n_rows, k))
+    while True:
+        drawn.sort(axis=1)
+        duplicates = np.zeros(drawn.shape, dtype=bool)
+        duplicates[:, 1:] = drawn[:, 1:] == drawn[:, :-1]
+        n_duplicates = np.count_nonzero(duplicates)
+        if not n_duplicates:
+            return drawn
+        drawn[duplicates] = rng.integers(0, n, size=n_duplicates)
+
+
+def _hypergeometric(rng, ngood, nbad, nsample):
+    """
+    Hypergeometric draw that falls back to the binomial approximation for populations numpy cannot handle.
+    """
+    if not nsample:
+        return 0
+    if ngood + nbad < 10 ** 9:
+        return rng.hypergeometric(ngood, nbad, nsample)
+    return min(rng.binomial(nsample, ngood / (ngood + nbad)), ngood, nsample)
+
+
+def get_modular_layout(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, debug=False):
+    """
+    Computes the cluster structure of a modular feed-forward connection matrix: source clusters, target intervals,
+    their overlaps and the intra-/inter-cluster connection probabilities.
+
+    :param n_src: number of source neurons
     :param n_tgt: number of neurons in target populations
+    :param mod_pars: modularity parameters (see `modular_matrix`)
     :param src_layer: index of the source layer
     :param tgt_layer: index of the target layer (usually src_layer + 1)
-    :param plot:
     :param debug:
-    :return: numpy array of weights [n_src x n_targets]
+    :return: ParameterSet
     """
     # if not hasattr(mod_pars, 'rho'):
     rho_src = mod_pars.rho0 + src_layer * mod_pars.delta  # i-1
@@ -206,6 +507,7 @@ def generate_modular_connections(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=
     #     rho_src = mod_pars.rho0 if src_layer == 0 else mod_pars.rho
     #     rho_tgt = mod_pars.rho
     src_clusters = get_source_clusters(n_src=n_src, n_stim=mod_pars.n_stim, rho_src=rho_src)
+    tgt_intervals, h_overlap = get_target_intervals(n_tgt=n_tgt, n_stim=mod_pars.n_stim, rho_tgt=rho_tgt)
 
     # compute size of map (#neurons) in target layer
     map_size_tgt = get_map_size(rho_tgt, n_tgt)
@@ -214,126 +516,631 @@ def generate_modular_connections(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=
     p_c, p_0 = get_topographic_probabilities(mod_pars.sigma, mod_pars.m, mod_pars.n_stim, n_src, n_tgt,
                                              map_size_src, map_size_tgt, debug)
 
-    A = np.zeros((n_src, n_tgt))
+    return ParameterSet({
+        'n_src': n_src,
+        'n_tgt': n_tgt,
+        'src_clusters': src_clusters,
+        'tgt_intervals': tgt_intervals,
+        'map_size_src': map_size_src,
+        'map_size_tgt': map_size_tgt,
+        # overlap between the modules in the source population (vertical in the FF connection matrix)
+        'v_overlap': len(set(src_clusters[0]).intersection(src_clusters[1])) if len(src_clusters) > 1 else 0,
+        # overlap between the modules among the target neurons (horizontal in the FF connection matrix)
+        'h_overlap': h_overlap,
+        'p_c': p_c,
+        'p_0': p_0,
+    })
 
-    start_idx = 0
-    stop_idx = map_size_tgt
 
-    # overlap between the modules among the target neurons (will change later - horizontal in the FF conn matrix)
-    h_overlap = 0
-    # overlap between the modules in the source population (vertical in the FF connection matrix; same for all clusters)
-    v_overlap = len(set(src_clusters[0]).intersection(src_clusters[1]))
+def intra_cluster_mask(layout, sources, targets):
+    """
+    Flags the connections within a stimulus-specific cluster, i.e., from a source neuron of cluster k onto a target
+    neuron of interval k for any k (neurons in overlaps belong to two or more clusters).
 
-    stimulus_segments = list()
+    :param layout: cluster layout (see `get_modular_layout`)
+    :param sources: source neuron indices
+    :param targets: target neuron indices
+    :return: boolean array
+    """
+    src_bits = get_membership_bits(layout.src_clusters, layout.n_src)
+    tgt_bits = get_membership_bits(layout.tgt_intervals, layout.n_tgt)
 
-    # deal with stimulus specific clusters
-    for map_idx, src_pop in enumerate(src_clusters):
-        # if we can create entirely segregated clusters, without any overlap, and we actually want it
-        if rho_tgt <= 1./mod_pars.n_stim and map_size_tgt * mod_pars.n_stim <= n_tgt:
-            start_idx = map_idx * map_size_tgt
-            stop_idx = int((map_idx + 1) * map_size_tgt)
+    intra = np.zeros(len(sources), dtype=bool)
+    for word in range(src_bits.shape[1]):
+        intra |= (src_bits[sources, word] & tgt_bits[targets, word]) != 0
+    return intra
 
-        # handle overlap
+
+def draw_synapse_parameters(intra, syn_pars, rng):
+    """
+    Draws per-connection synapse parameters (e.g., weights and delays) for all connections at once. Each entry of
+    `syn_pars` maps a parameter name to a dictionary with the keys
+        'mean': mean value
+        'intra_scale', 'inter_scale': factors for intra-/inter-cluster connections (default 1)
+        'distribution': 'constant' (default), 'normal' or 'lognormal', the sign of the mean is kept
+        'cv': coefficient of variation (default 0)
+        'min': lower bound of the absolute value, e.g. the resolution for delays (default 0)
+
+    :param intra: boolean array flagging intra-cluster connections (see `intra_cluster_mask`)
+    :param syn_pars: parameter specifications, e.g. {'weight': {'mean': 1., 'distribution': 'lognormal', 'cv': 0.5}}
+    :param rng: numpy.random.Generator
+    :return: dictionary of float32 arrays aligned with `intra`
+    """
+    values = dict()
+    for name, spec in syn_pars.items():
+        mean = spec['mean']
+        cv = spec.get('cv', 0.)
+        distribution = spec.get('distribution', 'constant')
+
+        # relative deviations with unit mean
+        if distribution == 'constant' or cv == 0.:
+            magnitude = np.ones(len(intra), dtype=np.float32)
+        elif distribution == 'normal':
+            magnitude = 1. + np.float32(cv) * rng.standard_normal(len(intra), dtype=np.float32)
+        elif distribution == 'lognormal':
+            sigma = np.sqrt(np.log(1. + cv ** 2))
+            magnitude = np.exp(np.float32(-sigma ** 2 / 2.) +
+                               np.float32(sigma) * rng.standard_normal(len(intra), dtype=np.float32))
         else:
-            h_overlap = get_overlap_size(map_size_tgt, map_idx, n_tgt, mod_pars.n_stim)
+            raise ValueError("Unknown distribution '{}' for synapse parameter '{}'".format(distribution, name))
 
-            if map_idx > 0:
-                start_idx = stop_idx - h_overlap
-                stop_idx = start_idx + map_size_tgt
+        magnitude *= np.where(intra, np.float32(spec.get('intra_scale', 1.) * abs(mean)),
+                              np.float32(spec.get('inter_scale', 1.) * abs(mean)))
+        np.maximum(magnitude, np.float32(spec.get('min', 0.)), out=magnitude)
+        values[name] = np.copysign(magnitude, np.float32(mean))
 
-        if debug:
-            print('src cluster for layer {2}: [{0}-{1}]\t->\t[{3} - {4}]'.format(min(src_pop), max(src_pop), tgt_layer,
-                                                                                 start_idx, stop_idx - 1))
+    return values
 
-        # putative target neuron ids
-        putative_intra_tgts = np.arange(start_idx, stop_idx)
-        putative_inter_tgts = np.concatenate((np.arange(start_idx), np.arange(stop_idx, n_tgt)))  # before and after
 
-        # number of total intra-/inter-cluster connections for this stimulus
-        k_c = int(p_c * map_size_src * map_size_tgt)
-        k_0 = int(p_0 * map_size_src * (n_tgt - map_size_tgt))
+def _split_rows(n_rows, k_c, k_0, w_c, w_0, chunk_size, rng):
+    """
+    Splits a block of source neurons into row blocks holding at most `chunk_size` connections. The number of
+    intra-/inter-cluster connections (k_c, k_0) is divided among the row blocks by hypergeometric draws, so sampling
+    each row block separately is equivalent to sampling the whole block at once.
+
+    :param n_rows: number of source neurons in the block
+    :param k_c: number of intra-cluster connections in the block
+    :param k_0: number of inter-cluster connections in the block
+    :param w_c: number of intra-cluster targets per source neuron
+    :param w_0: number of inter-cluster targets per source neuron
+    :param chunk_size: maximum number of connections per row block (None for no splitting)
+    :param rng: numpy.random.Generator
+    :return: generator of (first row, last row + 1, k_c, k_0)
+    """
+    stack = [(0, n_rows, k_c, k_0)]
+    while stack:
+        r0, r1, k_c, k_0 = stack.pop()
+        if chunk_size is None or k_c + k_0 <= chunk_size or r1 - r0 == 1:
+            yield r0, r1, k_c, k_0
+            continue
 
-        #############################################################
-        # draw the connections and mark them in the connection matrix
+        mid = (r0 + r1) // 2
+        k_c_lo = _hypergeometric(rng, (mid - r0) * w_c, (r1 - mid) * w_c, k_c)
+        k_0_lo = _hypergeometric(rng, (mid - r0) * w_0, (r1 - mid) * w_0, k_0)
+        stack.append((mid, r1, k_c - k_c_lo, k_0 - k_0_lo))
+        stack.append((r0, mid, k_c_lo, k_0_lo))
 
-        # randomly sample items from a flattened connectivity matrix, the drawn connection items will be expanded later
-        if k_c:
-            flattened_ids_intra = np.random.choice(np.arange(map_size_src * map_size_tgt), k_c, replace=False)
-        else:
-            flattened_ids_intra = 0
-        # only if there are new inter-cluster connections
-        if k_0:
-            flattened_ids_inter = np.random.choice(np.arange(map_size_src * (n_tgt - map_size_tgt)), k_0, replace=False)
-        else:
-            flattened_ids_inter = 0
 
-        # expand the flattened connection ids computed above and store source-target pairs for intra- and inter
-        src_neurons_intra = (flattened_ids_intra / map_size_tgt).astype(int)
-        tgt_neurons_intra = (flattened_ids_intra % map_size_tgt).astype(int)
+def iter_modular_connections(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, chunk_size=None, rng=None):
+    """
+    Generates the connections of a structured feed-forward connection matrix one stimulus-specific cluster at a time,
+    as (sources, targets) index arrays. If `chunk_size` is given, the clusters are further split into blocks of source
+    neurons such that no chunk holds more than `chunk_size` connections (unless a single source neuron has more
+    targets), hence the full matrix never exists in memory.
 
-        src_neurons_inter = (flattened_ids_inter / (n_tgt - map_size_tgt)).astype(int)
-        tgt_neurons_inter = (flattened_ids_inter % (n_tgt - map_size_tgt)).astype(int)
+    :param n_src: number of source neurons (e.g., generators / channels)
+    :param n_tgt: number of neurons in target populations
+    :param mod_pars: modularity parameters (see `modular_matrix`)
+    :param src_layer: index of the source layer
+    :param tgt_layer: index of the target layer (usually src_layer + 1)
+    :param chunk_size: maximum number of connections per chunk (None for one chunk per cluster)
+    :param rng: numpy.random.Generator or seed (None for fresh entropy)
+    :return: generator of (sources, targets) int32 arrays
+    """
+    rng = np.random.default_rng(rng)
+    layout = get_modular_layout(n_src, n_tgt, mod_pars, src_layer, tgt_layer)
+    src_clusters = layout.src_clusters
+    tgt_intervals = layout.tgt_intervals
+    map_size_src = layout.map_size_src
+    map_size_tgt = layout.map_size_tgt
+    v_overlap = layout.v_overlap
+    h_overlap = layout.h_overlap
+
+    # number of total intra-/inter-cluster connections for each stimulus
+    k_c = int(layout.p_c * map_size_src * map_size_tgt)
+    k_0 = int(layout.p_0 * map_size_src * (n_tgt - map_size_tgt))
 
-        # avoid duplicating connections by removing some new ones but also some existing ones
-        if v_overlap and map_idx:
-            # remove would-be within-cluster duplicates
-            if k_c:
-                to_delete = np.intersect1d(np.where(src_neurons_intra < v_overlap), np.where(tgt_neurons_intra < h_overlap))
-                src_neurons_intra = np.delete(src_neurons_intra, to_delete)
-                tgt_neurons_intra = np.delete(tgt_neurons_intra, to_delete)
+    # deal with stimulus specific clusters
+    for map_idx, src_pop in enumerate(src_clusters):
+        start_idx, stop_idx = tgt_intervals[map_idx]
+
+        for r0, r1, k_c_block, k_0_block in _split_rows(map_size_src, k_c, k_0, map_size_tgt, n_tgt - map_size_tgt,
+                                                        chunk_size, rng):
+            #############################################################
+            # draw the connections as (source, target) index pairs
+
+            # randomly sample items from a flattened connectivity block, the drawn connection items will be expanded
+            flattened_ids_intra = sample_without_replacement((r1 - r0) * map_size_tgt, k_c_block, rng)
+            flattened_ids_inter = sample_without_replacement((r1 - r0) * (n_tgt - map_size_tgt), k_0_block, rng)
+
+            # expand the flattened connection ids computed above and store source-target pairs for intra- and inter
+            src_neurons_intra = flattened_ids_intra // map_size_tgt + r0
+            tgt_neurons_intra = flattened_ids_intra % map_size_tgt
+
+            src_neurons_inter = flattened_ids_inter // (n_tgt - map_size_tgt) + r0
+            tgt_neurons_inter = flattened_ids_inter % (n_tgt - map_size_tgt)
+
+            # avoid duplicating connections by removing some new ones but also some existing ones
+            if v_overlap and map_idx:
+                # remove would-be within-cluster duplicates
+                keep = ~((src_neurons_intra < v_overlap) & (tgt_neurons_intra < h_overlap))
+                src_neurons_intra = src_neurons_intra[keep]
+                tgt_neurons_intra = tgt_neurons_intra[keep]
+
+                # remove would-be inter-cluster duplicates
+                keep = src_neurons_inter >= v_overlap
+                src_neurons_inter = src_neurons_inter[keep]
+                tgt_neurons_inter = tgt_neurons_inter[keep]
+
+            # convert to neuron ids, the inter-cluster targets are those before and after the map
+            src_intra = src_pop[src_neurons_intra]
+            tgt_intra = tgt_neurons_intra + start_idx
+            src_inter = src_pop[src_neurons_inter]
+            tgt_inter = tgt_neurons_inter + map_size_tgt * (tgt_neurons_inter >= start_idx)
+
+            sources = np.concatenate((src_intra, src_inter))
+            targets = np.concatenate((tgt_intra, tgt_inter))
+
+            # the overlap rows of every later cluster that shares source neurons with this one (more than one if
+            # rho > 2 / n_stim) are cleared by it before its intra-cluster connections are drawn, so the connections
+            # drawn here are replaced there
+            for next_idx in range(map_idx + 1, len(src_clusters)) if v_overlap else ():
+                next_src = src_clusters[next_idx][0]
+                if next_src > src_pop[-1]:
+                    break
+                next_start, next_stop = tgt_intervals[next_idx]
+                replaced = (sources >= next_src) & (sources < next_src + v_overlap) & \
+                           (targets >= next_start + h_overlap) & (targets < next_stop)
+                sources = sources[~replaced]
+                targets = targets[~replaced]
+
+            yield sources.astype(np.int32), targets.astype(np.int32)
 
-            # remove would-be inter-cluster duplicates, only if there are new inter-cluster connections
-            if k_0:
-                to_delete = np.where(src_neurons_inter < v_overlap)
-                src_neurons_inter = np.delete(src_neurons_inter, to_delete)
-                tgt_neurons_inter = np.delete(tgt_neurons_inter, to_delete)
+    ########
+    # ensure that neurons not in a topographic map - free neurons, if there are any, still project randomly with p_0
+    k_free = int(n_tgt * layout.p_0)
+    free_neurons = np.arange(max(src_clusters[-1]) + 1, n_src)
+    rows_per_chunk = max(1, len(free_neurons) if chunk_size is None else chunk_size // max(k_free, 1))
 
-            #
-            A[np.ix_(src_pop[:v_overlap], putative_intra_tgts[h_overlap:])] = 0
+    for chunk_start in range(0, len(free_neurons), rows_per_chunk):
+        src_neurons = free_neurons[chunk_start:chunk_start + rows_per_chunk]
+        tgts = sample_rows_without_replacement(len(src_neurons), n_tgt, k_free, rng)
+        yield np.repeat(src_neurons, k_free).astype(np.int32), tgts.ravel().astype(np.int32)
 
-        # update binary connectivity matrix using correct indices from the putative arrays
-        if k_c:
-            A[src_pop[src_neurons_intra], putative_intra_tgts[tgt_neurons_intra]] = 1
 
-        if k_0:
-            A[src_pop[src_neurons_inter], putative_inter_tgts[tgt_neurons_inter]] = 1
+def generate_modular_connections(n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, plot=False, debug=False,
+                                 sparse=False, rng=None, syn_pars=None):
+    """
+    Generates a structured feed-forward connection matrix.
 
+    :param n_src: number of source neurons (e.g., generators / channels)
+    :param n_tgt: number of neurons in target populations
+    :param src_layer: index of the source layer
+    :param tgt_layer: index of the target layer (usually src_layer + 1)
+    :param plot:
+    :param debug:
+    :param sparse: if True, return the connections in COO format (see `sparse_connections`) instead of a dense matrix
+    :param rng: numpy.random.Generator or seed (None for fresh entropy)
+    :param syn_pars: heterogeneous 'weight' and/or 'delay' specifications (see `draw_synapse_parameters`), None for
+                     the constant weight `mod_pars.wE`. Delays are only kept in the sparse format.
+    :return: numpy array of weights [n_src x n_targets] (or sparse connections)
+    """
+    rng = np.random.default_rng(rng)
+    layout = get_modular_layout(n_src, n_tgt, mod_pars, src_layer, tgt_layer, debug)
+
+    stimulus_segments = list()
+
+    for src_pop, (start_idx, stop_idx) in zip(layout.src_clusters, layout.tgt_intervals):
+        if debug:
+            print('src cluster for layer {2}: [{0}-{1}]\t->\t[{3} - {4}]'.format(min(src_pop), max(src_pop), tgt_layer,
+                                                                                 start_idx, stop_idx - 1))
         if plot:
             stimulus_segments.append(((min(src_pop), max(src_pop)), (start_idx, stop_idx - 1)))
 
-    ########
-    # ensure that neurons not in a topographic map - free neurons, if there are any, still project randomly with p_0
-    putative_tgts = np.arange(n_tgt)
-    for src_neuron in range(max(src_clusters[-1]) + 1, n_src):
-        targets = np.random.choice(putative_tgts, int(n_tgt * p_0), replace=False).astype(int)
-        A[src_neuron, targets] = 1
+    chunks = list(iter_modular_connections(n_src, n_tgt, mod_pars, src_layer, tgt_layer, rng=rng))
+    sources = np.concatenate([c[0] for c in chunks])
+    targets = np.concatenate([c[1] for c in chunks])
+    del chunks
+
+    if syn_pars is None:
+        S = sparse_connections(sources, targets, (n_src, n_tgt), mod_pars.wE)
+    else:
+        values = draw_synapse_parameters(intra_cluster_mask(layout, sources, targets), syn_pars, rng)
+        S = sparse_connections(sources, targets, (n_src, n_tgt), values.get('weight', mod_pars.wE),
+                               values.get('delay'))
+    A = S if sparse else sparse_to_dense(S)
 
     density_text = None
 
     if debug:
         density = compute_density_matrix(A)
-        density_theory = compute_density_theory(map_size_src, map_size_tgt, n_src, n_tgt,
-                                                p_0, p_c, mod_pars.n_stim)
+        density_theory = compute_density_theory(layout.map_size_src, layout.map_size_tgt, n_src, n_tgt,
+                                                layout.p_0, layout.p_c, mod_pars.n_stim)
 
         print('\nLayer {} -> {}\n\tComputed density: {}\n\tTheoretical density: {}\n\tDiscrepancy: {}'.format(
             src_layer, tgt_layer, density, density_theory, abs(density_theory - density)))
 
         density_text = 'Layer {} -> {}\nComputed density: {}\nTheoretical density: {}\nDiscrepancy: {}\np_c: {}, ' \
                        'p_0: {}'.format(src_layer, tgt_layer, density, density_theory,
-                                        abs(density_theory - density), p_c, p_0)
+                                        abs(density_theory - density), layout.p_c, layout.p_0)
 
-        assert abs(density_theory - density) < 0.01, "Large discrepancy"
+        if abs(density_theory - density) >= 0.01:
+            warnings.warn("Large discrepancy between computed and theoretical density: {}".format(density_text))
 
     # return connection matrix augmented with appropriate weights for E and I connections
     # and list of stimulus target segments
-    return A * mod_pars.wE, stimulus_segments, density_text
+    return A, stimulus_segments, density_text
+
+
+def _hash_uniform(seed, rows, cols):
+    """
+    Counter-based uniform random numbers in [0, 1): a splitmix64 hash of (seed, row, col), evaluated elementwise
+    (with broadcasting). The same (seed, row, col) always yields the same number, independent of which rows or columns
+    are generated together.
+
+    :param seed: integer seed
+    :param rows: int array of row indices (< 2**32)
+    :param cols: int array of column indices (< 2**32)
+    :return: float64 array
+    """
+    def splitmix64(z):
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+    key = splitmix64(np.array([seed], dtype=np.uint64))[0]
+    counter = (np.asarray(rows, dtype=np.uint64) << np.uint64(32)) | np.asarray(cols, dtype=np.uint64)
+
+    return (splitmix64(counter ^ key) >> np.uint64(11)) * (1. / 2 ** 53)
+
+
+class ModularConnectivitySpec:
+    """
+    Implicit representation of a modular feed-forward connection matrix. Only the cluster intervals, the connection
+    probabilities (p_c, p_0) and a seed are stored. Every (source, target) pair is connected independently with
+    probability p_c if they share a cluster and p_0 otherwise, decided by a counter-based random number of
+    (seed, source, target). Any range of rows or columns can thus be generated on demand and always yields the same
+    connections, e.g. each thread or MPI process generates only the targets it owns.
+
+    Unlike `generate_modular_connections`, the number of connections per cluster is not fixed but binomial, with the
+    same expectation.
+    """
+    def __init__(self, n_src, n_tgt, mod_pars, src_layer=0, tgt_layer=1, seed=0):
+        """
+        :param n_src: number of source neurons
+        :param n_tgt: number of neurons in target populations
+        :param mod_pars: modularity parameters (see `modular_matrix`)
+        :param src_layer: index of the source layer
+        :param tgt_layer: index of the target layer (usually src_layer + 1)
+        :param seed: integer seed
+        """
+        layout = get_modular_layout(n_src, n_tgt, mod_pars, src_layer, tgt_layer)
+
+        self.n_src = n_src
+        self.n_tgt = n_tgt
+        self.seed = seed
+        self.p_c = layout.p_c
+        self.p_0 = layout.p_0
+        # [start, stop) of the source clusters and target maps, one row per stimulus
+        self.src_intervals = np.array([(src_pop[0], src_pop[-1] + 1) for src_pop in layout.src_clusters])
+        self.tgt_intervals = np.array(layout.tgt_intervals)
+
+    @classmethod
+    def from_parameters(cls, src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None, seed=0):
+        """
+        Create the specification with the same parameters as `modular_matrix`.
+        """
+        if rho0 is None:
+            rho0 = 1./n_clusters
+        mod_pars = ParameterSet({
+            'rho0': rho0,
+            'm': modularity,
+            'sigma': density,
+            'n_stim': n_clusters,
+            'wE': 1.0,
+            'N': src_neurons,
+            'delta': 0.
+        })
+
+        return cls(src_neurons, tgt_neurons, mod_pars, seed=seed)
+
+    @staticmethod
+    def _memberships(ids, intervals):
+        """
+        :return: boolean array [len(ids) x n_stim], True where a neuron belongs to a cluster
+        """
+        ids = np.asarray(ids)[:, None]
+        return (ids >= intervals[:, 0]) & (ids < intervals[:, 1])
+
+    @staticmethod
+    def _union_size(memberships, intervals):
+        """
+        Size of the union of the (contiguous, neighbouring) intervals each neuron is assigned to.
+        """
+        start = np.where(memberships, intervals[:, 0], np.iinfo(np.int64).max).min(axis=1)
+        stop = np.where(memberships, intervals[:, 1], 0).max(axis=1)
+        return np.maximum(stop - start, 0)
+
+    def expected_out_degrees(self, sources=None):
+        """
+        Expected number of targets of each source neuron.
+
+        :param sources: source neuron indices (default: all)
+        :return: float array
+        """
+        sources = np.arange(self.n_src) if sources is None else sources
+        n_intra = self._union_size(self._memberships(sources, self.src_intervals), self.tgt_intervals)
+        return self.p_c * n_intra + self.p_0 * (self.n_tgt - n_intra)
+
+    def expected_in_degrees(self, targets=None):
+        """
+        Expected number of sources of each target neuron.
+
+        :param targets: target neuron indices (default: all)
+        :return: float array
+        """
+        targets = np.arange(self.n_tgt) if targets is None else targets
+        n_intra = self._union_size(self._memberships(targets, self.tgt_intervals), self.src_intervals)
+        return self.p_c * n_intra + self.p_0 * (self.n_src - n_intra)
+
+    def iter_connections(self, sources=None, targets=None, block_size=2 ** 20):
+        """
+        Generates the connections among the given source and target neurons, in blocks of at most `block_size`
+        candidate pairs.
+
+        :param sources: source neuron indices (default: all)
+        :param targets: target neuron indices (default: all)
+        :param block_size: maximum number of (source, target) pairs evaluated at once
+        :return: generator of (sources, targets) int32 arrays
+        """
+        sources = np.arange(self.n_src) if sources is None else np.asarray(sources)
+        targets = np.arange(self.n_tgt) if targets is None else np.asarray(targets)
+        if not len(targets):
+            return
+
+        tgt_memberships = self._memberships(targets, self.tgt_intervals).astype(np.float32)
+        rows_per_block = max(1, block_size // len(targets))
+
+        for start in range(0, len(sources), rows_per_block):
+            rows = sources[start:start + rows_per_block]
+            src_memberships = self._memberships(rows, self.src_intervals).astype(np.float32)
+
+            # pairs that share at least one cluster are intra-cluster pairs
+            intra = (src_memberships @ tgt_memberships.T) > 0
+            connected = _hash_uniform(self.seed, rows[:, None], targets[None, :]) < np.where(intra, self.p_c, self.p_0)
+
+            i, j = np.nonzero(connected)
+            yield rows[i].astype(np.int32), targets[j].astype(np.int32)
+
+    def get_connections(self, sources=None, targets=None):
+        """
+        All connections among the given source and target neurons, see `iter_connections`.
+
+        :return: sources, targets (int32 arrays)
+        """
+        chunks = list(self.iter_connections(sources, targets))
+        if not chunks:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+    def get_rows(self, start, stop):
+        """
+        All connections of the source neurons [start, stop).
+        """
+        return self.get_connections(sources=np.arange(start, stop))
+
+    def get_columns(self, start, stop):
+        """
+        All connections onto the target neurons [start, stop).
+        """
+        return self.get_connections(targets=np.arange(start, stop))
+
+    def blocks(self):
+        """
+        Decomposes the matrix into rectangular blocks of constant connection probability. The source neurons are split
+        into segments of equal cluster membership; the targets of a segment's clusters form one contiguous range
+        (connected with p_c), the targets before and after it are connected with p_0. Every (source, target) pair
+        lies in exactly one block, so overlapping clusters are not counted twice.
+
+        :return: list of ((src start, src stop), (tgt start, tgt stop), probability) with at most 3 blocks per segment
+        """
+        bounds = np.unique(np.concatenate(([0, self.n_src], self.src_intervals.ravel())))
+        blocks = []
+        for seg_start, seg_stop in zip(bounds[:-1], bounds[1:]):
+            member = (self.src_intervals[:, 0] <= seg_start) & (seg_stop <= self.src_intervals[:, 1])
+            if not member.any():
+                # free neurons, not part of any cluster
+                ranges = [((0, self.n_tgt), self.p_0)]
+            else:
+                intra_start, intra_stop = self.tgt_intervals[member, 0].min(), self.tgt_intervals[member, 1].max()
+                ranges = [((0, intra_start), self.p_0), ((intra_start, intra_stop), self.p_c),
+                          ((intra_stop, self.n_tgt), self.p_0)]
+
+            blocks += [((int(seg_start), int(seg_stop)), (int(tgt_start), int(tgt_stop)), p)
+                       for (tgt_start, tgt_stop), p in ranges if tgt_stop > tgt_start and p > 0.]
+
+        return blocks
+
+
+def connect_modular(pre, post, n_clusters, density, modularity, rho0=None, syn_spec=None, rule='pairwise_bernoulli'):
+    """
+    Connects two NodeCollections with modular feed-forward connectivity (see `modular_matrix`) without generating the
+    connections in Python. The matrix is decomposed into blocks of constant probability (see
+    `ModularConnectivitySpec.blocks`), each block is one `nest.Connect` call between sliced NodeCollections, so the
+    connections are created by the kernel using all threads and memory in Python is O(n_clusters).
+
+    :param pre: pre-synaptic NodeCollection
+    :param post: post-synaptic NodeCollection
+    :param n_clusters: number of clusters
+    :param density: connection density (total)
+    :param modularity: degree of modularity (0 for homogeneous, 1 for perfectly modular)
+    :param rho0: relation between intra and inter-cluster density (if None, keep equal to density)
+    :param syn_spec: synapse specification, passed on to every `nest.Connect` call
+    :param rule: 'pairwise_bernoulli' (binomial number of connections per block) or 'fixed_total_number' (expected
+                 number of connections per block, rounded; NEST allows multapses for this rule)
+    :return: list of blocks ((src start, src stop), (tgt start, tgt stop), probability)
+    """
+    spec = ModularConnectivitySpec.from_parameters(len(pre), len(post), n_clusters, density, modularity, rho0)
+    blocks = spec.blocks()
+
+    for (src_start, src_stop), (tgt_start, tgt_stop), p in blocks:
+        if rule == 'pairwise_bernoulli':
+            conn_spec = {'rule': 'pairwise_bernoulli', 'p': p}
+        elif rule == 'fixed_total_number':
+            conn_spec = {'rule': 'fixed_total_number',
+                         'N': int(round(p * (src_stop - src_start) * (tgt_stop - tgt_start)))}
+        else:
+            raise ValueError("Unknown connection rule '{}'".format(rule))
+        nest.Connect(pre[src_start:src_stop], post[tgt_start:tgt_stop], conn_spec, syn_spec)
+
+    return blocks
+
+
+def connect_from_adjacency(A, pre, post, syn_spec=None, chunk_size=1000000):
+    """
+    Connects two NodeCollections according to an adjacency / weight matrix (pre X post). Instead of connecting one
+    pre-synaptic neuron at a time, the non-zero entries are flattened into source / target node id arrays and
+    connected with a few array-based `one_to_one` calls.
+
+    :param A: numpy array [len(pre) x len(post)] or sparse connections (see `sparse_connections`)
+    :param pre: pre-synaptic NodeCollection
+    :param post: post-synaptic NodeCollection
+    :param syn_spec: synapse specification, 'weight' and 'delay' can be scalars or arrays aligned with the non-zero
+                     entries of A (in row-major order for dense matrices). If no weight (delay) is given, the entries
+                     of A (the delays stored with sparse connections) are used.
+    :param chunk_size: maximum number of connections per `nest.Connect` call
+    :return:
+    """
+    syn_spec = dict(syn_spec or {})
+    if is_sparse(A):
+        sources, targets = A['sources'], A['targets']
+        syn_spec.setdefault('weight', A['weights'])
+        if 'delays' in A:
+            syn_spec.setdefault('delay', A['delays'])
+    else:
+        sources, targets = np.nonzero(A)
+        syn_spec.setdefault('weight', A[sources, targets])
+
+    numeric = [key for key, value in syn_spec.items() if np.asarray(value).dtype.kind in 'biuf']
+    for key in numeric:
+        # numeric parameters are passed as one value per connection, converted to double chunk by chunk
+        syn_spec[key] = np.broadcast_to(np.asarray(syn_spec[key]), sources.shape)
+
+    pre_ids = np.asarray(pre.tolist(), dtype=np.int64)
+    post_ids = np.asarray(post.tolist(), dtype=np.int64)
+
+    for start in range(0, len(sources), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_spec = {key: np.ascontiguousarray(value[chunk], dtype=float) if key in numeric else value
+                      for key, value in syn_spec.items()}
+        nest.Connect(pre_ids[sources[chunk]], post_ids[targets[chunk]], 'one_to_one', chunk_spec)
+
+
+def connect_modular_distributed(pre, post, n_clusters, density, modularity, rho0=None, syn_spec=None, seed=0,
+                                block_size=2 ** 20):
+    """
+    Connects two NodeCollections with modular feed-forward connectivity (see `ModularConnectivitySpec`) when running
+    with MPI. Each rank generates only the columns of its local target nodes and connects them, so nothing is
+    generated or connected twice and memory per rank falls with the number of ranks. Connections are decided by
+    (seed, source, target) alone, hence the network does not depend on the number of ranks or threads.
+
+    :param pre: pre-synaptic NodeCollection
+    :param post: post-synaptic NodeCollection (primitive, i.e. contiguous node ids)
+    :param n_clusters: number of clusters
+    :param density: connection density (total)
+    :param modularity: degree of modularity (0 for homogeneous, 1 for perfectly modular)
+    :param rho0: relation between intra and inter-cluster density (if None, keep equal to density)
+    :param syn_spec: synapse specification, numeric parameters (e.g. 'weight', 'delay') must be scalars and are
+                     passed as one value per connection; NEST Parameters (e.g. `nest.random`) and arrays are not
+                     supported, since array-based `one_to_one` connections need a value for every connection
+    :param seed: integer seed, must be the same on all ranks
+    :param block_size: maximum number of (source, target) pairs evaluated at once
+    :return: number of connections created on this rank
+    """
+    syn_spec = dict(syn_spec or {})
+    for key, value in syn_spec.items():
+        if isinstance(value, str):
+            continue
+        if np.ndim(value) != 0 or np.asarray(value).dtype.kind not in 'biuf':
+            raise TypeError("Synapse parameter '{}' must be a scalar number for connect_modular_distributed, got "
+                            "{}".format(key, type(value).__name__))
+    numeric = [key for key, value in syn_spec.items() if not isinstance(value, str)]
+
+    spec = ModularConnectivitySpec.from_parameters(len(pre), len(post), n_clusters, density, modularity, rho0,
+                                                   seed=seed)
+    pre_ids = np.asarray(pre.tolist(), dtype=np.int64)
+    post_ids = np.asarray(post.tolist(), dtype=np.int64)
+    local_targets = np.asarray(nest.GetLocalNodeCollection(post).tolist(), dtype=np.int64) - post_ids[0]
+
+    n_connections = 0
+    for sources, targets in spec.iter_connections(targets=local_targets, block_size=block_size):
+        if len(sources):
+            # scalar parameters are broadcast to one value per connection, as in `connect_from_adjacency`
+            block_spec = {key: np.full(len(sources), value, dtype=float) if key in numeric else value
+                          for key, value in syn_spec.items()}
+            nest.Connect(pre_ids[sources], post_ids[targets], 'one_to_one', block_spec)
+            n_connections += len(sources)
+
+    return n_connections
+
+
+def aggregate_matrix(W, max_pixels=(1000, 1000), method='mean'):
+    """
+    Downsamples a weight matrix to a raster of at most `max_pixels` by aggregating blocks of entries. Sparse input is
+    binned directly from its connections, so the cost depends on the number of connections and pixels only.
 
+    :param W: numpy array or sparse connections (see `sparse_connections`)
+    :param max_pixels: maximum (rows, columns) of the raster
+    :param method: 'sum', 'mean' or 'max' of the entries in each block
+    :return: raster, (rows, columns) of W per pixel
+    """
+    shape = W['shape'] if is_sparse(W) else W.shape
+    block = tuple(max(1, int(np.ceil(n / float(m)))) for n, m in zip(shape, max_pixels))
+    raster_shape = tuple(int(np.ceil(n / float(b))) for n, b in zip(shape, block))
+
+    if is_sparse(W):
+        pixel = (W['sources'] // block[0]) * raster_shape[1] + W['targets'] // block[1]
+        if method == 'max':
+            raster = np.zeros(raster_shape[0] * raster_shape[1])
+            np.maximum.at(raster, pixel, W['weights'])
+        else:
+            raster = np.bincount(pixel, weights=W['weights'], minlength=raster_shape[0] * raster_shape[1])
+        raster = raster.reshape(raster_shape)
+    else:
+        # pad with zeros to full blocks
+        padded = np.zeros((raster_shape[0] * block[0], raster_shape[1] * block[1]))
+        padded[:shape[0], :shape[1]] = W
+        padded = padded.reshape(raster_shape[0], block[0], raster_shape[1], block[1])
+        raster = padded.max(axis=(1, 3)) if method == 'max' else padded.sum(axis=(1, 3))
+
+    if method == 'mean':
+        # blocks at the lower / right border may be smaller
+        rows = np.minimum(block[0], shape[0] - np.arange(raster_shape[0]) * block[0])
+        cols = np.minimum(block[1], shape[1] - np.arange(raster_shape[1]) * block[1])
+        raster = raster / np.outer(rows, cols)
+
+    return raster, block
 
-def print_weight_matrix(W, label=None, ax=None, cmap='Greys', save=False):
+
+def print_weight_matrix(W, label=None, ax=None, cmap='Greys', save=False, max_pixels=(1000, 1000), method='mean'):
     """
     E/D
     This is version 1 as per the documentation. In this case we have no real control over p_u
     at population level, rather only at single neuron level within a stimulus-specific sub-population.
+
+    Large matrices are downsampled to at most `max_pixels` before plotting (see `aggregate_matrix`), the axes keep
+    neuron indices as coordinates.
     :return:
     """
     if ax is None:
@@ -342,7 +1149,13 @@ def print_weight_matrix(W, label=None, ax=None, cmap='Greys', save=False):
     if label is not None:
         ax.set_title(label)
 
-    plot = ax.imshow(W, cmap=cmap, interpolation="none", aspect='auto')
+    n_src, n_tgt = W['shape'] if is_sparse(W) else W.shape
+    raster, block = aggregate_matrix(W, max_pixels, method)
+
+    plot = ax.imshow(raster, cmap=cmap, interpolation="none", aspect='auto',
+                     extent=(-0.5, raster.shape[1] * block[1] - 0.5, raster.shape[0] * block[0] - 0.5, -0.5))
+    ax.set_xlim(-0.5, n_tgt - 0.5)
+    ax.set_ylim(n_src - 0.5, -0.5)
 
     if cmap != 'Greys':
         cbar = pl.colorbar(plot, ax=ax)
@@ -354,18 +1167,21 @@ def print_weight_matrix(W, label=None, ax=None, cmap='Greys', save=False):
         fig.savefig('{}.pdf'.format(save))
 
 
-def plot_connection_matrices(W, stim_segments, n_stim, title, save):
+def plot_connection_matrices(W, stim_segments, n_stim, title, save, max_pixels=(1000, 1000), method='mean'):
     """
 
     :param W:
     :param stim_segments:
     :param n_stim:
     :param save:
+    :param max_pixels: maximum resolution of the (downsampled) matrix, see `aggregate_matrix`
+    :param method: aggregation of matrix entries per pixel, see `aggregate_matrix`
     :return:
     """
     fig = pl.figure(figsize=(6, 6))
     ax = pl.subplot2grid((1, 1), (0, 0))
-    print_weight_matrix(W, ax=ax)
+    # the matrix is drawn in neuron index coordinates, so the segments need no rescaling
+    print_weight_matrix(W, ax=ax, max_pixels=max_pixels, method=method)
     seg_colors = ['g', 'r', 'b', 'm', 'y']
 
     for seg_idx, seg in enumerate(stim_segments):
@@ -387,7 +1203,8 @@ def plot_connection_matrices(W, stim_segments, n_stim, title, save):
         fig.savefig(save)
 
 
-def modular_matrix(layer, N, src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None):
+def modular_matrix(layer, N, src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None, sparse=False,
+                   rng=None, syn_pars=None):
     """
     Generate a modular adjacency matrix.
 
@@ -396,6 +1213,9 @@ def modular_matrix(layer, N, src_neurons, tgt_neurons, n_clusters, density, modu
     :param density: connection density (total)
     :param modularity: degree of modularity (0 for homogeneous, 1 for perfectly modular)
     :param rho0: relation between intra and inter-cluster density (if None, keep equal to density)
+    :param sparse: if True, return the adjacency in COO format (see `sparse_connections`)
+    :param rng: numpy.random.Generator or seed (None for fresh entropy)
+    :param syn_pars: heterogeneous weights and/or delays (see `draw_synapse_parameters`), None for unit weights
     """
     if rho0 is None:
         rho0 = 1./n_clusters
@@ -412,8 +1232,91 @@ def modular_matrix(layer, N, src_neurons, tgt_neurons, n_clusters, density, modu
     # leave layer_tgt = 1 and src_layer = 0 to generate 1 matrix..
     adjacency, clusters, text = generate_modular_connections(n_src=src_neurons, n_tgt=tgt_neurons,
                                                                       src_layer=0, tgt_layer=1,
-                                                                      mod_pars=mod_pars, plot=True, debug=False)
+                                                                      mod_pars=mod_pars, plot=True, debug=False,
+                                                                      sparse=sparse, rng=rng, syn_pars=syn_pars)
     # clusters = [nest.NodeCollection(np.arange(ct[1][0] + (layer + 1) * N + 1, ct[1][1] + (layer + 1) * N + 1))
     # clusters = [np.arange(ct[1][0] + (layer + 1) * N + 1, ct[1][1] + (layer + 1) * N + 1)
     #             for ct in clusters]
     return adjacency
+
+
+def modular_chunks(src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None, chunk_size=100000,
+                   rng=None):
+    """
+    Generate a modular adjacency matrix in chunks of (sources, targets) index arrays, see `iter_modular_connections`.
+    The chunks can be connected directly, e.g.
+    `nest.Connect(pre_ids[sources], post_ids[targets], 'one_to_one', syn_spec)`.
+
+    :param src_neurons: number of pre-synaptic neurons
+    :param tgt_neurons: number of post-synaptic neurons
+    :param n_clusters: number of clusters
+    :param density: connection density (total)
+    :param modularity: degree of modularity (0 for homogeneous, 1 for perfectly modular)
+    :param rho0: relation between intra and inter-cluster density (if None, keep equal to density)
+    :param chunk_size: maximum number of connections per chunk
+    :param rng: numpy.random.Generator or seed (None for fresh entropy)
+    :return: generator of (sources, targets) int32 arrays
+    """
+    if rho0 is None:
+        rho0 = 1./n_clusters
+    mod_pars = ParameterSet({
+        'rho0': rho0,
+        'm': modularity,
+        'sigma': density,
+        'n_stim': n_clusters,
+        'wE': 1.0,
+        'N': src_neurons,
+        'delta': 0.
+    })
+
+    return iter_modular_connections(n_src=src_neurons, n_tgt=tgt_neurons, mod_pars=mod_pars, src_layer=0, tgt_layer=1,
+                                    chunk_size=chunk_size, rng=rng)
+
+
+def _modular_matrix_worker(args):
+    """
+    Generates one sparse modular matrix of `build_modular_stack` in a worker process.
+    """
+    seed_seq, kwargs = args
+    return modular_matrix(sparse=True, rng=np.random.default_rng(seed_seq), **kwargs)
+
+
+def build_modular_stack(n_layers, src_neurons, tgt_neurons, n_clusters, density, modularity, rho0=None, seed=None,
+                        n_workers=None, syn_pars=None):
+    """
+    Generate the modular feed-forward matrices between all consecutive layers of a network in parallel. Every matrix
+    is drawn from its own random stream, spawned from a single `numpy.random.SeedSequence`, so the result only
+    depends on `seed` and not on the number of workers.
+
+    :param n_layers: number of layers
+    :param src_neurons: number of pre-synaptic neurons per layer
+    :param tgt_neurons: dictionary of post-synaptic population sizes per layer, e.g. {'E': NE, 'I': NI}
+    :param n_clusters: number of clusters
+    :param density: connection density (total)
+    :param modularity: degree of modularity (0 for homogeneous, 1 for perfectly modular)
+    :param rho0: relation between intra and inter-cluster density (if None, keep equal to density)
+    :param seed: seed (or SeedSequence) for the random streams (None for fresh entropy)
+    :param n_workers: number of worker processes (None for all cores, 1 to generate in the calling process)
+    :param syn_pars: heterogeneous weights and/or delays (see `draw_synapse_parameters`), either one specification
+                     for all target populations or a dictionary per population, e.g. {'E': {..}, 'I': {..}}
+    :return: list with one dictionary of sparse connections (see `sparse_connections`) per target population for
+             each pair of layers (layer l -> l + 1)
+    """
+    pops = list(tgt_neurons)
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    if syn_pars is None or not set(syn_pars) <= set(pops):
+        # same synapse specification for all target populations
+        syn_pars = {pop: syn_pars for pop in pops}
+    keys = [(l, pop) for l in range(n_layers - 1) for pop in pops]
+    tasks = [(child_seq, {'layer': l, 'N': None, 'src_neurons': src_neurons, 'tgt_neurons': tgt_neurons[pop],
+                          'n_clusters': n_clusters, 'density': density, 'modularity': modularity, 'rho0': rho0,
+                          'syn_pars': syn_pars.get(pop)})
+             for (l, pop), child_seq in zip(keys, seed_seq.spawn(len(keys)))]
+
+    if n_workers == 1:
+        matrices = [_modular_matrix_worker(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            matrices = list(executor.map(_modular_matrix_worker, tasks))
+
+    return [dict(zip(pops, matrices[l * len(pops):(l + 1) * len(pops)])) for l in range(n_layers - 1)]
@@ -0,0 +1,85 @@
+import numpy as np
+
+from modularity import ParameterSet, cluster_bounds, compute_density_theory, expand_memberships, get_membership_bits, \
+    get_membership_lists, intra_cluster_mask, is_sparse
+
+
+def _pairs_in_common(src_bits, tgt_bits):
+    """
+    Number of (source, target) pairs that share at least one cluster, i.e. the size of the union of the intra-cluster
+    blocks, from the membership bit sets (see `modularity.get_membership_bits`). Source neurons with the same clusters
+    are handled together, so the cost scales with the number of distinct memberships instead of the matrix size.
+    """
+    memberships, n_sources = np.unique(src_bits, axis=0, return_counts=True)
+    n_pairs = 0
+    for bits, n in zip(memberships, n_sources):
+        if bits.any():
+            n_pairs += n * np.count_nonzero(np.any(tgt_bits & bits, axis=1))
+    return int(n_pairs)
+
+
+def connectivity_metrics(A, layout):
+    """
+    Computes density and modularity statistics of a (modular) connection matrix in a single pass over its
+    connections, without densifying sparse input: global density, intra-/inter-cluster density per cluster, the
+    empirical modularity m = 1 - p_0 / p_c and the in-/out-degree distributions. Deviations from the theoretical
+    values are reported in the result.
+
+    :param A: numpy array [n_src x n_tgt] or sparse connections (see `modularity.sparse_connections`)
+    :param layout: cluster structure of the matrix (see `modularity.get_modular_layout`)
+    :return: ParameterSet of metrics
+    """
+    if is_sparse(A):
+        sources, targets = A['sources'], A['targets']
+        n_src, n_tgt = A['shape']
+    else:
+        sources, targets = np.nonzero(A)
+        n_src, n_tgt = A.shape
+
+    n_stim = len(layout.src_clusters)
+    src_bits = get_membership_bits(layout.src_clusters, n_src)
+    tgt_bits = get_membership_bits(layout.tgt_intervals, n_tgt)
+
+    # expand each connection into one entry per cluster of its source (neurons in overlaps belong to two or more
+    # clusters), the connection is intra-cluster for that cluster if the target belongs to it as well
+    owner, src_labels = expand_memberships(*get_membership_lists(layout.src_clusters, n_src), sources)
+    tgt_member = (tgt_bits[targets[owner], src_labels // 64] >> (src_labels % 64).astype(np.uint64)) & np.uint64(1)
+
+    intra_counts = np.bincount(src_labels[tgt_member == 1], minlength=n_stim)
+    out_counts = np.bincount(src_labels, minlength=n_stim)
+    n_intra = np.count_nonzero(intra_cluster_mask(layout, sources, targets))
+
+    src_sizes = np.array([stop - start for start, stop in map(cluster_bounds, layout.src_clusters)])
+    tgt_sizes = np.array([stop - start for start, stop in map(cluster_bounds, layout.tgt_intervals)])
+
+    intra_pairs = _pairs_in_common(src_bits, tgt_bits)
+    inter_pairs = n_src * n_tgt - intra_pairs
+
+    density = len(sources) / float(n_src * n_tgt)
+    p_c = n_intra / float(intra_pairs) if intra_pairs else np.nan
+    p_0 = (len(sources) - n_intra) / float(inter_pairs) if inter_pairs else np.nan
+
+    out_degrees = np.bincount(sources, minlength=n_src)
+    in_degrees = np.bincount(targets, minlength=n_tgt)
+
+    density_theory = compute_density_theory(layout.map_size_src, layout.map_size_tgt, n_src, n_tgt,
+                                            layout.p_0, layout.p_c, n_stim)
+    modularity_theory = 1. - layout.p_0 / layout.p_c
+
+    return ParameterSet({
+        'n_connections': len(sources),
+        'density': density,
+        'density_theory': density_theory,
+        'density_discrepancy': density - density_theory,
+        'intra_density': intra_counts / (src_sizes * tgt_sizes).astype(float),
+        'inter_density': (out_counts - intra_counts) / (src_sizes * (n_tgt - tgt_sizes)).astype(float),
+        'p_c': p_c,
+        'p_0': p_0,
+        'modularity': 1. - p_0 / p_c,
+        'modularity_theory': modularity_theory,
+        'modularity_discrepancy': (1. - p_0 / p_c) - modularity_theory,
+        'out_degrees': out_degrees,
+        'in_degrees': in_degrees,
+        'out_degree_distribution': np.bincount(out_degrees),
+        'in_degree_distribution': np.bincount(in_degrees),
+    })
@@ -0,0 +1,96 @@
+"""
+Check of the distributed construction of modular feed-forward connectivity (`connect_modular_distributed`).
+
+Every rank connects only its local target nodes. The connections of all ranks are combined into an order-independent
+checksum, which must be identical for any number of ranks and match the serially generated matrix. The peak memory
+of each rank is reported as well.
+
+Usage:
+    python mpi_modular_check.py
+    mpirun -np 4 python mpi_modular_check.py --n-src 20000 --n-tgt 20000
+"""
+import argparse
+import resource
+
+import numpy as np
+import nest
+
+from modularity import ModularConnectivitySpec, connect_modular_distributed
+
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+
+def checksum(sources, targets, n_tgt):
+    """
+    Order-independent checksum of a set of connections given as source / target indices.
+    """
+    flat = sources.astype(np.uint64) * np.uint64(n_tgt) + targets.astype(np.uint64)
+    # mix the bits so that different sets of connections are unlikely to give the same XOR
+    flat = (flat ^ (flat >> np.uint64(31))) * np.uint64(0x9E3779B97F4A7C15)
+    return int(np.bitwise_xor.reduce(flat, initial=np.uint64(0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-src', type=int, default=5000, help='number of pre-synaptic neurons')
+    parser.add_argument('--n-tgt', type=int, default=5000, help='number of post-synaptic neurons')
+    parser.add_argument('--n-clusters', type=int, default=10, help='number of clusters')
+    parser.add_argument('--density', type=float, default=0.1, help='connection density')
+    parser.add_argument('--modularity', type=float, default=0.75, help='degree of modularity')
+    parser.add_argument('--seed', type=int, default=1234, help='connectivity seed (shared by all ranks)')
+    parser.add_argument('--threads', type=int, default=1, help='threads per rank')
+    parser.add_argument('--no-reference', action='store_true', help='skip the serial reference on rank 0')
+    args = parser.parse_args()
+
+    nest.ResetKernel()
+    nest.set_verbosity('M_WARNING')
+    nest.local_num_threads = args.threads
+    rank, n_ranks = nest.Rank(), nest.NumProcesses()
+
+    pre = nest.Create('parrot_neuron', args.n_src)
+    post = nest.Create('iaf_psc_delta', args.n_tgt)
+    n_local = connect_modular_distributed(pre, post, args.n_clusters, args.density, args.modularity,
+                                          syn_spec={'weight': 1., 'delay': 1.5}, seed=args.seed)
+
+    # connections stored on this rank, as indices into pre / post
+    conns = nest.GetConnections(pre, post)
+    sources = np.asarray(conns.get('source'), dtype=np.int64).ravel() - pre[0].global_id
+    targets = np.asarray(conns.get('target'), dtype=np.int64).ravel() - post[0].global_id
+    assert len(sources) == n_local, 'rank {}: {} connections created, {} stored'.format(rank, n_local, len(sources))
+
+    local = (len(sources), checksum(sources, targets, args.n_tgt),
+             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+    if n_ranks > 1:
+        if MPI is None:
+            raise ImportError('mpi4py is required to combine the results of several ranks')
+        gathered = MPI.COMM_WORLD.gather(local, root=0)
+    else:
+        gathered = [local]
+
+    if rank != 0:
+        return
+
+    n_total = sum(g[0] for g in gathered)
+    total_checksum = 0
+    for g in gathered:
+        total_checksum ^= g[1]
+
+    print('ranks: {}, threads per rank: {}'.format(n_ranks, args.threads))
+    for r, (n, _, rss) in enumerate(gathered):
+        print('  rank {}: {} connections, peak RSS {:.0f} MB'.format(r, n, rss))
+    print('total: {} connections, checksum {:016x}'.format(n_total, total_checksum))
+
+    if not args.no_reference:
+        spec = ModularConnectivitySpec.from_parameters(args.n_src, args.n_tgt, args.n_clusters, args.density,
+                                                       args.modularity, seed=args.seed)
+        ref_sources, ref_targets = spec.get_connections()
+        ref = (len(ref_sources), checksum(ref_sources, ref_targets, args.n_tgt))
+        status = 'OK' if ref == (n_total, total_checksum) else 'MISMATCH'
+        print('serial reference: {} connections, checksum {:016x} -> {}'.format(ref[0], ref[1], status))
+
+
+if __name__ == '__main__':
+    main()
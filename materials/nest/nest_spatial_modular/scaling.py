@@ -0,0 +1,177 @@
+"""
+Strong and weak scaling of the Brunel network (`helpers.build_brunel`) with the number of threads.
+
+Strong scaling keeps the network size fixed, weak scaling keeps the number of neurons per thread fixed (at constant
+indegree). Every run uses a fresh process, records the wall-clock times of Create, Connect, Prepare and Simulate, the
+real-time factor, the number of connections and the memory of the process, and the results are summarised in a table
+and a plot.
+
+Usage:
+    python scaling.py --threads 1 2 4 8 --mode strong weak --output scaling.json --plot scaling.png
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+import helpers
+
+
+def memory_mb(nest):
+    """
+    Memory of the current process in MB, as reported by NEST (falls back to the peak resident set size).
+    """
+    try:
+        return nest.ll_api.sli_func('memory_thisjob') / 1024.
+    except Exception:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024. ** 2 if sys.platform == 'darwin' else rss / 1024.
+
+
+def run_brunel(threads, NE, simtime):
+    """
+    Build and simulate the Brunel network once, meant to be executed in a fresh process.
+
+    :param threads: number of threads
+    :param NE: number of excitatory neurons
+    :param simtime: simulation time (ms)
+    :return: dictionary of timings and kernel statistics
+    """
+    import nest
+
+    net = helpers.build_brunel(NE=NE, threads=threads, record=helpers.N_rec, print_time=False)
+
+    start = time.perf_counter()
+    nest.Prepare()
+    prepare_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nest.Run(simtime)
+    simulate_time = time.perf_counter() - start
+    nest.Cleanup()
+
+    n_events = sum(recorder.n_events for recorder in (net['spikes_e'], net['spikes_i']))
+    n_rec = len(net['neurons_e'][:helpers.N_rec]) + len(net['neurons_i'][:helpers.N_rec])
+
+    return {
+        'threads': threads,
+        'NE': net['params']['NE'],
+        'N': net['params']['NE'] + net['params']['NI'],
+        'simtime': simtime,
+        'create': net['times']['create'],
+        'connect': net['times']['connect'],
+        'prepare': prepare_time,
+        'simulate': simulate_time,
+        'rtf': simulate_time / (simtime * 1e-3),
+        'num_connections': nest.GetKernelStatus('num_connections'),
+        'memory_mb': memory_mb(nest),
+        'rate': n_events / n_rec / (simtime * 1e-3),
+    }
+
+
+def scaling_runs(threads, NE, simtime, mode):
+    """
+    Runs the network for each number of threads, each in a fresh process.
+
+    :param threads: list of thread counts
+    :param NE: number of excitatory neurons (strong scaling) or per thread count of threads[0] (weak scaling)
+    :param simtime: simulation time (ms)
+    :param mode: 'strong' or 'weak'
+    :return: list of results
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for n_threads in threads:
+        size = NE if mode == 'strong' else int(round(NE * n_threads / threads[0]))
+        with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+            result = pool.apply(run_brunel, (n_threads, size, simtime))
+        result['mode'] = mode
+        results.append(result)
+
+    # parallel efficiency relative to the smallest thread count
+    ref = results[0]
+    for result in results:
+        ratio = result['threads'] / ref['threads']
+        total, ref_total = sum_times(result), sum_times(ref)
+        result['efficiency'] = ref_total / total / ratio if mode == 'strong' else ref_total / total
+
+    return results
+
+
+def sum_times(result):
+    return result['create'] + result['connect'] + result['prepare'] + result['simulate']
+
+
+def summary_table(results):
+    header = '{:>6} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>7} {:>12} {:>10} {:>7} {:>6}'.format(
+        'mode', 'threads', 'N', 'create', 'connect', 'prepare', 'simulate', 'RTF', 'connections', 'memory',
+        'rate', 'eff.')
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append('{:>6} {:>7} {:>8} {:>7.2f}s {:>7.2f}s {:>7.2f}s {:>8.2f}s {:>7.2f} {:>12} {:>8.0f}MB {:>7.2f} '
+                     '{:>6.2f}'.format(r['mode'], r['threads'], r['N'], r['create'], r['connect'], r['prepare'],
+                                       r['simulate'], r['rtf'], r['num_connections'], r['memory_mb'], r['rate'],
+                                       r['efficiency']))
+    return '\n'.join(lines)
+
+
+def plot_scaling(results, save=None):
+    """
+    Stacked phase times and parallel efficiency versus the number of threads, one column per scaling mode.
+    """
+    import matplotlib.pyplot as plt
+
+    modes = sorted({r['mode'] for r in results})
+    fig, axes = plt.subplots(2, len(modes), figsize=(5 * len(modes), 7), squeeze=False)
+    phases = ('create', 'connect', 'prepare', 'simulate')
+
+    for col, mode in enumerate(modes):
+        runs = [r for r in results if r['mode'] == mode]
+        labels = [str(r['threads']) for r in runs]
+        bottom = [0.] * len(runs)
+        for phase in phases:
+            values = [r[phase] for r in runs]
+            axes[0, col].bar(labels, values, bottom=bottom, label=phase)
+            bottom = [b + v for b, v in zip(bottom, values)]
+        axes[0, col].set_title('{} scaling'.format(mode))
+        axes[0, col].set_ylabel('wall-clock time (s)')
+        axes[0, col].legend()
+
+        axes[1, col].plot(labels, [r['efficiency'] for r in runs], 'o-')
+        axes[1, col].axhline(1., color='k', ls='--', lw=0.5)
+        axes[1, col].set_ylim(0., 1.2)
+        axes[1, col].set_xlabel('threads')
+        axes[1, col].set_ylabel('parallel efficiency')
+
+    fig.tight_layout()
+    if save:
+        fig.savefig(save)
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help='thread counts')
+    parser.add_argument('--mode', nargs='+', choices=('strong', 'weak'), default=['strong', 'weak'])
+    parser.add_argument('--NE', type=int, default=helpers.NE,
+                        help='excitatory neurons (weak scaling: for the first thread count)')
+    parser.add_argument('--simtime', type=float, default=helpers.simtime, help='simulation time (ms)')
+    parser.add_argument('--output', default='scaling.json', help='results file')
+    parser.add_argument('--plot', help='file to save the plot to')
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.mode:
+        results += scaling_runs(args.threads, args.NE, args.simtime, mode)
+
+    print(summary_table(results))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.plot:
+        plot_scaling(results, args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Parallel sweep over (g, nu_ext) of the Brunel network (`helpers.build_brunel`) to reproduce the phase diagram of [1].
+
+Every grid point is simulated in a worker process with a fresh NEST kernel and a fixed number of threads; the number
+of workers is chosen such that workers x threads matches the available cores. The spikes are reduced to summary
+statistics (rate, CV of the inter-spike intervals, synchrony) inside the worker and each result is appended to a
+JSON lines file as soon as it is done, so an interrupted sweep resumes where it stopped. Results are identified by all
+run parameters (`RUN_KEYS`), a store can hold sweeps with different settings.
+
+[1] Brunel N (2000) Dynamics of sparsely connected networks of excitatory and inhibitory spiking neurons.
+    J Comput Neurosci 8:183-208
+
+Usage:
+    python sweep.py --g 3 4 5 6 7 8 --nu-ratio 1 2 3 4 --threads 2 --store sweep.jsonl --plot sweep.png
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import helpers
+
+# parameters that identify a simulated point in the result store
+RUN_KEYS = ('g', 'nu_ratio', 'NE', 'simtime', 'transient', 'threads', 'n_rec', 'seed')
+
+
+def spike_statistics(senders, times, n_neurons, t_start, t_stop, bin_size=1.):
+    """
+    Summary statistics of the spikes of a population.
+
+    :param senders: node ids of the spikes
+    :param times: spike times (ms)
+    :param n_neurons: number of recorded neurons
+    :param t_start: start of the analysis window (ms)
+    :param t_stop: end of the analysis window (ms)
+    :param bin_size: bin size of the population spike count (ms)
+    :return: dictionary with the mean rate (spikes/s), the mean CV of the inter-spike intervals (over neurons with at
+             least 3 spikes) and the synchrony, i.e. the Fano factor of the population spike count (1 for independent
+             Poisson spike trains, larger for synchronous activity)
+    """
+    senders, times = np.asarray(senders), np.asarray(times)
+    keep = (times >= t_start) & (times < t_stop)
+    senders, times = senders[keep], times[keep]
+    rate = len(times) / n_neurons / ((t_stop - t_start) * 1e-3)
+
+    # inter-spike intervals of all neurons at once, after sorting by sender and time
+    order = np.lexsort((times, senders))
+    senders, times = senders[order], times[order]
+    same = senders[1:] == senders[:-1]
+    isi, isi_sender = np.diff(times)[same], senders[1:][same]
+    _, idx, n_isi = np.unique(isi_sender, return_inverse=True, return_counts=True)
+    mean = np.bincount(idx, weights=isi) / np.maximum(n_isi, 1)
+    var = np.bincount(idx, weights=isi ** 2) / np.maximum(n_isi, 1) - mean ** 2
+    valid = (n_isi >= 2) & (mean > 0)
+    cv = float(np.mean(np.sqrt(np.maximum(var[valid], 0.)) / mean[valid])) if valid.any() else np.nan
+
+    counts = np.bincount(((times - t_start) // bin_size).astype(int), minlength=int((t_stop - t_start) // bin_size))
+    synchrony = float(np.var(counts) / np.mean(counts)) if counts.sum() else np.nan
+
+    return {'rate': rate, 'cv': cv, 'synchrony': synchrony}
+
+
+def run_point(point, threads, simtime, transient, NE, n_rec, seed):
+    """
+    Simulate one grid point, meant to be executed in a worker process.
+
+    :param point: dictionary with 'g' and 'nu_ratio'
+    :param threads: number of threads of the worker
+    :param simtime: analysed simulation time (ms)
+    :param transient: initial simulation time that is discarded (ms)
+    :param NE: number of excitatory neurons
+    :param n_rec: number of recorded neurons per population
+    :param seed: seed of the NEST random number generators
+    :return: dictionary of parameters and statistics of the E and I populations
+    """
+    import nest
+
+    net = helpers.build_brunel(NE=NE, g=point['g'], nu_ratio=point['nu_ratio'], threads=threads, record=n_rec,
+                               print_time=False, seed=seed)
+    nest.Simulate(transient + simtime)
+
+    result = dict(point, threads=threads, simtime=simtime, transient=transient, NE=NE, n_rec=n_rec, seed=seed)
+    for pop in ('e', 'i'):
+        events = net['spikes_' + pop].events
+        n_neurons = min(n_rec, len(net['neurons_' + pop]))
+        stats = spike_statistics(events['senders'], events['times'], n_neurons, transient, transient + simtime)
+        result.update({'{}_{}'.format(key, pop): value for key, value in stats.items()})
+
+    return result
+
+
+def _init_worker(threads):
+    # limit OpenMP threads before NEST is imported in the worker
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+
+class ResultStore:
+    """
+    Append-only JSON lines file of sweep results, one line per finished grid point and run configuration.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def key(result):
+        """
+        All run parameters of a result (`RUN_KEYS`), results of older versions without some of them never match.
+        """
+        return tuple(None if result.get(k) is None else round(float(result[k]), 6) for k in RUN_KEYS)
+
+    def load(self):
+        """
+        :return: list of stored results (a partially written last line is ignored)
+        """
+        results = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        results.append(json.loads(line))
+                    except ValueError:
+                        pass
+        return results
+
+    def done(self):
+        return {self.key(r) for r in self.load()}
+
+    def append(self, result):
+        # start on a new line if the last write was interrupted
+        prefix = ''
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                prefix = '' if f.read(1) == b'\n' else '\n'
+
+        with open(self.path, 'a') as f:
+            f.write(prefix + json.dumps(result) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def run_sweep(points, store, threads=1, n_workers=None, simtime=1000., transient=200., NE=helpers.NE,
+              n_rec=helpers.N_rec, seed=1):
+    """
+    Simulate all grid points that are not yet in the store.
+
+    :param points: list of dictionaries with 'g' and 'nu_ratio'
+    :param store: ResultStore
+    :param threads: threads per worker
+    :param n_workers: number of worker processes (default: available cores // threads)
+    :return: list of the stored results of these points and run parameters
+    """
+    config = {'threads': threads, 'simtime': simtime, 'transient': transient, 'NE': NE, 'n_rec': n_rec, 'seed': seed}
+    keys = {store.key(dict(p, **config)) for p in points}
+    done = store.done()
+    todo = [p for p in points if store.key(dict(p, **config)) not in done]
+    n_workers = n_workers or max(1, available_cores() // threads)
+    print('{} of {} points done, running {} with {} workers x {} threads'.format(
+        len(points) - len(todo), len(points), len(todo), n_workers, threads))
+
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(threads,)) as executor:
+        futures = {executor.submit(run_point, p, threads, simtime, transient, NE, n_rec, seed): p for p in todo}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # failed points are not stored and are retried on the next run
+                print('g={g}, nu_ratio={nu_ratio} failed: {e}'.format(e=e, **futures[future]))
+                continue
+            store.append(result)
+            print('g={g}, nu_ratio={nu_ratio}: rate {rate_e:.1f} spikes/s, CV {cv_e:.2f}, '
+                  'synchrony {synchrony_e:.1f}'.format(**result), flush=True)
+
+    return [r for r in store.load() if store.key(r) in keys]
+
+
+def plot_phase_diagram(results, save=None):
+    """
+    Rate, CV and synchrony of the E population over the (nu_ratio, g) plane.
+    """
+    import matplotlib.pyplot as plt
+
+    gs = np.unique([r['g'] for r in results])
+    nus = np.unique([r['nu_ratio'] for r in results])
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+    for ax, (key, label) in zip(axes, (('rate_e', 'rate (spikes/s)'), ('cv_e', 'CV'),
+                                       ('synchrony_e', 'synchrony'))):
+        values = np.full((len(gs), len(nus)), np.nan)
+        for r in results:
+            values[np.searchsorted(gs, r['g']), np.searchsorted(nus, r['nu_ratio'])] = r[key]
+        im = ax.pcolormesh(nus, gs, values, shading='nearest')
+        fig.colorbar(im, ax=ax, label=label)
+        ax.set_xlabel(r'$\nu_{ext} / \nu_{th}$')
+        ax.set_ylabel('g')
+
+    fig.tight_layout()
+    if save:
+        fig.savefig(save)
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--g', type=float, nargs='+', default=[3., 4., 5., 6., 7., 8.], help='values of g')
+    parser.add_argument('--nu-ratio', type=float, nargs='+', default=[1., 2., 3., 4.],
+                        help='values of nu_ext / nu_th')
+    parser.add_argument('--threads', type=int, default=1, help='threads per worker')
+    parser.add_argument('--workers', type=int, help='worker processes (default: cores // threads)')
+    parser.add_argument('--simtime', type=float, default=1000., help='analysed simulation time (ms)')
+    parser.add_argument('--transient', type=float, default=200., help='discarded initial transient (ms)')
+    parser.add_argument('--NE', type=int, default=helpers.NE, help='number of excitatory neurons')
+    parser.add_argument('--n-rec', type=int, default=helpers.N_rec, help='recorded neurons per population')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the NEST random number generators')
+    parser.add_argument('--prescreen', action='store_true',
+                        help='only simulate points predicted to be in the asynchronous irregular state by the '
+                             'mean-field model, i.e. linearly stable with a rate in 0.5-50 spikes/s (see meanfield.py)')
+    parser.add_argument('--store', default='sweep.jsonl', help='results file, existing results are skipped')
+    parser.add_argument('--plot', help='file to save the phase diagram to')
+    args = parser.parse_args()
+
+    points = [{'g': g, 'nu_ratio': nu} for g in args.g for nu in args.nu_ratio]
+    if args.prescreen:
+        import meanfield
+        g = np.array([p['g'] for p in points])
+        nu_ext = np.array([p['nu_ratio'] for p in points]) * helpers.nu_th * 1e3
+        candidates = meanfield.ai_candidates(meanfield.self_consistent_rate(nu_ext, g))
+        points = [p for p, c in zip(points, candidates) if c]
+
+    results = run_sweep(points, ResultStore(args.store), args.threads, args.workers, args.simtime, args.transient,
+                        args.NE, args.n_rec, args.seed)
+    if args.plot:
+        plot_phase_diagram(results, args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Checks of the on-disk cache of modular connection matrices, run with `python -m pytest test_matrix_cache.py`.
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('nest')
+import matrix_cache  # noqa: E402
+from matrix_cache import MatrixCache  # noqa: E402
+from modularity import ParameterSet, generate_modular_connections, sparse_to_dense  # noqa: E402
+
+
+def test_key_depends_on_version(monkeypatch):
+    params = {'n_src': 100, 'n_tgt': 80, 'seed': 1}
+    key = MatrixCache.key('generate_modular_connections', **params)
+    assert MatrixCache.key('generate_modular_connections', **params) == key
+    monkeypatch.setattr(matrix_cache, '__version__', matrix_cache.__version__ + '.1')
+    assert MatrixCache.key('generate_modular_connections', **params) != key
+
+
+N_SRC, N_TGT = 400, 300
+PARS = ParameterSet({'rho0': 0.3, 'm': 0.9, 'sigma': 0.1, 'n_stim': 5, 'wE': 1., 'delta': 0.})
+SYN_PARS = {'weight': {'mean': 2.}, 'delay': {'mean': 1.5}}
+
+
+def count_calls(monkeypatch):
+    calls = []
+
+    def generate(*args, **kwargs):
+        calls.append(kwargs.get('rng'))
+        return generate_modular_connections(*args, **kwargs)
+
+    monkeypatch.setattr(matrix_cache, 'generate_modular_connections', generate)
+    return calls
+
+
+def generate(cache, seed=1, syn_pars=SYN_PARS):
+    return cache.generate_modular_connections(N_SRC, N_TGT, PARS, sparse=True, seed=seed, syn_pars=syn_pars)[0]
+
+
+def test_hit_equals_fresh_run(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch)
+    cache = MatrixCache(str(tmp_path))
+    first, hit = generate(cache), generate(cache)
+    assert len(calls) == 1 and len(cache.entries()) == 1
+
+    fresh, _, _ = generate_modular_connections(N_SRC, N_TGT, PARS, sparse=True, rng=1, syn_pars=SYN_PARS)
+    for name in ('sources', 'targets', 'weights', 'delays'):
+        # hits are memory-mapped from the cache directory
+        assert isinstance(hit[name], np.memmap) and hit[name].filename.startswith(str(tmp_path))
+        np.testing.assert_array_equal(hit[name], fresh[name])
+        np.testing.assert_array_equal(first[name], fresh[name])
+    assert tuple(hit['shape']) == tuple(fresh['shape'])
+
+    dense = cache.generate_modular_connections(N_SRC, N_TGT, PARS, seed=1, syn_pars=SYN_PARS)[0]
+    np.testing.assert_array_equal(dense, sparse_to_dense(fresh))
+    assert len(calls) == 1
+
+
+def test_misses(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch)
+    cache = MatrixCache(str(tmp_path))
+    generate(cache)
+    generate(cache, seed=2)
+    generate(cache, syn_pars={'weight': {'mean': 3.}, 'delay': {'mean': 1.5}})
+    monkeypatch.setattr(matrix_cache, '__version__', matrix_cache.__version__ + '.1')
+    generate(cache)
+    assert len(calls) == 4 and len(cache.entries()) == 4
+
+
+def test_unseeded_calls_are_not_cached(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch)
+    cache = MatrixCache(str(tmp_path))
+    generate(cache, seed=None)
+    generate(cache, seed=None)
+    assert len(calls) == 2 and not cache.entries()
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = MatrixCache(str(tmp_path))
+    for seed in range(4):
+        generate(cache, seed=seed)
+    entries = {key: size for _, size, key in cache.entries()}
+    keys = [MatrixCache.key('generate_modular_connections', seed=seed, n_src=N_SRC, n_tgt=N_TGT, mod_pars=dict(PARS),
+                            src_layer=0, tgt_layer=1, syn_pars=SYN_PARS) for seed in range(4)]
+    assert set(keys) == set(entries)
+
+    # last used in the order 2, 0, 3, 1
+    for t, seed in enumerate((2, 0, 3, 1)):
+        os.utime(os.path.join(str(tmp_path), keys[seed]), (1000. + t, 1000. + t))
+    cache.max_bytes = entries[keys[3]] + entries[keys[1]]
+    cache.evict()
+    assert {key for _, _, key in cache.entries()} == {keys[3], keys[1]}
+
+    # a hit marks an entry as recently used
+    generate(cache, seed=3)
+    cache.max_bytes = entries[keys[3]]
+    cache.evict()
+    assert [key for _, _, key in cache.entries()] == [keys[3]]
@@ -0,0 +1,70 @@
+"""
+Checks of the mean-field predictions, run with `python -m pytest test_meanfield.py`.
+"""
+import numpy as np
+import pytest
+from scipy.integrate import quad
+from scipy.special import erfcx
+
+import helpers
+import meanfield
+
+PARS = helpers.neuron_params
+
+
+def siegert_quad(mu, sigma):
+    integral, _ = quad(lambda u: erfcx(-u), (PARS['V_reset'] - mu) / sigma, (PARS['V_th'] - mu) / sigma)
+    return 1e3 / (PARS['t_ref'] + PARS['tau_m'] * np.sqrt(np.pi) * integral)
+
+
+@pytest.mark.parametrize('mu, sigma', [(10., 5.), (18., 2.), (30., 5.), (-5., 10.)])
+def test_siegert(mu, sigma):
+    rate = meanfield.siegert(mu, sigma, PARS['tau_m'], PARS['t_ref'], PARS['V_th'], PARS['V_reset'])
+    assert rate == pytest.approx(siegert_quad(mu, sigma), rel=1e-6)
+
+
+@pytest.mark.parametrize('mu, sigma', [(15., 5.), (30., 5.), (24., 11.)])
+def test_linear_response_static_limit(mu, sigma):
+    # at low frequencies the response is the derivative of the stationary rate, the error of the threshold integration
+    # falls linearly with the voltage step
+    rate, response_mu, response_s2 = meanfield.linear_response(mu, sigma, [1e-3], n_reset=1000)
+    h = 1e-3
+    d_mu = (siegert_quad(mu + h, sigma) - siegert_quad(mu - h, sigma)) / (2. * h)
+    d_s2 = (siegert_quad(mu, np.sqrt(sigma ** 2 + h)) - siegert_quad(mu, np.sqrt(sigma ** 2 - h))) / (2. * h)
+
+    assert rate == pytest.approx(siegert_quad(mu, sigma), rel=5e-3)
+    assert response_mu[0].real == pytest.approx(d_mu, rel=5e-3)
+    assert response_s2[0].real == pytest.approx(d_s2, rel=5e-3)
+    assert abs(response_mu[0].imag) < 1e-3 * abs(d_mu)
+
+
+def test_self_consistent_rate():
+    nu_ext = np.array([2., 4.]) * helpers.nu_th * 1e3
+    prediction = meanfield.self_consistent_rate(nu_ext, 5.)
+    transfer = meanfield.transfer(prediction['rate'], nu_ext, g=5.)
+    np.testing.assert_allclose(transfer, prediction['rate'], atol=1e-3)
+
+
+@pytest.mark.parametrize('g, nu_ratio, state', [
+    (5., 2., 'AI'),     # asynchronous irregular
+    (3., 4., 'SR'),     # excitation dominated, synchronous regular
+    (6., 4., 'SI'),     # inhibition dominated with strong input, synchronous irregular with fast oscillations
+    (8., 3., 'SI'),
+])
+def test_stability(g, nu_ratio, state):
+    prediction = meanfield.self_consistent_rate(nu_ratio * helpers.nu_th * 1e3, g)
+    if state == 'AI':
+        assert prediction['stable'] and meanfield.ai_candidates(prediction)
+        assert np.isnan(prediction['frequency'])
+    else:
+        assert prediction['oscillatory'] and not prediction['stable'] and not meanfield.ai_candidates(prediction)
+    if state == 'SI':
+        # fast oscillations, at a frequency set by the delay
+        assert 100. < prediction['frequency'] < 300.
+
+
+def test_grid_shape():
+    g, nu_ratio = np.meshgrid([4., 6.], [1.5, 2., 4.], indexing='ij')
+    prediction = meanfield.self_consistent_rate(nu_ratio * helpers.nu_th * 1e3, g)
+    assert all(np.shape(value) == g.shape for value in prediction.values())
+    assert prediction['oscillatory'].any() and prediction['stable'].any()
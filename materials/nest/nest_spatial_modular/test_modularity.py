@@ -0,0 +1,326 @@
+"""
+Checks of the modular feed-forward connectivity, run with `python -m pytest test_modularity.py`.
+
+The connections drawn by `iter_modular_connections` are replayed through the dense algorithm of the original
+`generate_modular_connections` (sequential writes into a matrix, clearing the overlap rows of each cluster), which
+defines the expected connections for the same random draws.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('nest')
+import nest  # noqa: E402
+import modularity  # noqa: E402
+from modularity import ClusterIndex, ModularConnectivitySpec, ParameterSet, aggregate_matrix, build_modular_stack, \
+    connect_modular, connect_modular_distributed, generate_modular_connections, get_membership_lists, \
+    get_modular_layout, get_overlap_size, get_source_clusters, intra_cluster_mask, iter_modular_connections, \
+    sparse_connections, sparse_to_dense  # noqa: E402
+
+# (n_src, n_tgt, n_stim, rho0): no overlap, overlap of two and of three or more clusters per neuron
+CASES = [(600, 400, 5, 0.2), (500, 300, 5, 0.3), (500, 300, 5, 0.4), (1000, 1000, 10, 0.3), (400, 500, 4, 0.7)]
+
+
+def mod_pars(n_stim, rho0, density=0.1, modularity=0.9):
+    return ParameterSet({'rho0': rho0, 'm': modularity, 'sigma': density, 'n_stim': n_stim, 'wE': 1., 'delta': 0.})
+
+
+def record_draws(monkeypatch):
+    draws = []
+    depth = [0]
+
+    def recorded(sampler):
+        # the samplers call themselves for dense draws, only the outermost result is used
+        def sample(*args):
+            depth[0] += 1
+            try:
+                values = sampler(*args)
+            finally:
+                depth[0] -= 1
+            if not depth[0]:
+                draws.append(values)
+            return values
+        return sample
+
+    monkeypatch.setattr(modularity, 'sample_without_replacement', recorded(modularity.sample_without_replacement))
+    monkeypatch.setattr(modularity, 'sample_rows_without_replacement',
+                        recorded(modularity.sample_rows_without_replacement))
+    return draws
+
+
+def baseline_matrix(n_src, n_tgt, pars, draws):
+    """
+    Dense matrix of the original generator, with its calls to `np.random.choice` replaced by the recorded draws.
+    """
+    draws = iter(draws)
+    layout = get_modular_layout(n_src, n_tgt, pars)
+    map_size_src, map_size_tgt = layout.map_size_src, layout.map_size_tgt
+    v_overlap = layout.v_overlap
+
+    A = np.zeros((n_src, n_tgt))
+    start_idx, stop_idx = 0, map_size_tgt
+    h_overlap = 0
+    for map_idx, src_pop in enumerate(layout.src_clusters):
+        if pars.rho0 <= 1. / pars.n_stim and map_size_tgt * pars.n_stim <= n_tgt:
+            start_idx, stop_idx = map_idx * map_size_tgt, (map_idx + 1) * map_size_tgt
+        else:
+            h_overlap = get_overlap_size(map_size_tgt, map_idx, n_tgt, pars.n_stim)
+            if map_idx > 0:
+                start_idx = stop_idx - h_overlap
+                stop_idx = start_idx + map_size_tgt
+
+        putative_intra_tgts = np.arange(start_idx, stop_idx)
+        putative_inter_tgts = np.concatenate((np.arange(start_idx), np.arange(stop_idx, n_tgt)))
+
+        flattened_ids_intra, flattened_ids_inter = next(draws), next(draws)
+        src_neurons_intra, tgt_neurons_intra = flattened_ids_intra // map_size_tgt, flattened_ids_intra % map_size_tgt
+        src_neurons_inter = flattened_ids_inter // (n_tgt - map_size_tgt)
+        tgt_neurons_inter = flattened_ids_inter % (n_tgt - map_size_tgt)
+
+        if v_overlap and map_idx:
+            keep = ~((src_neurons_intra < v_overlap) & (tgt_neurons_intra < h_overlap))
+            src_neurons_intra, tgt_neurons_intra = src_neurons_intra[keep], tgt_neurons_intra[keep]
+            keep = src_neurons_inter >= v_overlap
+            src_neurons_inter, tgt_neurons_inter = src_neurons_inter[keep], tgt_neurons_inter[keep]
+            A[np.ix_(src_pop[:v_overlap], putative_intra_tgts[h_overlap:])] = 0
+
+        A[src_pop[src_neurons_intra], putative_intra_tgts[tgt_neurons_intra]] = 1
+        A[src_pop[src_neurons_inter], putative_inter_tgts[tgt_neurons_inter]] = 1
+
+    free_neurons = np.arange(max(layout.src_clusters[-1]) + 1, n_src)
+    if len(free_neurons):
+        A[np.repeat(free_neurons, int(n_tgt * layout.p_0)), next(draws).ravel()] = 1
+
+    return A
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_matches_baseline(monkeypatch, n_src, n_tgt, n_stim, rho0):
+    pars = mod_pars(n_stim, rho0)
+    draws = record_draws(monkeypatch)
+    chunks = list(iter_modular_connections(n_src, n_tgt, pars, rng=1))
+    sources = np.concatenate([c[0] for c in chunks])
+    targets = np.concatenate([c[1] for c in chunks])
+
+    A = np.zeros((n_src, n_tgt))
+    A[sources, targets] = 1
+    np.testing.assert_array_equal(A, baseline_matrix(n_src, n_tgt, pars, draws))
+    assert len(sources) == np.count_nonzero(A)
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+@pytest.mark.parametrize('chunk_size', [None, 500])
+def test_no_duplicate_connections(n_src, n_tgt, n_stim, rho0, chunk_size):
+    chunks = list(iter_modular_connections(n_src, n_tgt, mod_pars(n_stim, rho0), chunk_size=chunk_size, rng=2))
+    sources = np.concatenate([c[0] for c in chunks]).astype(np.int64)
+    targets = np.concatenate([c[1] for c in chunks]).astype(np.int64)
+    assert len(np.unique(sources * n_tgt + targets)) == len(sources)
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_dense_equals_sparse(n_src, n_tgt, n_stim, rho0):
+    pars = mod_pars(n_stim, rho0)
+    A, _, _ = generate_modular_connections(n_src, n_tgt, pars, rng=3)
+    S, _, _ = generate_modular_connections(n_src, n_tgt, pars, sparse=True, rng=3)
+    assert len(S['sources']) == np.count_nonzero(A)
+    np.testing.assert_array_equal(sparse_to_dense(S), A)
+
+
+@pytest.mark.parametrize('n, n_stim, rho', [(1000, 10, 0.1), (1000, 10, 0.15), (1000, 10, 0.3), (500, 4, 0.7)])
+def test_membership_lists(membership_matrix, n, n_stim, rho):
+    intervals = get_source_clusters(n, n_stim, rho)
+    indptr, labels = get_membership_lists(intervals, n)
+    member = membership_matrix(intervals, n)
+    for i in range(n):
+        np.testing.assert_array_equal(labels[indptr[i]:indptr[i + 1]], np.flatnonzero(member[i]))
+
+
+def test_cluster_index_counts(membership_matrix):
+    nest.ResetKernel()
+    n_stim, rho = 10, 0.3
+    layers = {'E': [nest.Create('iaf_psc_alpha', 1000) for _ in range(2)],
+              'I': [nest.Create('iaf_psc_alpha', 250) for _ in range(2)]}
+    index = ClusterIndex(layers, n_stim, rho)
+
+    # neuron 200 of a layer of 1000 is in the clusters 0, 1 and 2
+    owner, labels = index.memberships([layers['E'][1][200].global_id])
+    np.testing.assert_array_equal(labels, [0, 1, 2])
+
+    node_ids = np.concatenate([nodes.tolist() for pop in layers for nodes in layers[pop]])
+    counts = index.count(node_ids)
+    for pop_idx, pop in enumerate(layers):
+        for layer_idx, nodes in enumerate(layers[pop]):
+            member = membership_matrix(get_source_clusters(len(nodes), n_stim, rho), len(nodes))
+            np.testing.assert_array_equal(counts[layer_idx, pop_idx], member.sum(axis=0))
+            assert [len(c) for c in index.clusters[pop][layer_idx]] == list(member.sum(axis=0))
+
+    # every recorded neuron of cluster 1 fires twice
+    senders = np.repeat(np.asarray(layers['E'][0].tolist())[membership_matrix(
+        get_source_clusters(1000, n_stim, rho), 1000)[:, 1]], 2)
+    rates = index.cluster_rates(senders, 1000.)
+    assert rates['E'][0, 1] == 2.
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES + [(2000, 1500, 80, 0.05)])
+def test_intra_cluster_mask(membership_matrix, n_src, n_tgt, n_stim, rho0):
+    layout = get_modular_layout(n_src, n_tgt, mod_pars(n_stim, rho0))
+    rng = np.random.default_rng(4)
+    sources, targets = rng.integers(0, n_src, 20000), rng.integers(0, n_tgt, 20000)
+
+    shared = membership_matrix(layout.src_clusters, n_src)[sources] & \
+        membership_matrix(layout.tgt_intervals, n_tgt)[targets]
+    np.testing.assert_array_equal(intra_cluster_mask(layout, sources, targets), shared.any(axis=1))
+
+
+def test_connect_modular_distributed_syn_spec(monkeypatch):
+    nest.ResetKernel()
+    pre, post = nest.Create('iaf_psc_alpha', 300), nest.Create('iaf_psc_alpha', 200)
+    calls = []
+    monkeypatch.setattr(nest, 'Connect', lambda *args: calls.append(args))
+
+    n = connect_modular_distributed(pre, post, 5, 0.1, 0.9, syn_spec={'synapse_model': 'static_synapse',
+                                                                      'weight': 2., 'delay': 1.5}, block_size=5000)
+    assert n == sum(len(c[0]) for c in calls) > 0
+    for sources, targets, rule, spec in calls:
+        assert rule == 'one_to_one' and spec['synapse_model'] == 'static_synapse'
+        np.testing.assert_array_equal(spec['weight'], np.full(len(sources), 2.))
+        np.testing.assert_array_equal(spec['delay'], np.full(len(sources), 1.5))
+
+    for value in (object(), np.ones(3)):
+        with pytest.raises(TypeError):
+            connect_modular_distributed(pre, post, 5, 0.1, 0.9, syn_spec={'weight': value})
+
+
+def test_build_modular_stack_workers():
+    """
+    Every matrix has its own random stream, the result does not depend on the number of workers.
+    """
+    kwargs = dict(n_layers=3, src_neurons=400, tgt_neurons={'E': 400, 'I': 100}, n_clusters=5, density=0.1,
+                  modularity=0.9, seed=11, syn_pars={'weight': {'mean': 1., 'distribution': 'lognormal', 'cv': 0.5}})
+    serial = build_modular_stack(n_workers=1, **kwargs)
+    parallel = build_modular_stack(n_workers=2, **kwargs)
+    assert len(serial) == len(parallel) == 2
+    for S, P in zip(serial, parallel):
+        for pop in ('E', 'I'):
+            assert tuple(S[pop]['shape']) == tuple(P[pop]['shape'])
+            for name in ('sources', 'targets', 'weights'):
+                np.testing.assert_array_equal(S[pop][name], P[pop][name])
+    # the layers are drawn from different streams
+    assert not np.array_equal(serial[0]['E']['sources'], serial[1]['E']['sources'])
+
+
+def spec_probabilities(spec, membership_matrix):
+    """
+    Dense matrix of the connection probabilities of a `ModularConnectivitySpec`, from the cluster memberships.
+    """
+    shared = membership_matrix([tuple(i) for i in spec.src_intervals], spec.n_src).astype(int) @ \
+        membership_matrix([tuple(i) for i in spec.tgt_intervals], spec.n_tgt).T.astype(int)
+    return np.where(shared > 0, spec.p_c, spec.p_0)
+
+
+def connection_matrix(sources, targets, shape):
+    A = np.zeros(shape, dtype=int)
+    np.add.at(A, (sources, targets), 1)
+    return A
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_spec_rows_and_columns(n_src, n_tgt, n_stim, rho0):
+    spec = ModularConnectivitySpec(n_src, n_tgt, mod_pars(n_stim, rho0), seed=5)
+    A = connection_matrix(*spec.get_connections(), (n_src, n_tgt))
+    assert A.max() == 1
+
+    # any split into rows, columns or blocks of pairs yields the same connections
+    chunks = list(spec.iter_connections(block_size=3000))
+    assert len(chunks) > 1
+    np.testing.assert_array_equal(connection_matrix(np.concatenate([c[0] for c in chunks]),
+                                                    np.concatenate([c[1] for c in chunks]), A.shape), A)
+    for start, stop in [(0, 1), (37, 211), (n_src - 50, n_src)]:
+        sources, targets = spec.get_rows(start, stop)
+        np.testing.assert_array_equal(connection_matrix(sources, targets, A.shape)[start:stop], A[start:stop])
+        assert np.all((sources >= start) & (sources < stop))
+    for start, stop in [(0, 1), (120, 280), (n_tgt - 50, n_tgt)]:
+        sources, targets = spec.get_columns(start, stop)
+        np.testing.assert_array_equal(connection_matrix(sources, targets, A.shape)[:, start:stop], A[:, start:stop])
+        assert np.all((targets >= start) & (targets < stop))
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_spec_degrees(membership_matrix, n_src, n_tgt, n_stim, rho0):
+    spec = ModularConnectivitySpec(n_src, n_tgt, mod_pars(n_stim, rho0), seed=6)
+    P = spec_probabilities(spec, membership_matrix)
+    np.testing.assert_allclose(spec.expected_out_degrees(), P.sum(axis=1))
+    np.testing.assert_allclose(spec.expected_in_degrees(), P.sum(axis=0))
+
+    # the empirical degrees are sums of independent Bernoulli variables with these probabilities
+    A = connection_matrix(*spec.get_connections(), (n_src, n_tgt))
+    variance = P * (1. - P)
+    for axis in (1, 0):
+        z = (A.sum(axis=axis) - P.sum(axis=axis)) / np.sqrt(variance.sum(axis=axis))
+        assert np.abs(z).max() < 5. and abs(z.mean()) < 5. / np.sqrt(len(z))
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_spec_blocks(membership_matrix, n_src, n_tgt, n_stim, rho0):
+    spec = ModularConnectivitySpec(n_src, n_tgt, mod_pars(n_stim, rho0))
+    covered = np.zeros((n_src, n_tgt), dtype=int)
+    probability = np.zeros((n_src, n_tgt))
+    for (src_start, src_stop), (tgt_start, tgt_stop), p in spec.blocks():
+        covered[src_start:src_stop, tgt_start:tgt_stop] += 1
+        probability[src_start:src_stop, tgt_start:tgt_stop] = p
+    # blocks with p = 0 are left out
+    P = spec_probabilities(spec, membership_matrix)
+    np.testing.assert_array_equal(covered, P > 0)
+    np.testing.assert_array_equal(probability, P)
+
+
+@pytest.mark.parametrize('rule', ['pairwise_bernoulli', 'fixed_total_number'])
+def test_connect_modular_blocks(monkeypatch, membership_matrix, rule):
+    """
+    The `nest.Connect` calls of `connect_modular` cover every pair once, with p_c where the source and target share
+    a cluster (including pairs in the overlap of two or three clusters) and p_0 elsewhere.
+    """
+    nest.ResetKernel()
+    pre, post = nest.Create('iaf_psc_alpha', 500), nest.Create('iaf_psc_alpha', 300)
+    calls = []
+    monkeypatch.setattr(nest, 'Connect', lambda *args: calls.append(args))
+    connect_modular(pre, post, 5, 0.1, 0.9, rho0=0.4, syn_spec={'weight': 2.}, rule=rule)
+
+    spec = ModularConnectivitySpec.from_parameters(500, 300, 5, 0.1, 0.9, rho0=0.4)
+    P = spec_probabilities(spec, membership_matrix)
+    assert spec.p_c != spec.p_0 and (P == spec.p_c).any() and (P == spec.p_0).any()
+
+    pre_offset, post_offset = pre[0].global_id, post[0].global_id
+    covered = np.zeros(P.shape, dtype=int)
+    for sources, targets, conn_spec, syn_spec in calls:
+        rows = np.asarray(sources.tolist()) - pre_offset
+        cols = np.asarray(targets.tolist()) - post_offset
+        block = P[np.ix_(rows, cols)]
+        covered[np.ix_(rows, cols)] += 1
+        assert syn_spec == {'weight': 2.} and conn_spec['rule'] == rule
+        if rule == 'pairwise_bernoulli':
+            np.testing.assert_array_equal(block, conn_spec['p'])
+        else:
+            assert np.all(block == block[0, 0]) and conn_spec['N'] == int(round(block.sum()))
+    np.testing.assert_array_equal(covered, 1)
+
+
+@pytest.mark.parametrize('shape, max_pixels', [((1003, 517), (100, 60)), ((250, 999), (250, 100)), ((7, 5), (10, 10))])
+def test_aggregate_matrix(shape, max_pixels):
+    rng = np.random.default_rng(8)
+    W = np.where(rng.random(shape) < 0.05, rng.uniform(0.5, 2., shape), 0.)
+    S = sparse_connections(*np.nonzero(W), shape, weights=W[np.nonzero(W)])
+
+    raster, block = aggregate_matrix(W, max_pixels, 'sum')
+    assert raster.shape[0] <= max_pixels[0] and raster.shape[1] <= max_pixels[1]
+    # reference: sums, means and maxima over the blocks, the last blocks may be smaller
+    row_edges, col_edges = np.arange(0, shape[0], block[0]), np.arange(0, shape[1], block[1])
+    assert raster.shape == (len(row_edges), len(col_edges))
+    blocks = [[W[i:i + block[0], j:j + block[1]] for j in col_edges] for i in row_edges]
+    expected = {'sum': [[b.sum() for b in row] for row in blocks], 'mean': [[b.mean() for b in row] for row in blocks],
+                'max': [[b.max() for b in row] for row in blocks]}
+    assert raster.sum() == pytest.approx(W.sum())
+
+    for method, reference in expected.items():
+        for matrix in (W, S):
+            raster, _ = aggregate_matrix(matrix, max_pixels, method)
+            np.testing.assert_allclose(raster, reference, rtol=1e-5)
@@ -0,0 +1,75 @@
+"""
+Checks of the connectivity metrics, run with `python -m pytest test_modularity_metrics.py`.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('nest')
+from modularity import ParameterSet, generate_modular_connections, get_modular_layout, sparse_connections  # noqa: E402
+from modularity_metrics import connectivity_metrics  # noqa: E402
+
+# (n_src, n_tgt, n_stim, rho0): overlap of two and of three or more clusters per neuron
+CASES = [(1000, 800, 10, 0.15), (1000, 800, 5, 0.4), (1500, 1200, 10, 0.3)]
+
+
+def layout_of(n_src, n_tgt, n_stim, rho0):
+    pars = ParameterSet({'rho0': rho0, 'm': 0.9, 'sigma': 0.1, 'n_stim': n_stim, 'wE': 1., 'delta': 0.})
+    return pars, get_modular_layout(n_src, n_tgt, pars)
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_bernoulli_matrix(membership_matrix, n_src, n_tgt, n_stim, rho0):
+    """
+    Connections drawn independently with p_c between neurons that share a cluster and p_0 otherwise: the measured
+    densities match the closed-form expectations.
+    """
+    _, layout = layout_of(n_src, n_tgt, n_stim, rho0)
+    src_member = membership_matrix(layout.src_clusters, n_src)
+    tgt_member = membership_matrix(layout.tgt_intervals, n_tgt)
+    shared = (src_member.astype(int) @ tgt_member.T.astype(int)) > 0
+    p = np.where(shared, layout.p_c, layout.p_0)
+
+    A = np.random.default_rng(5).random((n_src, n_tgt)) < p
+    metrics = connectivity_metrics(sparse_connections(*np.nonzero(A), A.shape), layout)
+
+    def tolerance(p_expected, n_pairs):
+        return 5. * np.sqrt(p_expected * (1. - p_expected) / n_pairs)
+
+    assert abs(metrics.p_c - layout.p_c) < tolerance(layout.p_c, shared.sum())
+    assert abs(metrics.p_0 - layout.p_0) < tolerance(layout.p_0, (~shared).sum())
+
+    for k in range(n_stim):
+        rows, cols = src_member[:, k], tgt_member[:, k]
+        assert abs(metrics.intra_density[k] - layout.p_c) < tolerance(layout.p_c, rows.sum() * cols.sum())
+        # the targets outside interval k may still share another cluster with the sources of cluster k
+        inter = p[np.ix_(rows, ~cols)]
+        assert abs(metrics.inter_density[k] - inter.mean()) < tolerance(inter.mean(), inter.size)
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_dense_and_sparse_input(membership_matrix, n_src, n_tgt, n_stim, rho0):
+    _, layout = layout_of(n_src, n_tgt, n_stim, rho0)
+    A = np.random.default_rng(6).random((n_src, n_tgt)) < 0.05
+    dense = connectivity_metrics(A, layout)
+    sparse = connectivity_metrics(sparse_connections(*np.nonzero(A), A.shape), layout)
+
+    src_member = membership_matrix(layout.src_clusters, n_src)
+    tgt_member = membership_matrix(layout.tgt_intervals, n_tgt)
+    shared = (src_member.astype(int) @ tgt_member.T.astype(int)) > 0
+    for metrics in (dense, sparse):
+        assert metrics.p_c == A[shared].mean()
+        assert metrics.p_0 == A[~shared].mean()
+        for k in range(n_stim):
+            rows, cols = src_member[:, k], tgt_member[:, k]
+            assert metrics.intra_density[k] == A[np.ix_(rows, cols)].mean()
+            assert metrics.inter_density[k] == A[np.ix_(rows, ~cols)].mean()
+
+
+@pytest.mark.parametrize('n_src, n_tgt, n_stim, rho0', CASES)
+def test_generated_matrix(n_src, n_tgt, n_stim, rho0):
+    pars, layout = layout_of(n_src, n_tgt, n_stim, rho0)
+    S, _, _ = generate_modular_connections(n_src, n_tgt, pars, sparse=True, rng=7)
+    metrics = connectivity_metrics(S, layout)
+    assert metrics.p_c == pytest.approx(layout.p_c, rel=0.02)
+    assert metrics.p_0 == pytest.approx(layout.p_0, rel=0.05)
+    np.testing.assert_allclose(metrics.intra_density, layout.p_c, rtol=0.05)
@@ -0,0 +1,35 @@
+"""
+Checks of the resumable result store of the sweep, run with `python -m pytest test_sweep.py`.
+"""
+import sweep
+from sweep import ResultStore, run_sweep
+
+CONFIG = {'threads': 2, 'simtime': 500., 'transient': 100., 'NE': 2000, 'n_rec': 50, 'seed': 3}
+
+
+def test_key_includes_run_parameters():
+    result = dict({'g': 5., 'nu_ratio': 2.}, **CONFIG)
+    assert ResultStore.key(result) == ResultStore.key(dict(result, g=5.0000001))
+    for k in sweep.RUN_KEYS:
+        assert ResultStore.key(result) != ResultStore.key(dict(result, **{k: result[k] + 1}))
+    # results written before all run parameters were stored
+    assert ResultStore.key(result) != ResultStore.key({'g': 5., 'nu_ratio': 2., 'threads': 2, 'simtime': 500.})
+
+
+def test_resume(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / 'sweep.jsonl'))
+    points = [{'g': g, 'nu_ratio': 2.} for g in (4., 5.)]
+    for p in points:
+        store.append(dict(p, rate_e=1., **CONFIG))
+        store.append(dict(p, rate_e=2., **dict(CONFIG, seed=4)))
+    # interrupted write
+    with open(store.path, 'a') as f:
+        f.write('{"g": 6.')
+
+    def run_point(*args):
+        raise AssertionError('finished point simulated again')
+
+    monkeypatch.setattr(sweep, 'run_point', run_point)
+    results = run_sweep(points, store, **CONFIG)
+    assert sorted(r['g'] for r in results) == [4., 5.] and all(r['seed'] == 3 for r in results)
+    assert len(store.load()) == 4